@@ -1,8 +1,11 @@
+import asyncio
 import hashlib
 import json
 import logging
 import os
+import re
 import uuid
+import weakref
 from functools import lru_cache
 from pathlib import Path
 
@@ -17,15 +20,14 @@
     File,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import Optional
 
 from config import (
     SRC_LOG_LEVELS,
     CACHE_DIR,
     WHISPER_MODEL,
-    WHISPER_MODEL_DIR,
-    WHISPER_MODEL_AUTO_UPDATE,
     DEVICE_TYPE,
     AUDIO_STT_OPENAI_API_BASE_URL,
     AUDIO_STT_OPENAI_API_KEY,
@@ -37,10 +39,16 @@
     AUDIO_TTS_ENGINE,
     AUDIO_TTS_MODEL,
     AUDIO_TTS_VOICE,
+    AUDIO_TTS_SPLIT_CONCURRENCY,
     AppConfig,
     CORS_ALLOW_ORIGIN,
 )
 from constants import ERROR_MESSAGES
+from apps.audio.whisper_pool import WhisperModelPool
+from apps.audio.streaming import StreamingTranscriber, SAMPLE_RATE
+from apps.audio.speech_cache import SpeechCache, SpeechUpstreamError
+from apps.socket.main import sio, SESSION_POOL
+from utils.client_pool import client_pool
 from utils.utils import (
     get_current_user,
     get_verified_user,
@@ -65,6 +73,7 @@
 app.state.config.STT_OPENAI_API_KEY = AUDIO_STT_OPENAI_API_KEY
 app.state.config.STT_ENGINE = AUDIO_STT_ENGINE
 app.state.config.STT_MODEL = AUDIO_STT_MODEL
+app.state.config.WHISPER_MODEL = WHISPER_MODEL
 
 app.state.config.TTS_OPENAI_API_BASE_URL = AUDIO_TTS_OPENAI_API_BASE_URL
 app.state.config.TTS_OPENAI_API_KEY = AUDIO_TTS_OPENAI_API_KEY
@@ -77,9 +86,13 @@
 whisper_device_type = DEVICE_TYPE if DEVICE_TYPE and DEVICE_TYPE == "cuda" else "cpu"
 log.info(f"whisper_device_type: {whisper_device_type}")
 
+app.state.WHISPER_MODEL_POOL = WhisperModelPool(whisper_device_type)
+
 SPEECH_CACHE_DIR = Path(CACHE_DIR).joinpath("./audio/speech/")
 SPEECH_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
+app.state.SPEECH_CACHE = SpeechCache(SPEECH_CACHE_DIR)
+
 
 class TTSConfigForm(BaseModel):
     OPENAI_API_BASE_URL: str
@@ -95,6 +108,7 @@ class STTConfigForm(BaseModel):
     OPENAI_API_KEY: str
     ENGINE: str
     MODEL: str
+    WHISPER_MODEL: Optional[str] = None
 
 
 class AudioConfigUpdateForm(BaseModel):
@@ -145,6 +159,7 @@ async def get_audio_config(user=Depends(get_admin_user)):
             "OPENAI_API_KEY": app.state.config.STT_OPENAI_API_KEY,
             "ENGINE": app.state.config.STT_ENGINE,
             "MODEL": app.state.config.STT_MODEL,
+            "WHISPER_MODEL": app.state.config.WHISPER_MODEL,
         },
     }
 
@@ -164,6 +179,9 @@ async def update_audio_config(
     app.state.config.STT_OPENAI_API_KEY = form_data.stt.OPENAI_API_KEY
     app.state.config.STT_ENGINE = form_data.stt.ENGINE
     app.state.config.STT_MODEL = form_data.stt.MODEL
+    if form_data.stt.WHISPER_MODEL:
+        # Picked up by the Whisper pool on the next transcription
+        app.state.config.WHISPER_MODEL = form_data.stt.WHISPER_MODEL
 
     return {
         "tts": {
@@ -179,81 +197,29 @@ async def update_audio_config(
             "OPENAI_API_KEY": app.state.config.STT_OPENAI_API_KEY,
             "ENGINE": app.state.config.STT_ENGINE,
             "MODEL": app.state.config.STT_MODEL,
+            "WHISPER_MODEL": app.state.config.WHISPER_MODEL,
         },
     }
 
 
-@app.post("/speech")
-async def speech(request: Request, user=Depends(get_verified_user)):
-    body = await request.body()
-    name = hashlib.sha256(body).hexdigest()
-
-    file_path = SPEECH_CACHE_DIR.joinpath(f"{name}.mp3")
-    file_body_path = SPEECH_CACHE_DIR.joinpath(f"{name}.json")
-
-    # Check if the file already exists in the cache
-    if file_path.is_file():
-        return FileResponse(file_path)
-
+def get_speech_request(payload: dict):
+    """
+    Returns the payload saved next to the cached audio and a function making
+    the upstream request for it, or None if no TTS engine is configured.
+    """
     if app.state.config.TTS_ENGINE == "openai":
-        headers = {}
-        headers["Authorization"] = f"Bearer {app.state.config.TTS_OPENAI_API_KEY}"
-        headers["Content-Type"] = "application/json"
-
-        try:
-            body = body.decode("utf-8")
-            body = json.loads(body)
-            body["model"] = app.state.config.TTS_MODEL
-            body = json.dumps(body).encode("utf-8")
-        except Exception as e:
-            pass
-
-        r = None
-        try:
-            r = requests.post(
-                url=f"{app.state.config.TTS_OPENAI_API_BASE_URL}/audio/speech",
-                data=body,
-                headers=headers,
-                stream=True,
-            )
-
-            r.raise_for_status()
-
-            # Save the streaming content to a file
-            with open(file_path, "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-
-            with open(file_body_path, "w") as f:
-                json.dump(json.loads(body.decode("utf-8")), f)
-
-            # Return the saved file
-            return FileResponse(file_path)
-
-        except Exception as e:
-            log.exception(e)
-            error_detail = "Open WebUI: Server Connection Error"
-            if r is not None:
-                try:
-                    res = r.json()
-                    if "error" in res:
-                        error_detail = f"External: {res['error']['message']}"
-                except Exception:
-                    error_detail = f"External: {e}"
+        payload = {**payload, "model": app.state.config.TTS_MODEL}
+        url = f"{app.state.config.TTS_OPENAI_API_BASE_URL}/audio/speech"
+        headers = {
+            "Authorization": f"Bearer {app.state.config.TTS_OPENAI_API_KEY}",
+            "Content-Type": "application/json",
+        }
 
-            raise HTTPException(
-                status_code=r.status_code if r != None else 500,
-                detail=error_detail,
-            )
+        return payload, lambda: client_pool.get_session(url).post(
+            url, json=payload, headers=headers
+        )
 
     elif app.state.config.TTS_ENGINE == "elevenlabs":
-        payload = None
-        try:
-            payload = json.loads(body.decode("utf-8"))
-        except Exception as e:
-            log.exception(e)
-            raise HTTPException(status_code=400, detail="Invalid JSON payload")
-
         voice_id = payload.get("voice", "")
 
         if voice_id not in get_available_voices():
@@ -276,38 +242,136 @@ async def speech(request: Request, user=Depends(get_verified_user)):
             "voice_settings": {"stability": 0.5, "similarity_boost": 0.5},
         }
 
-        try:
-            r = requests.post(url, json=data, headers=headers)
+        return payload, lambda: client_pool.get_session(url).post(
+            url, json=data, headers=headers
+        )
+
+    return None
+
 
-            r.raise_for_status()
+def split_sentences(text: str) -> list[str]:
+    sentences = re.split(r"(?<=[.!?])\s+|(?<=[。！？])|\n+", text)
+    return [sentence.strip() for sentence in sentences if sentence.strip()]
 
-            # Save the streaming content to a file
-            with open(file_path, "wb") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
 
-            with open(file_body_path, "w") as f:
-                json.dump(json.loads(body.decode("utf-8")), f)
+async def get_split_speech(payload: dict):
+    """
+    Synthesizes each sentence of the input on its own, up to
+    AUDIO_TTS_SPLIT_CONCURRENCY at a time, and returns their audio in order.
+    Each sentence is cached under its own hash, so sentences that come up
+    again are served from the cache.
+    """
+    semaphore = asyncio.Semaphore(AUDIO_TTS_SPLIT_CONCURRENCY)
+
+    async def synthesize(sentence: str) -> bytes:
+        sentence_payload = {**payload, "input": sentence}
+        name = hashlib.sha256(
+            json.dumps(sentence_payload, sort_keys=True).encode("utf-8")
+        ).hexdigest()
 
-            # Return the saved file
-            return FileResponse(file_path)
+        async with semaphore:
+            metadata, send_request = get_speech_request(sentence_payload)
+            return await app.state.SPEECH_CACHE.read(name, send_request, metadata)
 
+    tasks = [
+        asyncio.create_task(synthesize(sentence))
+        for sentence in split_sentences(payload.get("input", ""))
+    ]
+    if not tasks:
+        raise HTTPException(status_code=400, detail=ERROR_MESSAGES.EMPTY_CONTENT)
+
+    try:
+        # Errors before any audio is sent are reported as a normal error response
+        first = await tasks[0]
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    def cancel():
+        for task in tasks:
+            task.cancel()
+
+    async def stream_content():
+        try:
+            yield first
+            for task in tasks[1:]:
+                yield await task
+        except Exception as e:
+            # Raised so that the connection is aborted rather than the audio
+            # ending early as if it were complete
+            log.exception(e)
+            raise
+        finally:
+            cancel()
+
+    content = stream_content()
+    # Cancels the remaining sentences if the stream is never iterated
+    weakref.finalize(content, cancel)
+    return content
+
+
+@app.post("/speech")
+async def speech(
+    request: Request, split: bool = False, user=Depends(get_verified_user)
+):
+    body = await request.body()
+
+    if split:
+        try:
+            payload = json.loads(body.decode("utf-8"))
         except Exception as e:
             log.exception(e)
-            error_detail = "Open WebUI: Server Connection Error"
-            if r is not None:
-                try:
-                    res = r.json()
-                    if "error" in res:
-                        error_detail = f"External: {res['error']['message']}"
-                except Exception:
-                    error_detail = f"External: {e}"
+            raise HTTPException(status_code=400, detail="Invalid JSON payload")
+
+        # Validates the payload and checks that an engine is configured
+        if get_speech_request(payload) is None:
+            return None
 
+        try:
+            chunks = await get_split_speech(payload)
+        except SpeechUpstreamError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except HTTPException:
+            raise
+        except Exception as e:
+            log.exception(e)
             raise HTTPException(
-                status_code=r.status_code if r != None else 500,
-                detail=error_detail,
+                status_code=500, detail="Open WebUI: Server Connection Error"
             )
 
+        return StreamingResponse(chunks, media_type="audio/mpeg")
+
+    name = hashlib.sha256(body).hexdigest()
+
+    # Check if the file already exists in the cache
+    file_path = app.state.SPEECH_CACHE.get(name)
+    if file_path is not None:
+        return FileResponse(file_path)
+
+    try:
+        payload = json.loads(body.decode("utf-8"))
+    except Exception as e:
+        log.exception(e)
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+
+    speech_request = get_speech_request(payload)
+    if speech_request is None:
+        return None
+    payload, send_request = speech_request
+
+    try:
+        chunks = await app.state.SPEECH_CACHE.stream(name, send_request, payload)
+    except SpeechUpstreamError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except Exception as e:
+        log.exception(e)
+        raise HTTPException(
+            status_code=500, detail="Open WebUI: Server Connection Error"
+        )
+
+    return StreamingResponse(chunks, media_type="audio/mpeg")
+
 
 @app.post("/transcriptions")
 def transcribe(
@@ -340,34 +404,17 @@ def transcribe(
             f.close()
 
         if app.state.config.STT_ENGINE == "":
-            from faster_whisper import WhisperModel
-
-            whisper_kwargs = {
-                "model_size_or_path": WHISPER_MODEL,
-                "device": whisper_device_type,
-                "compute_type": "int8",
-                "download_root": WHISPER_MODEL_DIR,
-                "local_files_only": not WHISPER_MODEL_AUTO_UPDATE,
-            }
-
-            log.debug(f"whisper_kwargs: {whisper_kwargs}")
-
-            try:
-                model = WhisperModel(**whisper_kwargs)
-            except Exception:
-                log.warning(
-                    "WhisperModel initialization failed, attempting download with local_files_only=False"
+            with app.state.WHISPER_MODEL_POOL.acquire(
+                app.state.config.WHISPER_MODEL
+            ) as model:
+                segments, info = model.transcribe(file_path, beam_size=5)
+                log.info(
+                    "Detected language '%s' with probability %f"
+                    % (info.language, info.language_probability)
                 )
-                whisper_kwargs["local_files_only"] = False
-                model = WhisperModel(**whisper_kwargs)
 
-            segments, info = model.transcribe(file_path, beam_size=5)
-            log.info(
-                "Detected language '%s' with probability %f"
-                % (info.language, info.language_probability)
-            )
-
-            transcript = "".join([segment.text for segment in list(segments)])
+                # Segments are decoded lazily, so consume them while holding the model
+                transcript = "".join([segment.text for segment in list(segments)])
 
             data = {"text": transcript.strip()}
 
@@ -439,6 +486,119 @@ def transcribe(
         )
 
 
+@app.post("/transcriptions/stream")
+async def transcribe_stream(
+    request: Request,
+    sample_rate: int = SAMPLE_RATE,
+    language: Optional[str] = None,
+    user=Depends(get_current_user),
+):
+    """
+    Transcribes a streamed request body of raw 16-bit mono PCM audio and
+    responds with NDJSON: a "segment" line for each segment as soon as it is
+    decoded, then a "done" line with the full transcript.
+    """
+    if app.state.config.STT_ENGINE != "":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Streaming transcription is only supported by the local Whisper engine",
+        )
+
+    transcriber = StreamingTranscriber(
+        app.state.WHISPER_MODEL_POOL,
+        app.state.config.WHISPER_MODEL,
+        sample_rate=sample_rate,
+        language=language,
+    )
+
+    async def stream_content():
+        try:
+            async for segment in transcriber.stream(request.stream()):
+                yield json.dumps({"type": "segment", **segment}) + "\n"
+            yield json.dumps({"type": "done", "text": transcriber.text}) + "\n"
+        except Exception as e:
+            log.exception(e)
+            yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(stream_content(), media_type="application/x-ndjson")
+
+
+# Seconds without audio after which a socket transcription is ended
+TRANSCRIPTION_STREAM_IDLE_TIMEOUT = 30
+
+# sid -> queue of audio chunks for the session's socket transcription
+TRANSCRIPTION_STREAMS: dict[str, asyncio.Queue] = {}
+
+
+async def run_socket_transcription(sid: str, transcriber: StreamingTranscriber):
+    queue = TRANSCRIPTION_STREAMS[sid]
+
+    async def chunks():
+        while True:
+            try:
+                chunk = await asyncio.wait_for(
+                    queue.get(), timeout=TRANSCRIPTION_STREAM_IDLE_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                log.info(f"Transcription stream for {sid} timed out")
+                return
+            if chunk is None:
+                return
+            yield chunk
+
+    try:
+        async for segment in transcriber.stream(chunks()):
+            await sio.emit("transcription", {"type": "segment", **segment}, to=sid)
+        await sio.emit(
+            "transcription", {"type": "done", "text": transcriber.text}, to=sid
+        )
+    except Exception as e:
+        log.exception(e)
+        await sio.emit("transcription", {"type": "error", "detail": str(e)}, to=sid)
+    finally:
+        if TRANSCRIPTION_STREAMS.get(sid) is queue:
+            del TRANSCRIPTION_STREAMS[sid]
+
+
+@sio.on("transcription:start")
+async def transcription_start(sid, data=None):
+    data = data or {}
+    if sid not in SESSION_POOL:
+        return {"error": ERROR_MESSAGES.UNAUTHORIZED}
+    if app.state.config.STT_ENGINE != "":
+        return {
+            "error": "Streaming transcription is only supported by the local Whisper engine"
+        }
+
+    previous = TRANSCRIPTION_STREAMS.get(sid)
+    if previous is not None:
+        previous.put_nowait(None)
+
+    TRANSCRIPTION_STREAMS[sid] = asyncio.Queue()
+    transcriber = StreamingTranscriber(
+        app.state.WHISPER_MODEL_POOL,
+        app.state.config.WHISPER_MODEL,
+        sample_rate=int(data.get("sample_rate", SAMPLE_RATE)),
+        language=data.get("language"),
+    )
+    asyncio.create_task(run_socket_transcription(sid, transcriber))
+    return {"status": True}
+
+
+@sio.on("transcription:audio")
+async def transcription_audio(sid, data):
+    queue = TRANSCRIPTION_STREAMS.get(sid)
+    if queue is not None and data:
+        queue.put_nowait(bytes(data))
+
+
+@sio.on("transcription:stop")
+async def transcription_stop(sid, data=None):
+    queue = TRANSCRIPTION_STREAMS.get(sid)
+    if queue is not None:
+        queue.put_nowait(None)
+
+
 def get_available_models() -> list[dict]:
     if app.state.config.TTS_ENGINE == "openai":
         return [{"id": "tts-1"}, {"id": "tts-1-hd"}]
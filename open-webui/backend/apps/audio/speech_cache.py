@@ -0,0 +1,237 @@
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Callable, Optional
+
+from config import SRC_LOG_LEVELS, AUDIO_TTS_CACHE_MAX_SIZE
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["AUDIO"])
+
+
+class SpeechUpstreamError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class SpeechFlight:
+    """
+    A single upstream synthesis shared by every request for the same speech.
+    Chunks are kept as they arrive so late subscribers start from the top.
+    """
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.started = asyncio.Event()
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+    async def _notify(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def push(self, chunk: bytes):
+        self.chunks.append(chunk)
+        await self._notify()
+
+    async def finish(self, error: Optional[Exception] = None):
+        self.error = error
+        self.done = True
+        self.started.set()
+        await self._notify()
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        i = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: i < len(self.chunks) or self.done)
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SpeechCache:
+    """
+    Cache of synthesized speech under `path`, named by the hash of the
+    request. Files are evicted least recently used first once the cache
+    grows over `max_size` bytes (0 means unbounded).
+
+    Concurrent requests for speech that isn't cached yet share one upstream
+    call: its audio is streamed to all of them while being written to the
+    cache.
+    """
+
+    def __init__(self, path: Path, max_size: int = AUDIO_TTS_CACHE_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+        # name -> size in bytes, least recently used first
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+        self.inflight: dict[str, SpeechFlight] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+
+        self._load()
+
+    def _get_file_paths(self, name: str) -> tuple[Path, Path]:
+        return self.path.joinpath(f"{name}.mp3"), self.path.joinpath(f"{name}.json")
+
+    def _get_size(self, name: str) -> int:
+        size = 0
+        for file_path in self._get_file_paths(name):
+            try:
+                size += file_path.stat().st_size
+            except FileNotFoundError:
+                pass
+        return size
+
+    def _load(self):
+        files = []
+        for file_path in self.path.glob("*.mp3"):
+            try:
+                files.append((file_path.stat().st_atime, file_path.stem))
+            except FileNotFoundError:
+                pass
+
+        for _, name in sorted(files):
+            self.entries[name] = self._get_size(name)
+            self.size += self.entries[name]
+        self._evict()
+
+    def _remove(self, name: str):
+        self.size -= self.entries.pop(name, 0)
+        for file_path in self._get_file_paths(name):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        if self.max_size <= 0:
+            return
+        while self.size > self.max_size and len(self.entries) > 1:
+            name = next(iter(self.entries))
+            log.debug(f"Evicting {name} from the speech cache")
+            self._remove(name)
+            self.evictions += 1
+
+    def get(self, name: str) -> Optional[Path]:
+        file_path, _ = self._get_file_paths(name)
+        if name not in self.entries:
+            return None
+        if not file_path.is_file():
+            self._remove(name)
+            return None
+
+        self.entries.move_to_end(name)
+        try:
+            # Keeps the order across restarts
+            os.utime(file_path)
+        except OSError:
+            pass
+        self.hits += 1
+        return file_path
+
+    def _add(self, name: str):
+        self.size -= self.entries.pop(name, 0)
+        self.entries[name] = self._get_size(name)
+        self.size += self.entries[name]
+        self._evict()
+
+    async def _fill(self, name: str, flight: SpeechFlight, request: Callable, metadata):
+        file_path, file_body_path = self._get_file_paths(name)
+        tmp_path = file_path.with_suffix(".tmp")
+        try:
+            async with request() as r:
+                if r.status >= 400:
+                    error_detail = "Open WebUI: Server Connection Error"
+                    try:
+                        res = await r.json(content_type=None)
+                        if "error" in res:
+                            error_detail = f"External: {res['error']['message']}"
+                    except Exception:
+                        error_detail = f"External: {r.status} {r.reason}"
+                    raise SpeechUpstreamError(r.status, error_detail)
+
+                flight.started.set()
+                with open(tmp_path, "wb") as f:
+                    async for chunk in r.content.iter_chunked(8192):
+                        f.write(chunk)
+                        await flight.push(chunk)
+
+            os.replace(tmp_path, file_path)
+            with open(file_body_path, "w") as f:
+                json.dump(metadata, f)
+            self._add(name)
+
+            await flight.finish()
+        except Exception as e:
+            if not isinstance(e, SpeechUpstreamError):
+                log.exception(e)
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            await flight.finish(e)
+        finally:
+            self.inflight.pop(name, None)
+
+    async def stream(
+        self, name: str, request: Callable, metadata
+    ) -> AsyncIterator[bytes]:
+        """
+        Returns the audio stream of the upstream request made by `request()`,
+        joining the one already in flight for `name` if there is one. Raises
+        if the upstream fails before sending any audio.
+        """
+        flight = self.inflight.get(name)
+        if flight is None:
+            self.misses += 1
+            flight = SpeechFlight()
+            self.inflight[name] = flight
+            flight.task = asyncio.create_task(
+                self._fill(name, flight, request, metadata)
+            )
+        else:
+            self.shared += 1
+
+        await flight.started.wait()
+        if flight.error is not None and not flight.chunks:
+            raise flight.error
+        return flight.subscribe()
+
+    async def read(self, name: str, request: Callable, metadata) -> bytes:
+        file_path = self.get(name)
+        if file_path is not None:
+            with open(file_path, "rb") as f:
+                return f.read()
+
+        chunks = await self.stream(name, request, metadata)
+        return b"".join([chunk async for chunk in chunks])
+
+    def get_metrics(self) -> dict:
+        return {
+            "files": len(self.entries),
+            "size": self.size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "evictions": self.evictions,
+            "inflight": len(self.inflight),
+        }
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Optional
+
+import numpy as np
+
+from apps.audio.whisper_pool import WhisperModelPool
+from utils.executor import MeteredExecutor
+from config import (
+    SRC_LOG_LEVELS,
+    WHISPER_MODEL_POOL_SIZE,
+    AUDIO_STT_STREAM_SILENCE_MS,
+    AUDIO_STT_STREAM_MAX_WINDOW,
+    AUDIO_STT_STREAM_VAD_THRESHOLD,
+)
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["AUDIO"])
+
+
+# Whisper works on 16kHz mono audio
+SAMPLE_RATE = 16000
+# 30ms frames
+FRAME_SIZE = 480
+# Frames of silence kept in front of speech so its onset isn't clipped
+PRE_ROLL_FRAMES = 10
+# Characters of the transcript so far passed as the prompt for the next window
+PROMPT_LENGTH = 200
+
+
+# Decodes windows of streaming transcriptions. Each worker holds a pooled
+# model while it decodes, so there is no point in having more of them.
+stt_stream_executor = MeteredExecutor(WHISPER_MODEL_POOL_SIZE, "stt-stream")
+
+
+def pcm16_to_float(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+
+
+def resample(audio: np.ndarray, sample_rate: int) -> np.ndarray:
+    if sample_rate == SAMPLE_RATE or audio.size == 0:
+        return audio
+
+    length = int(audio.size * SAMPLE_RATE / sample_rate)
+    return np.interp(
+        np.linspace(0, audio.size, length, endpoint=False),
+        np.arange(audio.size),
+        audio,
+    ).astype(np.float32)
+
+
+class VADSegmenter:
+    """
+    Energy-based voice activity detection. Leading silence is dropped and a
+    window is closed once speech is followed by `silence_ms` of silence, or
+    when it reaches `max_window` seconds.
+    """
+
+    def __init__(
+        self,
+        silence_ms: int = AUDIO_STT_STREAM_SILENCE_MS,
+        max_window: float = AUDIO_STT_STREAM_MAX_WINDOW,
+        threshold: float = AUDIO_STT_STREAM_VAD_THRESHOLD,
+    ):
+        self.silence_frames = max(silence_ms * SAMPLE_RATE // 1000 // FRAME_SIZE, 1)
+        self.max_frames = max(int(max_window * SAMPLE_RATE / FRAME_SIZE), 1)
+        self.threshold = threshold
+
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.frames: list[np.ndarray] = []
+        self.speech = False
+        self.silent = 0
+        # Samples seen before the start of the current window
+        self.offset = 0
+
+    def _cut(self) -> tuple[float, np.ndarray]:
+        window = (self.offset / SAMPLE_RATE, np.concatenate(self.frames))
+        self.offset += window[1].size
+        self.frames = []
+        self.speech = False
+        self.silent = 0
+        return window
+
+    def feed(self, audio: np.ndarray) -> list[tuple[float, np.ndarray]]:
+        windows = []
+
+        self.pending = np.concatenate([self.pending, audio])
+        count = self.pending.size // FRAME_SIZE
+        for i in range(count):
+            frame = self.pending[i * FRAME_SIZE : (i + 1) * FRAME_SIZE]
+            self.frames.append(frame)
+
+            if np.sqrt(np.mean(frame**2)) >= self.threshold:
+                self.speech = True
+                self.silent = 0
+            else:
+                self.silent += 1
+
+            if not self.speech:
+                if len(self.frames) > PRE_ROLL_FRAMES:
+                    self.frames.pop(0)
+                    self.offset += FRAME_SIZE
+            elif (
+                self.silent >= self.silence_frames
+                or len(self.frames) >= self.max_frames
+            ):
+                windows.append(self._cut())
+
+        self.pending = self.pending[count * FRAME_SIZE :]
+        return windows
+
+    def flush(self) -> list[tuple[float, np.ndarray]]:
+        if self.pending.size:
+            self.frames.append(self.pending)
+            self.pending = np.zeros(0, dtype=np.float32)
+        return [self._cut()] if self.speech and self.frames else []
+
+
+class StreamingTranscriber:
+    """
+    Transcribes 16-bit little-endian mono PCM audio while it is still being
+    received. Audio is cut into windows at pauses in speech and each window is
+    decoded as soon as it closes, so segments come out while the speaker is
+    still talking instead of after the whole recording.
+    """
+
+    def __init__(
+        self,
+        pool: WhisperModelPool,
+        model_name: str,
+        sample_rate: int = SAMPLE_RATE,
+        language: Optional[str] = None,
+    ):
+        self.pool = pool
+        self.model_name = model_name
+        self.sample_rate = sample_rate
+        self.language = language
+
+        self.segmenter = VADSegmenter()
+        # Trailing odd byte of a chunk, completed by the next one
+        self.remainder = b""
+        self.texts: list[str] = []
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.texts)
+
+    def feed(self, data: bytes) -> list[tuple[float, np.ndarray]]:
+        data = self.remainder + data
+        size = len(data) - len(data) % 2
+        self.remainder = data[size:]
+        return self.segmenter.feed(
+            resample(pcm16_to_float(data[:size]), self.sample_rate)
+        )
+
+    def flush(self) -> list[tuple[float, np.ndarray]]:
+        return self.segmenter.flush()
+
+    def decode(
+        self, offset: float, audio: np.ndarray, on_segment: Callable[[dict], None]
+    ):
+        with self.pool.acquire(self.model_name) as model:
+            segments, info = model.transcribe(
+                audio,
+                beam_size=5,
+                language=self.language,
+                initial_prompt=self.text[-PROMPT_LENGTH:] or None,
+            )
+            if self.language is None:
+                log.info(
+                    "Detected language '%s' with probability %f"
+                    % (info.language, info.language_probability)
+                )
+                # Later windows are too short to detect the language reliably
+                self.language = info.language
+
+            for segment in segments:
+                text = segment.text.strip()
+                if not text:
+                    continue
+
+                self.texts.append(text)
+                on_segment(
+                    {
+                        "start": round(offset + segment.start, 2),
+                        "end": round(offset + segment.end, 2),
+                        "text": text,
+                    }
+                )
+
+    async def stream(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+        """
+        Reads audio chunks and yields segments as they are decoded. Windows
+        are decoded one at a time, in order, while more audio is read.
+        """
+        loop = asyncio.get_running_loop()
+        windows: asyncio.Queue = asyncio.Queue()
+        output: asyncio.Queue = asyncio.Queue()
+
+        async def read():
+            try:
+                async for chunk in chunks:
+                    for window in self.feed(chunk):
+                        windows.put_nowait(window)
+                for window in self.flush():
+                    windows.put_nowait(window)
+            finally:
+                windows.put_nowait(None)
+
+        def on_segment(segment: dict):
+            loop.call_soon_threadsafe(output.put_nowait, segment)
+
+        async def decode():
+            try:
+                while (window := await windows.get()) is not None:
+                    await stt_stream_executor.run(self.decode, *window, on_segment)
+                output.put_nowait(None)
+            except Exception as e:
+                output.put_nowait(e)
+
+        reader = asyncio.create_task(read())
+        decoder = asyncio.create_task(decode())
+        try:
+            while (item := await output.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+            await reader
+        finally:
+            reader.cancel()
+            decoder.cancel()
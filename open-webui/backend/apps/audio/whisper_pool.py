@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Optional
+
+from config import (
+    SRC_LOG_LEVELS,
+    WHISPER_MODEL_DIR,
+    WHISPER_MODEL_AUTO_UPDATE,
+    WHISPER_MODEL_POOL_SIZE,
+    WHISPER_MODEL_IDLE_TIMEOUT,
+)
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["AUDIO"])
+
+
+class WhisperModelPool:
+    """
+    Keeps up to `pool_size` faster-whisper models resident so transcriptions
+    don't pay a model load each time, and concurrent requests each get their
+    own instance.
+
+    When the requested model name changes, new requests get instances of the
+    new model while instances of the old one are dropped as their requests
+    finish. Models left idle for `idle_timeout` seconds are unloaded.
+    """
+
+    def __init__(
+        self,
+        device: str,
+        pool_size: int = WHISPER_MODEL_POOL_SIZE,
+        idle_timeout: int = WHISPER_MODEL_IDLE_TIMEOUT,
+    ):
+        self.device = device
+        self.pool_size = max(pool_size, 1)
+        self.idle_timeout = idle_timeout
+
+        self.model_name: Optional[str] = None
+        # Bumped on every model change so instances of older models are dropped
+        self.generation = 0
+        self.idle: list[Any] = []
+        self.instances = 0
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+        self.loads = 0
+        self.condition = threading.Condition()
+        self.reaper: Optional[threading.Thread] = None
+
+    def _load(self, model_name: str):
+        from faster_whisper import WhisperModel
+
+        whisper_kwargs = {
+            "model_size_or_path": model_name,
+            "device": self.device,
+            "compute_type": "int8",
+            "download_root": WHISPER_MODEL_DIR,
+            "local_files_only": not WHISPER_MODEL_AUTO_UPDATE,
+        }
+
+        log.debug(f"whisper_kwargs: {whisper_kwargs}")
+
+        try:
+            return WhisperModel(**whisper_kwargs)
+        except Exception:
+            log.warning(
+                "WhisperModel initialization failed, attempting download with local_files_only=False"
+            )
+            whisper_kwargs["local_files_only"] = False
+            return WhisperModel(**whisper_kwargs)
+
+    def _start_reaper(self):
+        if self.idle_timeout > 0 and self.reaper is None:
+            self.reaper = threading.Thread(
+                target=self._reap, name="whisper-reaper", daemon=True
+            )
+            self.reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(min(self.idle_timeout, 60))
+            with self.condition:
+                if (
+                    self.idle
+                    and self.in_use == 0
+                    and time.monotonic() - self.last_used > self.idle_timeout
+                ):
+                    log.info(
+                        f"Unloading {len(self.idle)} idle Whisper model(s) ({self.model_name})"
+                    )
+                    self.instances -= len(self.idle)
+                    self.idle = []
+
+    @contextmanager
+    def acquire(self, model_name: str):
+        with self.condition:
+            self._start_reaper()
+
+            while True:
+                if model_name != self.model_name:
+                    if self.model_name is not None:
+                        log.info(
+                            f"Switching Whisper model {self.model_name} -> {model_name}"
+                        )
+                    self.model_name = model_name
+                    self.generation += 1
+                    self.idle = []
+                    self.instances = 0
+                    self.condition.notify_all()
+
+                if self.idle or self.instances < self.pool_size:
+                    break
+                self.condition.wait()
+
+            generation = self.generation
+            model = self.idle.pop() if self.idle else None
+            if model is None:
+                self.instances += 1
+            self.in_use += 1
+
+        try:
+            if model is None:
+                try:
+                    model = self._load(model_name)
+                    self.loads += 1
+                except Exception:
+                    with self.condition:
+                        if generation == self.generation:
+                            self.instances -= 1
+                        self.in_use -= 1
+                        self.condition.notify()
+                    raise
+
+            yield model
+        finally:
+            if model is not None:
+                with self.condition:
+                    self.in_use -= 1
+                    self.last_used = time.monotonic()
+                    if generation == self.generation:
+                        self.idle.append(model)
+                    self.condition.notify()
+
+    def get_metrics(self) -> dict:
+        with self.condition:
+            return {
+                "model": self.model_name,
+                "pool_size": self.pool_size,
+                "loaded": self.instances,
+                "idle": len(self.idle),
+                "in_use": self.in_use,
+                "loads": self.loads,
+            }
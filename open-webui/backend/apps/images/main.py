@@ -8,6 +8,7 @@
 from typing import Optional
 from pydantic import BaseModel
 from pathlib import Path
+import asyncio
 import mimetypes
 import uuid
 import base64
@@ -20,12 +21,15 @@
     get_verified_user,
     get_admin_user,
 )
+from utils.client_pool import client_pool
+from utils.executor import MeteredExecutor
 
 from apps.images.utils.comfyui import (
     ComfyUIWorkflow,
     ComfyUIGenerateImageForm,
     comfyui_generate_image,
 )
+from apps.images.utils.scheduler import ImageGenerationQueue
 
 from constants import ERROR_MESSAGES
 from config import (
@@ -43,6 +47,11 @@
     IMAGE_GENERATION_MODEL,
     IMAGE_SIZE,
     IMAGE_STEPS,
+    IMAGE_PROCESSING_WORKERS,
+    IMAGE_THUMBNAIL_SIZE,
+    IMAGE_GENERATION_CONCURRENCY,
+    IMAGE_GENERATION_OPENAI_CONCURRENCY,
+    IMAGE_GENERATION_MAX_BATCH_SIZE,
     CORS_ALLOW_ORIGIN,
     AppConfig,
 )
@@ -53,6 +62,9 @@
 IMAGE_CACHE_DIR = Path(CACHE_DIR).joinpath("./image/generations/")
 IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
+# Decodes generated images and creates their thumbnails off the event loop
+image_executor = MeteredExecutor(IMAGE_PROCESSING_WORKERS, "images")
+
 app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
@@ -200,21 +212,32 @@ async def verify_url(user=Depends(get_admin_user)):
         return True
 
 
-def set_image_model(model: str):
+async def request_json(method: str, url: str, **kwargs):
+    session = client_pool.get_session(url)
+    async with session.request(method, url, **kwargs) as r:
+        try:
+            res = await r.json(content_type=None)
+        except Exception:
+            r.raise_for_status()
+            raise
+
+        if r.status >= 400:
+            if isinstance(res, dict) and "error" in res:
+                raise Exception(res["error"]["message"])
+            r.raise_for_status()
+        return res
+
+
+async def set_image_model(model: str):
     app.state.config.MODEL = model
     if app.state.config.ENGINE in ["", "automatic1111"]:
+        url = f"{app.state.config.AUTOMATIC1111_BASE_URL}/sdapi/v1/options"
         api_auth = get_automatic1111_api_auth()
-        r = requests.get(
-            url=f"{app.state.config.AUTOMATIC1111_BASE_URL}/sdapi/v1/options",
-            headers={"authorization": api_auth},
-        )
-        options = r.json()
+        options = await request_json("GET", url, headers={"authorization": api_auth})
         if model != options["sd_model_checkpoint"]:
             options["sd_model_checkpoint"] = model
-            r = requests.post(
-                url=f"{app.state.config.AUTOMATIC1111_BASE_URL}/sdapi/v1/options",
-                json=options,
-                headers={"authorization": api_auth},
+            await request_json(
+                "POST", url, json=options, headers={"authorization": api_auth}
             )
     return app.state.config.MODEL
 
@@ -358,6 +381,34 @@ class GenerateImageForm(BaseModel):
     negative_prompt: Optional[str] = None
 
 
+# Base64 characters decoded at a time, a multiple of 4
+B64_CHUNK_SIZE = 4 * 64 * 1024
+
+
+def write_b64_to_file(encoded: str, file_path: Path):
+    # Decodes a slice at a time instead of holding the whole decoded image
+    with open(file_path, "wb") as f:
+        for i in range(0, len(encoded), B64_CHUNK_SIZE):
+            f.write(base64.b64decode(encoded[i : i + B64_CHUNK_SIZE]))
+
+
+def create_thumbnail(image_filename: str) -> Optional[str]:
+    """Saves a size-reduced JPEG of a cached image for rendering chat history."""
+    from PIL import Image
+
+    try:
+        thumbnail_filename = f"{Path(image_filename).stem}_thumbnail.jpg"
+        with Image.open(IMAGE_CACHE_DIR.joinpath(image_filename)) as image:
+            image.thumbnail((IMAGE_THUMBNAIL_SIZE, IMAGE_THUMBNAIL_SIZE))
+            image.convert("RGB").save(
+                IMAGE_CACHE_DIR.joinpath(thumbnail_filename), "JPEG", quality=85
+            )
+        return thumbnail_filename
+    except Exception as e:
+        log.exception(f"Error creating thumbnail: {e}")
+        return None
+
+
 def save_b64_image(b64_str):
     try:
         image_id = str(uuid.uuid4())
@@ -365,37 +416,37 @@ def save_b64_image(b64_str):
         if "," in b64_str:
             header, encoded = b64_str.split(",", 1)
             mime_type = header.split(";")[0]
-
-            img_data = base64.b64decode(encoded)
             image_format = mimetypes.guess_extension(mime_type)
-
             image_filename = f"{image_id}{image_format}"
-            file_path = IMAGE_CACHE_DIR / f"{image_filename}"
-            with open(file_path, "wb") as f:
-                f.write(img_data)
-            return image_filename
         else:
+            encoded = b64_str
             image_filename = f"{image_id}.png"
-            file_path = IMAGE_CACHE_DIR.joinpath(image_filename)
-
-            img_data = base64.b64decode(b64_str)
 
-            # Write the image data to a file
-            with open(file_path, "wb") as f:
-                f.write(img_data)
-            return image_filename
+        # Write the image data to a file
+        write_b64_to_file(encoded, IMAGE_CACHE_DIR.joinpath(image_filename))
+        return image_filename
 
     except Exception as e:
         log.exception(f"Error saving image: {e}")
         return None
 
 
-def save_url_image(url):
+def save_b64_image_with_thumbnail(b64_str) -> tuple[Optional[str], Optional[str]]:
+    image_filename = save_b64_image(b64_str)
+    if image_filename is None:
+        return None, None
+    return image_filename, create_thumbnail(image_filename)
+
+
+async def save_url_image(url) -> tuple[Optional[str], Optional[str]]:
     image_id = str(uuid.uuid4())
     try:
-        r = requests.get(url)
-        r.raise_for_status()
-        if r.headers["content-type"].split("/")[0] == "image":
+        session = client_pool.get_session(url)
+        async with session.get(url) as r:
+            r.raise_for_status()
+            if r.headers["content-type"].split("/")[0] != "image":
+                log.error(f"Url does not point to an image.")
+                return None, None
 
             mime_type = r.headers["content-type"]
             image_format = mimetypes.guess_extension(mime_type)
@@ -407,157 +458,197 @@ def save_url_image(url):
 
             file_path = IMAGE_CACHE_DIR.joinpath(f"{image_filename}")
             with open(file_path, "wb") as image_file:
-                for chunk in r.iter_content(chunk_size=8192):
+                async for chunk in r.content.iter_chunked(8192):
                     image_file.write(chunk)
-            return image_filename
-        else:
-            log.error(f"Url does not point to an image.")
-            return None
+
+        return image_filename, await image_executor.run(
+            create_thumbnail, image_filename
+        )
 
     except Exception as e:
         log.exception(f"Error saving image: {e}")
-        return None
+        return None, None
 
 
-@app.post("/generations")
-async def image_generations(
-    form_data: GenerateImageForm,
-    user=Depends(get_verified_user),
-):
-    width, height = tuple(map(int, app.state.config.IMAGE_SIZE.split("x")))
+async def save_b64_images(b64_strs: list[str]) -> list[tuple]:
+    return await asyncio.gather(
+        *[
+            image_executor.run(save_b64_image_with_thumbnail, b64_str)
+            for b64_str in b64_strs
+        ]
+    )
 
-    r = None
-    try:
-        if app.state.config.ENGINE == "openai":
 
-            headers = {}
-            headers["Authorization"] = f"Bearer {app.state.config.OPENAI_API_KEY}"
-            headers["Content-Type"] = "application/json"
+def get_image_response(image_filename, thumbnail_filename, metadata: dict) -> dict:
+    file_body_path = IMAGE_CACHE_DIR.joinpath(f"{image_filename}.json")
+    with open(file_body_path, "w") as f:
+        json.dump(metadata, f)
 
-            data = {
-                "model": (
-                    app.state.config.MODEL
-                    if app.state.config.MODEL != ""
-                    else "dall-e-2"
-                ),
-                "prompt": form_data.prompt,
-                "n": form_data.n,
-                "size": (
-                    form_data.size if form_data.size else app.state.config.IMAGE_SIZE
-                ),
-                "response_format": "b64_json",
-            }
+    image = {"url": f"/cache/image/generations/{image_filename}"}
+    if thumbnail_filename:
+        image["thumbnail_url"] = f"/cache/image/generations/{thumbnail_filename}"
+    return image
 
-            r = requests.post(
-                url=f"{app.state.config.OPENAI_API_BASE_URL}/images/generations",
-                json=data,
-                headers=headers,
-            )
-
-            r.raise_for_status()
-            res = r.json()
 
-            images = []
+async def generate_images(form_data: GenerateImageForm) -> list[dict]:
+    width, height = tuple(map(int, app.state.config.IMAGE_SIZE.split("x")))
 
-            for image in res["data"]:
-                image_filename = save_b64_image(image["b64_json"])
-                images.append({"url": f"/cache/image/generations/{image_filename}"})
-                file_body_path = IMAGE_CACHE_DIR.joinpath(f"{image_filename}.json")
+    if app.state.config.ENGINE == "openai":
 
-                with open(file_body_path, "w") as f:
-                    json.dump(data, f)
+        headers = {}
+        headers["Authorization"] = f"Bearer {app.state.config.OPENAI_API_KEY}"
+        headers["Content-Type"] = "application/json"
+
+        data = {
+            "model": (
+                app.state.config.MODEL if app.state.config.MODEL != "" else "dall-e-2"
+            ),
+            "prompt": form_data.prompt,
+            "n": form_data.n,
+            "size": (form_data.size if form_data.size else app.state.config.IMAGE_SIZE),
+            "response_format": "b64_json",
+        }
+
+        res = await request_json(
+            "POST",
+            f"{app.state.config.OPENAI_API_BASE_URL}/images/generations",
+            json=data,
+            headers=headers,
+        )
 
-            return images
+        saved = await save_b64_images([image["b64_json"] for image in res["data"]])
+        return [
+            get_image_response(image_filename, thumbnail_filename, data)
+            for image_filename, thumbnail_filename in saved
+        ]
 
-        elif app.state.config.ENGINE == "comfyui":
-            data = {
-                "prompt": form_data.prompt,
-                "width": width,
-                "height": height,
-                "n": form_data.n,
+    elif app.state.config.ENGINE == "comfyui":
+        data = {
+            "prompt": form_data.prompt,
+            "width": width,
+            "height": height,
+            "n": form_data.n,
+        }
+
+        if app.state.config.IMAGE_STEPS is not None:
+            data["steps"] = app.state.config.IMAGE_STEPS
+
+        if form_data.negative_prompt is not None:
+            data["negative_prompt"] = form_data.negative_prompt
+
+        form_data = ComfyUIGenerateImageForm(
+            **{
+                "workflow": ComfyUIWorkflow(
+                    **{
+                        "workflow": app.state.config.COMFYUI_WORKFLOW,
+                        "nodes": app.state.config.COMFYUI_WORKFLOW_NODES,
+                    }
+                ),
+                **data,
             }
+        )
+        res = await comfyui_generate_image(
+            app.state.config.MODEL,
+            form_data,
+            app.state.config.COMFYUI_BASE_URL,
+        )
+        log.debug(f"res: {res}")
 
-            if app.state.config.IMAGE_STEPS is not None:
-                data["steps"] = app.state.config.IMAGE_STEPS
-
-            if form_data.negative_prompt is not None:
-                data["negative_prompt"] = form_data.negative_prompt
-
-            form_data = ComfyUIGenerateImageForm(
-                **{
-                    "workflow": ComfyUIWorkflow(
-                        **{
-                            "workflow": app.state.config.COMFYUI_WORKFLOW,
-                            "nodes": app.state.config.COMFYUI_WORKFLOW_NODES,
-                        }
-                    ),
-                    **data,
-                }
-            )
-            res = await comfyui_generate_image(
-                app.state.config.MODEL,
-                form_data,
-                user.id,
-                app.state.config.COMFYUI_BASE_URL,
+        # Download all images of the batch at once
+        saved = await asyncio.gather(
+            *[save_url_image(image["url"]) for image in res["data"]]
+        )
+        images = [
+            get_image_response(
+                image_filename,
+                thumbnail_filename,
+                form_data.model_dump(exclude_none=True),
             )
-            log.debug(f"res: {res}")
+            for image_filename, thumbnail_filename in saved
+        ]
 
-            images = []
+        log.debug(f"images: {images}")
+        return images
+    elif app.state.config.ENGINE == "automatic1111" or app.state.config.ENGINE == "":
+        if form_data.model:
+            await set_image_model(form_data.model)
+
+        data = {
+            "prompt": form_data.prompt,
+            "batch_size": form_data.n,
+            "width": width,
+            "height": height,
+        }
+
+        if app.state.config.IMAGE_STEPS is not None:
+            data["steps"] = app.state.config.IMAGE_STEPS
+
+        if form_data.negative_prompt is not None:
+            data["negative_prompt"] = form_data.negative_prompt
+
+        res = await request_json(
+            "POST",
+            f"{app.state.config.AUTOMATIC1111_BASE_URL}/sdapi/v1/txt2img",
+            json=data,
+            headers={"authorization": get_automatic1111_api_auth()},
+        )
+        log.debug(f"res: {res}")
 
-            for image in res["data"]:
-                image_filename = save_url_image(image["url"])
-                images.append({"url": f"/cache/image/generations/{image_filename}"})
-                file_body_path = IMAGE_CACHE_DIR.joinpath(f"{image_filename}.json")
+        saved = await save_b64_images(res["images"])
+        return [
+            get_image_response(
+                image_filename, thumbnail_filename, {**data, "info": res["info"]}
+            )
+            for image_filename, thumbnail_filename in saved
+        ]
 
-                with open(file_body_path, "w") as f:
-                    json.dump(form_data.model_dump(exclude_none=True), f)
 
-            log.debug(f"images: {images}")
-            return images
-        elif (
-            app.state.config.ENGINE == "automatic1111" or app.state.config.ENGINE == ""
-        ):
-            if form_data.model:
-                set_image_model(form_data.model)
-
-            data = {
-                "prompt": form_data.prompt,
-                "batch_size": form_data.n,
-                "width": width,
-                "height": height,
-            }
-
-            if app.state.config.IMAGE_STEPS is not None:
-                data["steps"] = app.state.config.IMAGE_STEPS
+def get_image_backend() -> str:
+    if app.state.config.ENGINE == "openai":
+        return f"openai:{app.state.config.OPENAI_API_BASE_URL}"
+    elif app.state.config.ENGINE == "comfyui":
+        return f"comfyui:{app.state.config.COMFYUI_BASE_URL}"
+    else:
+        return f"automatic1111:{app.state.config.AUTOMATIC1111_BASE_URL}"
 
-            if form_data.negative_prompt is not None:
-                data["negative_prompt"] = form_data.negative_prompt
 
-            r = requests.post(
-                url=f"{app.state.config.AUTOMATIC1111_BASE_URL}/sdapi/v1/txt2img",
-                json=data,
-                headers={"authorization": get_automatic1111_api_auth()},
-            )
+def get_image_backend_concurrency(backend: str) -> int:
+    if backend.startswith("openai:"):
+        return IMAGE_GENERATION_OPENAI_CONCURRENCY
+    return IMAGE_GENERATION_CONCURRENCY
 
-            res = r.json()
-            log.debug(f"res: {res}")
 
-            images = []
+def get_image_backend_max_batch_size(backend: str) -> int:
+    # Some OpenAI models (e.g. dall-e-3) only generate one image per call
+    if backend.startswith("openai:"):
+        return 1
+    return IMAGE_GENERATION_MAX_BATCH_SIZE
 
-            for image in res["images"]:
-                image_filename = save_b64_image(image)
-                images.append({"url": f"/cache/image/generations/{image_filename}"})
-                file_body_path = IMAGE_CACHE_DIR.joinpath(f"{image_filename}.json")
 
-                with open(file_body_path, "w") as f:
-                    json.dump({**data, "info": res["info"]}, f)
+app.state.IMAGE_GENERATION_QUEUE = ImageGenerationQueue(
+    get_image_backend_concurrency, get_image_backend_max_batch_size
+)
 
-            return images
 
+@app.post("/generations")
+async def image_generations(
+    form_data: GenerateImageForm,
+    user=Depends(get_verified_user),
+):
+    try:
+        return await app.state.IMAGE_GENERATION_QUEUE.submit(
+            get_image_backend(),
+            form_data.model or app.state.config.MODEL,
+            form_data.model_dump(exclude={"model", "n"}),
+            form_data.n,
+            lambda n: generate_images(form_data.model_copy(update={"n": n})),
+            user_id=user.id,
+        )
     except Exception as e:
-        error = e
-        if r != None:
-            data = r.json()
-            if "error" in data:
-                error = data["error"]["message"]
-        raise HTTPException(status_code=400, detail=ERROR_MESSAGES.DEFAULT(error))
+        log.exception(e)
+        raise HTTPException(status_code=400, detail=ERROR_MESSAGES.DEFAULT(e))
+
+
+@app.get("/generations/queue")
+async def get_image_generation_queue(user=Depends(get_verified_user)):
+    return app.state.IMAGE_GENERATION_QUEUE.get_positions(user.id)
@@ -1,11 +1,14 @@
 import asyncio
-import websocket  # NOTE: websocket-client (https://github.com/websocket-client/websocket-client)
 import json
-import urllib.request
 import urllib.parse
 import random
 import logging
+import uuid
+from collections import OrderedDict
 
+import aiohttp
+
+from utils.client_pool import client_pool
 from config import SRC_LOG_LEVELS
 
 log = logging.getLogger(__name__)
@@ -16,22 +19,6 @@
 from typing import Optional
 
 
-def queue_prompt(prompt, client_id, base_url):
-    log.info("queue_prompt")
-    p = {"prompt": prompt, "client_id": client_id}
-    data = json.dumps(p).encode("utf-8")
-    req = urllib.request.Request(f"{base_url}/prompt", data=data)
-    return json.loads(urllib.request.urlopen(req).read())
-
-
-def get_image(filename, subfolder, folder_type, base_url):
-    log.info("get_image")
-    data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    url_values = urllib.parse.urlencode(data)
-    with urllib.request.urlopen(f"{base_url}/view?{url_values}") as response:
-        return response.read()
-
-
 def get_image_url(filename, subfolder, folder_type, base_url):
     log.info("get_image")
     data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
@@ -39,37 +26,158 @@ def get_image_url(filename, subfolder, folder_type, base_url):
     return f"{base_url}/view?{url_values}"
 
 
-def get_history(prompt_id, base_url):
-    log.info("get_history")
-    with urllib.request.urlopen(f"{base_url}/history/{prompt_id}") as response:
-        return json.loads(response.read())
+class ComfyUIConnectionLost(Exception):
+    pass
 
 
-def get_images(ws, prompt, client_id, base_url):
-    prompt_id = queue_prompt(prompt, client_id, base_url)["prompt_id"]
-    output_images = []
-    while True:
-        out = ws.recv()
-        if isinstance(out, str):
-            message = json.loads(out)
-            if message["type"] == "executing":
-                data = message["data"]
-                if data["node"] is None and data["prompt_id"] == prompt_id:
-                    break  # Execution is done
-        else:
-            continue  # previews are binary data
+class ComfyUIClient:
+    """
+    Keeps one websocket open to a ComfyUI server and shares it between all
+    generations. Prompts are queued under this client's id, so ComfyUI sends
+    their progress on this websocket, and the completion of each prompt is
+    routed to whoever is waiting on its prompt_id.
+    """
+
+    # Prompts remembered after completing, in case they finish before their
+    # waiter is registered
+    MAX_COMPLETED = 256
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.client_id = str(uuid.uuid4())
+
+        self.ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self.listener: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+        self.waiters: dict[str, asyncio.Future] = {}
+        self.completed: OrderedDict[str, Optional[str]] = OrderedDict()
+
+    async def connect(self):
+        async with self.lock:
+            if self.ws is not None and not self.ws.closed:
+                return
+
+            ws_url = self.base_url.replace("http://", "ws://").replace(
+                "https://", "wss://"
+            )
+            session = client_pool.get_session(self.base_url)
+            self.ws = await session.ws_connect(
+                f"{ws_url}/ws?clientId={self.client_id}", heartbeat=30
+            )
+            log.info(f"WebSocket connection established with {self.base_url}.")
+            self.listener = asyncio.create_task(self._listen(self.ws))
+
+    def _complete(self, prompt_id: str, error: Optional[str] = None):
+        self.completed[prompt_id] = error
+        while len(self.completed) > self.MAX_COMPLETED:
+            self.completed.popitem(last=False)
+
+        future = self.waiters.pop(prompt_id, None)
+        if future is not None and not future.done():
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(Exception(error))
+
+    async def _listen(self, ws: aiohttp.ClientWebSocketResponse):
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue  # previews are binary data
 
-    history = get_history(prompt_id, base_url)[prompt_id]
-    for o in history["outputs"]:
+                message = json.loads(msg.data)
+                data = message.get("data", {})
+                if message["type"] == "executing":
+                    if data.get("node") is None and data.get("prompt_id"):
+                        self._complete(data["prompt_id"])  # Execution is done
+                elif message["type"] == "execution_error":
+                    self._complete(
+                        data.get("prompt_id"),
+                        data.get("exception_message", "ComfyUI execution error"),
+                    )
+        except Exception as e:
+            log.exception(f"Error while receiving ComfyUI events: {e}")
+        finally:
+            log.info(f"WebSocket connection with {self.base_url} closed.")
+            waiters, self.waiters = self.waiters, {}
+            for future in waiters.values():
+                if not future.done():
+                    future.set_exception(ComfyUIConnectionLost())
+
+    async def queue_prompt(self, prompt: dict) -> str:
+        log.info("queue_prompt")
+        session = client_pool.get_session(self.base_url)
+        async with session.post(
+            f"{self.base_url}/prompt",
+            json={"prompt": prompt, "client_id": self.client_id},
+        ) as r:
+            r.raise_for_status()
+            res = await r.json()
+        return res["prompt_id"]
+
+    async def get_history(self, prompt_id: str) -> dict:
+        log.info("get_history")
+        session = client_pool.get_session(self.base_url)
+        async with session.get(f"{self.base_url}/history/{prompt_id}") as r:
+            r.raise_for_status()
+            return await r.json()
+
+    async def wait_for_prompt(self, prompt_id: str):
+        while True:
+            if prompt_id in self.completed:
+                error = self.completed[prompt_id]
+                if error is not None:
+                    raise Exception(error)
+                return
+
+            future = self.waiters.get(prompt_id)
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                self.waiters[prompt_id] = future
+
+            try:
+                return await future
+            except ComfyUIConnectionLost:
+                # The prompt may have finished while we were disconnected
+                await self.connect()
+                if prompt_id in await self.get_history(prompt_id):
+                    return
+
+    async def get_images(self, prompt: dict) -> dict:
+        await self.connect()
+        prompt_id = await self.queue_prompt(prompt)
+        await self.wait_for_prompt(prompt_id)
+
+        output_images = []
+        history = (await self.get_history(prompt_id))[prompt_id]
         for node_id in history["outputs"]:
             node_output = history["outputs"][node_id]
             if "images" in node_output:
                 for image in node_output["images"]:
                     url = get_image_url(
-                        image["filename"], image["subfolder"], image["type"], base_url
+                        image["filename"],
+                        image["subfolder"],
+                        image["type"],
+                        self.base_url,
                     )
                     output_images.append({"url": url})
-    return {"data": output_images}
+        return {"data": output_images}
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+
+COMFYUI_CLIENTS: dict[str, ComfyUIClient] = {}
+
+
+def get_comfyui_client(base_url: str) -> ComfyUIClient:
+    client = COMFYUI_CLIENTS.get(base_url)
+    if client is None:
+        client = ComfyUIClient(base_url)
+        COMFYUI_CLIENTS[base_url] = client
+    return client
 
 
 class ComfyUINodeInput(BaseModel):
@@ -98,9 +206,8 @@ class ComfyUIGenerateImageForm(BaseModel):
 
 
 async def comfyui_generate_image(
-    model: str, payload: ComfyUIGenerateImageForm, client_id, base_url
+    model: str, payload: ComfyUIGenerateImageForm, base_url
 ):
-    ws_url = base_url.replace("http://", "ws://").replace("https://", "wss://")
     workflow = json.loads(payload.workflow.workflow)
 
     for node in payload.workflow.nodes:
@@ -139,21 +246,11 @@ async def comfyui_generate_image(
                 workflow[node_id]["inputs"][node.key] = node.value
 
     try:
-        ws = websocket.WebSocket()
-        ws.connect(f"{ws_url}/ws?clientId={client_id}")
-        log.info("WebSocket connection established.")
-    except Exception as e:
-        log.exception(f"Failed to connect to WebSocket server: {e}")
-        return None
-
-    try:
-        log.info("Sending workflow to WebSocket server.")
+        log.info("Sending workflow to ComfyUI.")
         log.info(f"Workflow: {workflow}")
-        images = await asyncio.to_thread(get_images, ws, workflow, client_id, base_url)
+        images = await get_comfyui_client(base_url).get_images(workflow)
     except Exception as e:
         log.exception(f"Error while receiving images: {e}")
         images = None
 
-    ws.close()
-
     return images
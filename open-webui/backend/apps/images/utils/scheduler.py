@@ -0,0 +1,227 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from apps.socket.main import emit_to_user
+from config import SRC_LOG_LEVELS
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["IMAGES"])
+
+
+class ImageJob:
+    def __init__(
+        self,
+        backend: str,
+        model: Optional[str],
+        params: dict,
+        n: int,
+        run: Callable[[int], Awaitable[list]],
+        user_id: Optional[str] = None,
+    ):
+        self.id = str(uuid.uuid4())
+        self.backend = backend
+        self.model = model
+        self.params = params
+        # Jobs with the same batch key can be generated in one call
+        self.batch_key = json.dumps([model, params], sort_keys=True, default=str)
+        self.n = n
+        self.run = run
+        self.user_id = user_id
+
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.created_at = time.time()
+        self.skipped = 0
+        self.position: Optional[int] = None
+
+
+class ImageGenerationQueue:
+    """
+    Admits image generation requests to each backend (engine and URL) up to
+    its concurrency limit and queues the rest.
+
+    Queued jobs for the model the backend has loaded go first, so the
+    checkpoint isn't switched back and forth, and a backend only switches
+    models once nothing is running on it. A job is never passed over more
+    than MAX_SKIPS times. Queued jobs with identical parameters are merged
+    into one call of up to `get_max_batch_size(backend)` images, so backends
+    that can't generate several images at once must return 1.
+
+    Users are sent their jobs' queue positions over the socket as they change.
+    """
+
+    MAX_SKIPS = 3
+
+    def __init__(
+        self,
+        get_concurrency: Callable[[str], int],
+        get_max_batch_size: Callable[[str], int],
+    ):
+        self.get_concurrency = get_concurrency
+        self.get_max_batch_size = get_max_batch_size
+
+        self.pending: list[ImageJob] = []
+        # backend -> {"running": int, "model": last model dispatched}
+        self.backends: dict[str, dict] = {}
+        self.tasks: set[asyncio.Task] = set()
+
+        self.completed = 0
+        self.batched = 0
+        self.model_switches = 0
+
+    def _get_backend(self, backend: str) -> dict:
+        return self.backends.setdefault(backend, {"running": 0, "model": None})
+
+    def _pick(self, backend: str) -> Optional[ImageJob]:
+        jobs = [job for job in self.pending if job.backend == backend]
+        if not jobs:
+            return None
+
+        state = self._get_backend(backend)
+        if state["running"] >= max(self.get_concurrency(backend), 1):
+            return None
+
+        oldest = jobs[0]
+        same_model = next((job for job in jobs if job.model == state["model"]), None)
+        if (
+            same_model is not None
+            and same_model is not oldest
+            and oldest.skipped < self.MAX_SKIPS
+        ):
+            oldest.skipped += 1
+            return same_model
+
+        if state["running"] > 0 and oldest.model != state["model"]:
+            # Switching models now would swap it under the running jobs
+            return None
+        return oldest
+
+    def _schedule(self):
+        for backend in {job.backend for job in self.pending}:
+            max_batch_size = self.get_max_batch_size(backend)
+            while (job := self._pick(backend)) is not None:
+                batch = [job]
+                n = job.n
+                for other in self.pending:
+                    if (
+                        other is not job
+                        and other.backend == backend
+                        and other.batch_key == job.batch_key
+                        and n + other.n <= max_batch_size
+                    ):
+                        batch.append(other)
+                        n += other.n
+                for batch_job in batch:
+                    self.pending.remove(batch_job)
+
+                state = self._get_backend(backend)
+                if state["model"] != job.model and state["model"] is not None:
+                    self.model_switches += 1
+                state["model"] = job.model
+                state["running"] += 1
+
+                task = asyncio.create_task(self._run(backend, batch, n))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+        self._notify_positions()
+
+    def _notify_positions(self):
+        positions: dict[str, int] = {}
+        for job in self.pending:
+            positions[job.backend] = positions.get(job.backend, 0) + 1
+            if job.position != positions[job.backend] and job.user_id:
+                job.position = positions[job.backend]
+                task = asyncio.create_task(
+                    emit_to_user(
+                        job.user_id,
+                        "image-generation",
+                        {"id": job.id, "status": "queued", "position": job.position},
+                    )
+                )
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, backend: str, batch: list[ImageJob], n: int):
+        if len(batch) > 1:
+            log.info(f"Generating {len(batch)} image requests as one batch of {n}")
+            self.batched += len(batch) - 1
+
+        try:
+            images = await batch[0].run(n)
+            offset = 0
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_result(images[offset : offset + job.n])
+                offset += job.n
+        except Exception as e:
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_exception(e)
+        finally:
+            self.completed += len(batch)
+            self._get_backend(backend)["running"] -= 1
+            self._schedule()
+
+    async def submit(
+        self,
+        backend: str,
+        model: Optional[str],
+        params: dict,
+        n: int,
+        run: Callable[[int], Awaitable[list]],
+        user_id: Optional[str] = None,
+    ) -> list:
+        """
+        Queues a request for `n` images and returns them once generated.
+        `run(n)` generates a batch of `n` images with `params`.
+        """
+        job = ImageJob(backend, model, params, n, run, user_id)
+        self.pending.append(job)
+        self._schedule()
+
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            # The client went away before its job started
+            if job in self.pending:
+                self.pending.remove(job)
+                self._notify_positions()
+            raise
+
+    def get_positions(self, user_id: str) -> list[dict]:
+        positions = []
+        counts: dict[str, int] = {}
+        for job in self.pending:
+            counts[job.backend] = counts.get(job.backend, 0) + 1
+            if job.user_id == user_id:
+                positions.append(
+                    {
+                        "id": job.id,
+                        "position": counts[job.backend],
+                        "created_at": job.created_at,
+                    }
+                )
+        return positions
+
+    def get_metrics(self) -> dict:
+        return {
+            "queued": len(self.pending),
+            "backends": {
+                backend: {
+                    **state,
+                    "queued": len(
+                        [job for job in self.pending if job.backend == backend]
+                    ),
+                    "concurrency": self.get_concurrency(backend),
+                    "max_batch_size": self.get_max_batch_size(backend),
+                }
+                for backend, state in self.backends.items()
+            },
+            "completed": self.completed,
+            "batched": self.batched,
+            "model_switches": self.model_switches,
+        }
@@ -13,7 +13,6 @@
 
 import os
 import re
-import random
 import requests
 import json
 import aiohttp
@@ -31,12 +30,17 @@
     get_verified_user,
     get_admin_user,
 )
+from utils.client_pool import client_pool
+from utils.model_registry import model_registry
+from apps.ollama.utils.load_balancer import LoadBalancer
 
 from config import (
     SRC_LOG_LEVELS,
     OLLAMA_BASE_URLS,
+    OLLAMA_LOAD_BALANCING_STRATEGY,
+    OLLAMA_EJECTION_THRESHOLD,
+    OLLAMA_EJECTION_DURATION,
     ENABLE_OLLAMA_API,
-    AIOHTTP_CLIENT_TIMEOUT,
     ENABLE_MODEL_FILTER,
     MODEL_FILTER_LIST,
     UPLOAD_DIR,
@@ -71,10 +75,11 @@
 app.state.config.OLLAMA_BASE_URLS = OLLAMA_BASE_URLS
 app.state.MODELS = {}
 
-
-# TODO: Implement a more intelligent load balancing mechanism for distributing requests among multiple backend instances.
-# Current implementation uses a simple round-robin approach (random.choice). Consider incorporating algorithms like weighted round-robin,
-# least connections, or least response time for better resource utilization and performance optimization.
+app.state.LOAD_BALANCER = LoadBalancer(
+    strategy=OLLAMA_LOAD_BALANCING_STRATEGY,
+    ejection_threshold=OLLAMA_EJECTION_THRESHOLD,
+    ejection_duration=OLLAMA_EJECTION_DURATION,
+)
 
 
 @app.middleware("http")
@@ -106,6 +111,7 @@ class OllamaConfigForm(BaseModel):
 @app.post("/config/update")
 async def update_config(form_data: OllamaConfigForm, user=Depends(get_admin_user)):
     app.state.config.ENABLE_OLLAMA_API = form_data.enable_ollama_api
+    model_registry.invalidate()
     return {"ENABLE_OLLAMA_API": app.state.config.ENABLE_OLLAMA_API}
 
 
@@ -121,6 +127,7 @@ class UrlUpdateForm(BaseModel):
 @app.post("/urls/update")
 async def update_ollama_api_url(form_data: UrlUpdateForm, user=Depends(get_admin_user)):
     app.state.config.OLLAMA_BASE_URLS = form_data.urls
+    model_registry.invalidate()
 
     log.info(f"app.state.config.OLLAMA_BASE_URLS: {app.state.config.OLLAMA_BASE_URLS}")
     return {"OLLAMA_BASE_URLS": app.state.config.OLLAMA_BASE_URLS}
@@ -129,9 +136,9 @@ async def update_ollama_api_url(form_data: UrlUpdateForm, user=Depends(get_admin
 async def fetch_url(url):
     timeout = aiohttp.ClientTimeout(total=5)
     try:
-        async with aiohttp.ClientSession(timeout=timeout, trust_env=True) as session:
-            async with session.get(url) as response:
-                return await response.json()
+        session = client_pool.get_session(url)
+        async with session.get(url, timeout=timeout) as response:
+            return await response.json()
     except Exception as e:
         # Handle connection error here
         log.error(f"Connection error: {e}")
@@ -139,21 +146,29 @@ async def fetch_url(url):
 
 
 async def cleanup_response(
-    response: Optional[aiohttp.ClientResponse],
-    session: Optional[aiohttp.ClientSession],
+    response: Optional[aiohttp.ClientResponse], base_url: Optional[str] = None
 ):
+    # Release the connection back to the shared pool instead of closing the session
     if response:
-        response.close()
-    if session:
-        await session.close()
+        response.release()
+    if base_url:
+        app.state.LOAD_BALANCER.release(base_url)
 
 
-async def post_streaming_url(url: str, payload: Union[str, bytes], stream: bool = True):
+async def post_streaming_url(
+    url: str,
+    payload: Union[str, bytes],
+    stream: bool = True,
+    base_url: Optional[str] = None,
+):
+    # base_url is set for load balanced requests so that in-flight requests,
+    # latency and failures are reported back to the load balancer
     r = None
+    if base_url:
+        app.state.LOAD_BALANCER.acquire(base_url)
     try:
-        session = aiohttp.ClientSession(
-            trust_env=True, timeout=aiohttp.ClientTimeout(total=AIOHTTP_CLIENT_TIMEOUT)
-        )
+        session = client_pool.get_session(url)
+        start_time = time.monotonic()
         r = await session.post(
             url,
             data=payload,
@@ -161,18 +176,23 @@ async def post_streaming_url(url: str, payload: Union[str, bytes], stream: bool
         )
         r.raise_for_status()
 
+        if base_url:
+            app.state.LOAD_BALANCER.report(
+                base_url, success=True, latency=time.monotonic() - start_time
+            )
+
         if stream:
             return StreamingResponse(
                 r.content,
                 status_code=r.status,
                 headers=dict(r.headers),
                 background=BackgroundTask(
-                    cleanup_response, response=r, session=session
+                    cleanup_response, response=r, base_url=base_url
                 ),
             )
         else:
             res = await r.json()
-            await cleanup_response(r, session)
+            await cleanup_response(r, base_url)
             return res
 
     except Exception as e:
@@ -185,12 +205,39 @@ async def post_streaming_url(url: str, payload: Union[str, bytes], stream: bool
             except Exception:
                 error_detail = f"Ollama: {e}"
 
+        if base_url:
+            # Only connection errors and server errors count against the URL
+            if r is None or r.status >= 500:
+                app.state.LOAD_BALANCER.report(base_url, success=False)
+        await cleanup_response(r, base_url)
+
         raise HTTPException(
             status_code=r.status if r else 500,
             detail=error_detail,
         )
 
 
+def invalidate_models_on_completion(response):
+    # Models pulled or created through a stream only exist once the stream is done
+    model_registry.invalidate()
+    if isinstance(response, StreamingResponse):
+        background = response.background
+
+        async def cleanup():
+            if background is not None:
+                await background()
+            model_registry.invalidate()
+
+        response.background = BackgroundTask(cleanup)
+    return response
+
+
+def select_url_idx(url_idxs: list[int], key: Optional[str] = None) -> int:
+    urls = app.state.config.OLLAMA_BASE_URLS
+    url = app.state.LOAD_BALANCER.select([urls[idx] for idx in url_idxs], key)
+    return urls.index(url)
+
+
 def merge_models_lists(model_lists):
     merged_models = {}
 
@@ -347,7 +394,9 @@ async def pull_model(
     # Admin should be able to pull models from any source
     payload = {**form_data.model_dump(exclude_none=True), "insecure": True}
 
-    return await post_streaming_url(f"{url}/api/pull", json.dumps(payload))
+    return invalidate_models_on_completion(
+        await post_streaming_url(f"{url}/api/pull", json.dumps(payload))
+    )
 
 
 class PushModelForm(BaseModel):
@@ -396,8 +445,10 @@ async def create_model(
     url = app.state.config.OLLAMA_BASE_URLS[url_idx]
     log.info(f"url: {url}")
 
-    return await post_streaming_url(
-        f"{url}/api/create", form_data.model_dump_json(exclude_none=True).encode()
+    return invalidate_models_on_completion(
+        await post_streaming_url(
+            f"{url}/api/create", form_data.model_dump_json(exclude_none=True).encode()
+        )
     )
 
 
@@ -435,6 +486,7 @@ async def copy_model(
         r.raise_for_status()
 
         log.debug(f"r.text: {r.text}")
+        model_registry.invalidate()
 
         return True
     except Exception as e:
@@ -483,6 +535,7 @@ async def delete_model(
         r.raise_for_status()
 
         log.debug(f"r.text: {r.text}")
+        model_registry.invalidate()
 
         return True
     except Exception as e:
@@ -510,7 +563,7 @@ async def show_model_info(form_data: ModelNameForm, user=Depends(get_verified_us
             detail=ERROR_MESSAGES.MODEL_NOT_FOUND(form_data.name),
         )
 
-    url_idx = random.choice(app.state.MODELS[form_data.name]["urls"])
+    url_idx = select_url_idx(app.state.MODELS[form_data.name]["urls"])
     url = app.state.config.OLLAMA_BASE_URLS[url_idx]
     log.info(f"url: {url}")
 
@@ -562,7 +615,7 @@ async def generate_embeddings(
             model = f"{model}:latest"
 
         if model in app.state.MODELS:
-            url_idx = random.choice(app.state.MODELS[model]["urls"])
+            url_idx = select_url_idx(app.state.MODELS[model]["urls"])
         else:
             raise HTTPException(
                 status_code=400,
@@ -612,7 +665,7 @@ def generate_ollama_embeddings(
             model = f"{model}:latest"
 
         if model in app.state.MODELS:
-            url_idx = random.choice(app.state.MODELS[model]["urls"])
+            url_idx = select_url_idx(app.state.MODELS[model]["urls"])
         else:
             raise HTTPException(
                 status_code=400,
@@ -681,7 +734,7 @@ async def generate_completion(
             model = f"{model}:latest"
 
         if model in app.state.MODELS:
-            url_idx = random.choice(app.state.MODELS[model]["urls"])
+            url_idx = select_url_idx(app.state.MODELS[model]["urls"])
         else:
             raise HTTPException(
                 status_code=400,
@@ -692,7 +745,9 @@ async def generate_completion(
     log.info(f"url: {url}")
 
     return await post_streaming_url(
-        f"{url}/api/generate", form_data.model_dump_json(exclude_none=True).encode()
+        f"{url}/api/generate",
+        form_data.model_dump_json(exclude_none=True).encode(),
+        base_url=url,
     )
 
 
@@ -710,16 +765,17 @@ class GenerateChatCompletionForm(BaseModel):
     template: Optional[str] = None
     stream: Optional[bool] = None
     keep_alive: Optional[Union[int, str]] = None
+    metadata: Optional[dict] = None
 
 
-def get_ollama_url(url_idx: Optional[int], model: str):
+def get_ollama_url(url_idx: Optional[int], model: str, key: Optional[str] = None):
     if url_idx is None:
         if model not in app.state.MODELS:
             raise HTTPException(
                 status_code=400,
                 detail=ERROR_MESSAGES.MODEL_NOT_FOUND(model),
             )
-        url_idx = random.choice(app.state.MODELS[model]["urls"])
+        url_idx = select_url_idx(app.state.MODELS[model]["urls"], key)
     url = app.state.config.OLLAMA_BASE_URLS[url_idx]
     return url
 
@@ -733,8 +789,7 @@ async def generate_chat_completion(
 ):
     payload = {**form_data.model_dump(exclude_none=True)}
     log.debug(f"{payload = }")
-    if "metadata" in payload:
-        del payload["metadata"]
+    metadata = payload.pop("metadata", None) or {}
 
     model_id = form_data.model
     model_info = Models.get_model_by_id(model_id)
@@ -757,11 +812,13 @@ async def generate_chat_completion(
     if ":" not in payload["model"]:
         payload["model"] = f"{payload['model']}:latest"
 
-    url = get_ollama_url(url_idx, payload["model"])
+    url = get_ollama_url(url_idx, payload["model"], metadata.get("chat_id"))
     log.info(f"url: {url}")
     log.debug(payload)
 
-    return await post_streaming_url(f"{url}/api/chat", json.dumps(payload))
+    return await post_streaming_url(
+        f"{url}/api/chat", json.dumps(payload), base_url=url
+    )
 
 
 # TODO: we should update this part once Ollama supports other types
@@ -812,13 +869,15 @@ async def generate_openai_chat_completion(
     if ":" not in payload["model"]:
         payload["model"] = f"{payload['model']}:latest"
 
-    url = get_ollama_url(url_idx, payload["model"])
+    metadata = form_data.get("metadata", None) or {}
+    url = get_ollama_url(url_idx, payload["model"], metadata.get("chat_id"))
     log.info(f"url: {url}")
 
     return await post_streaming_url(
         f"{url}/v1/chat/completions",
         json.dumps(payload),
         stream=payload.get("stream", False),
+        base_url=url,
     )
 
 
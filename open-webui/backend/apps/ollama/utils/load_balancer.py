@@ -0,0 +1,194 @@
+import bisect
+import hashlib
+import logging
+import random
+import threading
+import time
+from typing import Optional
+
+from config import SRC_LOG_LEVELS
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["OLLAMA"])
+
+
+STRATEGIES = ["random", "least_outstanding", "ewma", "consistent_hash"]
+
+
+class UrlStats:
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ewma_latency: Optional[float] = None
+        self.ejected_until = 0.0
+
+    def is_ejected(self, now: float) -> bool:
+        return self.ejected_until > now
+
+    def to_dict(self, now: float) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ewma_latency": (
+                round(self.ewma_latency, 4) if self.ewma_latency is not None else None
+            ),
+            "ejected": self.is_ejected(now),
+        }
+
+
+def _hash(value: str) -> int:
+    return int(hashlib.md5(value.encode("utf-8")).hexdigest(), 16)
+
+
+class LoadBalancer:
+    """
+    Picks an Ollama base URL for a model from the URLs that serve it.
+
+    Strategies:
+    - random: the previous behaviour, uniform random choice
+    - least_outstanding: URL with the fewest in-flight requests
+    - ewma: URL with the lowest EWMA latency weighted by in-flight requests
+    - consistent_hash: URL picked from a hash ring by key (e.g. chat_id), so a
+      conversation keeps hitting the same instance and its KV cache stays warm;
+      falls back to least_outstanding when no key is given
+
+    URLs that fail `ejection_threshold` times in a row are ejected for
+    `ejection_duration` seconds and then re-admitted on probation.
+    """
+
+    def __init__(
+        self,
+        strategy: str = "least_outstanding",
+        ejection_threshold: int = 3,
+        ejection_duration: float = 30.0,
+        ewma_alpha: float = 0.3,
+        virtual_nodes: int = 100,
+    ):
+        if strategy not in STRATEGIES:
+            log.warning(
+                f"Unknown load balancing strategy '{strategy}', using least_outstanding"
+            )
+            strategy = "least_outstanding"
+
+        self.strategy = strategy
+        self.ejection_threshold = ejection_threshold
+        self.ejection_duration = ejection_duration
+        self.ewma_alpha = ewma_alpha
+        self.virtual_nodes = virtual_nodes
+
+        self.stats: dict[str, UrlStats] = {}
+        self.rings: dict[tuple[str, ...], tuple[list[int], list[str]]] = {}
+        self.lock = threading.Lock()
+
+    def _get_stats(self, url: str) -> UrlStats:
+        if url not in self.stats:
+            self.stats[url] = UrlStats()
+        return self.stats[url]
+
+    def _get_ring(self, urls: list[str]) -> tuple[list[int], list[str]]:
+        ring_key = tuple(sorted(set(urls)))
+        if ring_key not in self.rings:
+            points = sorted(
+                (_hash(f"{url}#{i}"), url)
+                for url in ring_key
+                for i in range(self.virtual_nodes)
+            )
+            self.rings[ring_key] = (
+                [point for point, _ in points],
+                [url for _, url in points],
+            )
+        return self.rings[ring_key]
+
+    def _least_outstanding(self, urls: list[str]) -> str:
+        min_in_flight = min(self._get_stats(url).in_flight for url in urls)
+        return random.choice(
+            [url for url in urls if self._get_stats(url).in_flight == min_in_flight]
+        )
+
+    def _ewma(self, urls: list[str]) -> str:
+        # URLs without a latency sample yet are tried first
+        unmeasured = [url for url in urls if self._get_stats(url).ewma_latency is None]
+        if unmeasured:
+            return self._least_outstanding(unmeasured)
+
+        return min(
+            urls,
+            key=lambda url: self._get_stats(url).ewma_latency
+            * (self._get_stats(url).in_flight + 1),
+        )
+
+    def _consistent_hash(self, urls: list[str], key: str, healthy: set[str]) -> str:
+        points, ring_urls = self._get_ring(urls)
+        start = bisect.bisect(points, _hash(key)) % len(points)
+
+        # Walk the ring clockwise until a healthy URL is found
+        for offset in range(len(points)):
+            url = ring_urls[(start + offset) % len(points)]
+            if url in healthy:
+                return url
+        return ring_urls[start]
+
+    def select(self, urls: list[str], key: Optional[str] = None) -> str:
+        if len(urls) == 1:
+            return urls[0]
+
+        with self.lock:
+            now = time.monotonic()
+            healthy = [url for url in urls if not self._get_stats(url).is_ejected(now)]
+            # If every URL is ejected, fall back to all of them rather than failing
+            candidates = healthy if healthy else urls
+
+            if self.strategy == "random":
+                return random.choice(candidates)
+            if self.strategy == "ewma":
+                return self._ewma(candidates)
+            if self.strategy == "consistent_hash" and key:
+                return self._consistent_hash(urls, key, set(candidates))
+            return self._least_outstanding(candidates)
+
+    def acquire(self, url: str):
+        with self.lock:
+            stats = self._get_stats(url)
+            stats.in_flight += 1
+            stats.requests += 1
+
+    def release(self, url: str):
+        with self.lock:
+            stats = self._get_stats(url)
+            stats.in_flight = max(stats.in_flight - 1, 0)
+
+    def report(self, url: str, success: bool, latency: Optional[float] = None):
+        with self.lock:
+            stats = self._get_stats(url)
+
+            if success:
+                stats.consecutive_failures = 0
+                if latency is not None:
+                    stats.ewma_latency = (
+                        latency
+                        if stats.ewma_latency is None
+                        else self.ewma_alpha * latency
+                        + (1 - self.ewma_alpha) * stats.ewma_latency
+                    )
+                return
+
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.ejection_threshold:
+                log.warning(
+                    f"Ejecting {url} for {self.ejection_duration}s after {stats.consecutive_failures} consecutive failures"
+                )
+                stats.ejected_until = time.monotonic() + self.ejection_duration
+                # Re-admitted URLs get one more strike before being ejected again
+                stats.consecutive_failures = self.ejection_threshold - 1
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            return {
+                "strategy": self.strategy,
+                "urls": {url: stats.to_dict(now) for url, stats in self.stats.items()},
+            }
@@ -21,11 +21,12 @@
     apply_model_params_to_body_openai,
     apply_model_system_prompt_to_body,
 )
+from utils.client_pool import client_pool
+from utils.model_registry import model_registry
 
 from config import (
     SRC_LOG_LEVELS,
     ENABLE_OPENAI_API,
-    AIOHTTP_CLIENT_TIMEOUT,
     OPENAI_API_BASE_URLS,
     OPENAI_API_KEYS,
     CACHE_DIR,
@@ -86,6 +87,7 @@ class OpenAIConfigForm(BaseModel):
 @app.post("/config/update")
 async def update_config(form_data: OpenAIConfigForm, user=Depends(get_admin_user)):
     app.state.config.ENABLE_OPENAI_API = form_data.enable_openai_api
+    model_registry.invalidate()
     return {"ENABLE_OPENAI_API": app.state.config.ENABLE_OPENAI_API}
 
 
@@ -106,6 +108,7 @@ async def get_openai_urls(user=Depends(get_admin_user)):
 async def update_openai_urls(form_data: UrlsUpdateForm, user=Depends(get_admin_user)):
     await get_all_models()
     app.state.config.OPENAI_API_BASE_URLS = form_data.urls
+    model_registry.invalidate()
     return {"OPENAI_API_BASE_URLS": app.state.config.OPENAI_API_BASE_URLS}
 
 
@@ -117,6 +120,7 @@ async def get_openai_keys(user=Depends(get_admin_user)):
 @app.post("/keys/update")
 async def update_openai_key(form_data: KeysUpdateForm, user=Depends(get_admin_user)):
     app.state.config.OPENAI_API_KEYS = form_data.keys
+    model_registry.invalidate()
     return {"OPENAI_API_KEYS": app.state.config.OPENAI_API_KEYS}
 
 
@@ -188,23 +192,19 @@ async def fetch_url(url, key):
     timeout = aiohttp.ClientTimeout(total=5)
     try:
         headers = {"Authorization": f"Bearer {key}"}
-        async with aiohttp.ClientSession(timeout=timeout, trust_env=True) as session:
-            async with session.get(url, headers=headers) as response:
-                return await response.json()
+        session = client_pool.get_session(url)
+        async with session.get(url, headers=headers, timeout=timeout) as response:
+            return await response.json()
     except Exception as e:
         # Handle connection error here
         log.error(f"Connection error: {e}")
         return None
 
 
-async def cleanup_response(
-    response: Optional[aiohttp.ClientResponse],
-    session: Optional[aiohttp.ClientSession],
-):
+async def cleanup_response(response: Optional[aiohttp.ClientResponse]):
+    # Release the connection back to the shared pool instead of closing the session
     if response:
-        response.close()
-    if session:
-        await session.close()
+        response.release()
 
 
 def merge_models_lists(model_lists):
@@ -402,13 +402,10 @@ async def generate_chat_completion(
         headers["X-Title"] = "Open WebUI"
 
     r = None
-    session = None
     streaming = False
 
     try:
-        session = aiohttp.ClientSession(
-            trust_env=True, timeout=aiohttp.ClientTimeout(total=AIOHTTP_CLIENT_TIMEOUT)
-        )
+        session = client_pool.get_session(url)
         r = await session.request(
             method="POST",
             url=f"{url}/chat/completions",
@@ -425,9 +422,7 @@ async def generate_chat_completion(
                 r.content,
                 status_code=r.status,
                 headers=dict(r.headers),
-                background=BackgroundTask(
-                    cleanup_response, response=r, session=session
-                ),
+                background=BackgroundTask(cleanup_response, response=r),
             )
         else:
             response_data = await r.json()
@@ -445,10 +440,8 @@ async def generate_chat_completion(
                 error_detail = f"External: {e}"
         raise HTTPException(status_code=r.status if r else 500, detail=error_detail)
     finally:
-        if not streaming and session:
-            if r:
-                r.close()
-            await session.close()
+        if not streaming:
+            await cleanup_response(r)
 
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
@@ -467,11 +460,10 @@ async def proxy(path: str, request: Request, user=Depends(get_verified_user)):
     headers["Content-Type"] = "application/json"
 
     r = None
-    session = None
     streaming = False
 
     try:
-        session = aiohttp.ClientSession(trust_env=True)
+        session = client_pool.get_session(url)
         r = await session.request(
             method=request.method,
             url=target_url,
@@ -488,9 +480,7 @@ async def proxy(path: str, request: Request, user=Depends(get_verified_user)):
                 r.content,
                 status_code=r.status,
                 headers=dict(r.headers),
-                background=BackgroundTask(
-                    cleanup_response, response=r, session=session
-                ),
+                background=BackgroundTask(cleanup_response, response=r),
             )
         else:
             response_data = await r.json()
@@ -508,7 +498,5 @@ async def proxy(path: str, request: Request, user=Depends(get_verified_user)):
                 error_detail = f"External: {e}"
         raise HTTPException(status_code=r.status if r else 500, detail=error_detail)
     finally:
-        if not streaming and session:
-            if r:
-                r.close()
-            await session.close()
+        if not streaming:
+            await cleanup_response(r)
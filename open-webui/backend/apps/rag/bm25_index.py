@@ -0,0 +1,238 @@
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+from collections import Counter
+from typing import Optional
+
+from config import SRC_LOG_LEVELS, CHROMA_CLIENT, BM25_INDEX_PATH
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["RAG"])
+
+
+def tokenize(text: str) -> list[str]:
+    # Same tokenization as langchain's BM25Retriever default
+    return text.split()
+
+
+class BM25Index:
+    """
+    Inverted index over the documents of one collection. Documents are added
+    incrementally and a query only walks the posting lists of its own terms.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+        # doc number -> (chroma id, text, metadata, length)
+        self.docs: list[tuple[str, str, dict, int]] = []
+        self.ids: set[str] = set()
+        # term -> {doc number: term frequency}
+        self.postings: dict[str, dict[int, int]] = {}
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, ids: list[str], texts: list[str], metadatas: list[dict]):
+        with self.lock:
+            for id, text, metadata in zip(ids, texts, metadatas):
+                if id in self.ids:
+                    continue
+
+                tokens = tokenize(text)
+                doc = len(self.docs)
+                self.docs.append((id, text, metadata or {}, len(tokens)))
+                self.ids.add(id)
+                self.total_length += len(tokens)
+
+                for term, tf in Counter(tokens).items():
+                    self.postings.setdefault(term, {})[doc] = tf
+
+    def search(self, query: str, k: int) -> list[tuple[float, str, dict]]:
+        with self.lock:
+            n = len(self.docs)
+            if n == 0:
+                return []
+
+            avg_length = self.total_length / n
+            scores: dict[int, float] = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, tf in postings.items():
+                    length = self.docs[doc][3]
+                    scores[doc] = scores.get(doc, 0.0) + idf * (
+                        tf
+                        * (self.k1 + 1)
+                        / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+                    )
+
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(score, self.docs[doc][1], self.docs[doc][2]) for doc, score in top]
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "docs": self.docs,
+                "postings": {
+                    term: list(postings.items())
+                    for term, postings in self.postings.items()
+                },
+            }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        index = cls()
+        index.docs = [tuple(doc) for doc in data["docs"]]
+        index.ids = {doc[0] for doc in index.docs}
+        index.total_length = sum(doc[3] for doc in index.docs)
+        index.postings = {
+            term: dict((doc, tf) for doc, tf in postings)
+            for term, postings in data["postings"].items()
+        }
+        return index
+
+
+class BM25IndexStore:
+    """
+    Keeps one BM25Index per collection in memory and persists each of them as
+    JSON under BM25_INDEX_PATH. An index whose size no longer matches its
+    Chroma collection (e.g. data written before indexing existed, or by code
+    paths that don't update the index) is rebuilt once from the collection.
+
+    Each collection has its own lock, so that building one index doesn't
+    hold up queries on the others. The store lock only guards the dicts.
+    """
+
+    def __init__(self, path: str = BM25_INDEX_PATH):
+        self.path = path
+        self.indexes: dict[str, BM25Index] = {}
+        self.locks: dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def _get_lock(self, collection_name: str) -> threading.Lock:
+        with self.lock:
+            if collection_name not in self.locks:
+                self.locks[collection_name] = threading.Lock()
+            return self.locks[collection_name]
+
+    def _get_index(self, collection_name: str) -> Optional[BM25Index]:
+        with self.lock:
+            return self.indexes.get(collection_name)
+
+    def _set_index(self, collection_name: str, index: BM25Index):
+        with self.lock:
+            self.indexes[collection_name] = index
+
+    def _get_file_path(self, collection_name: str) -> str:
+        return os.path.join(self.path, f"{collection_name}.json")
+
+    def _load(self, collection_name: str) -> Optional[BM25Index]:
+        file_path = self._get_file_path(collection_name)
+        if not os.path.exists(file_path):
+            return None
+
+        try:
+            with open(file_path, "r") as f:
+                return BM25Index.from_dict(json.load(f))
+        except Exception as e:
+            log.exception(f"Unable to load BM25 index for {collection_name}: {e}")
+            return None
+
+    def _save(self, collection_name: str, index: BM25Index):
+        file_path = self._get_file_path(collection_name)
+        try:
+            with open(f"{file_path}.tmp", "w") as f:
+                json.dump(index.to_dict(), f)
+            os.replace(f"{file_path}.tmp", file_path)
+        except Exception as e:
+            log.exception(f"Unable to save BM25 index for {collection_name}: {e}")
+
+    def _build(self, collection_name: str, collection) -> BM25Index:
+        log.info(f"Building BM25 index for {collection_name}")
+        documents = collection.get(include=["documents", "metadatas"])
+
+        index = BM25Index()
+        index.add(
+            documents.get("ids", []),
+            documents.get("documents", []),
+            documents.get("metadatas") or [{} for _ in documents.get("ids", [])],
+        )
+        self._save(collection_name, index)
+        return index
+
+    def get(self, collection_name: str, collection=None) -> BM25Index:
+        if collection is None:
+            collection = CHROMA_CLIENT.get_collection(name=collection_name)
+        count = collection.count()
+
+        index = self._get_index(collection_name)
+        if index is not None and len(index) == count:
+            return index
+
+        with self._get_lock(collection_name):
+            # It may have been loaded or built while waiting for the lock
+            index = self._get_index(collection_name)
+            if index is None:
+                index = self._load(collection_name)
+            if index is None or len(index) != count:
+                index = self._build(collection_name, collection)
+
+            self._set_index(collection_name, index)
+            return index
+
+    def add(
+        self,
+        collection_name: str,
+        ids: list[str],
+        texts: list[str],
+        metadatas: list[dict],
+        save: bool = True,
+    ):
+        with self._get_lock(collection_name):
+            index = self._get_index(collection_name)
+            if index is None:
+                index = self._load(collection_name) or BM25Index()
+                self._set_index(collection_name, index)
+
+            index.add(ids, texts, metadatas)
+            if save:
+                self._save(collection_name, index)
+
+    def save(self, collection_name: str):
+        with self._get_lock(collection_name):
+            index = self._get_index(collection_name)
+            if index is not None:
+                self._save(collection_name, index)
+
+    def delete(self, collection_name: str):
+        with self._get_lock(collection_name):
+            with self.lock:
+                self.indexes.pop(collection_name, None)
+            try:
+                os.remove(self._get_file_path(collection_name))
+            except FileNotFoundError:
+                pass
+
+    def reset(self):
+        with self.lock:
+            self.indexes = {}
+            for filename in os.listdir(self.path):
+                try:
+                    os.remove(os.path.join(self.path, filename))
+                except Exception as e:
+                    log.error(f"Failed to delete {filename}. Reason: {e}")
+
+
+bm25_indexes = BM25IndexStore()
@@ -0,0 +1,251 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+
+from config import (
+    SRC_LOG_LEVELS,
+    RAG_EMBEDDING_CACHE_SIZE,
+    RAG_EMBEDDING_CACHE_DISK_SIZE,
+    RAG_EMBEDDING_CACHE_DIR,
+)
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["RAG"])
+
+
+def get_cache_key(engine: str, model: str, text: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{engine}:{model}:{digest}"
+
+
+class DiskEmbeddingStore:
+    """
+    SQLite backed embedding store. Entries carry an access timestamp and the
+    least recently used ones are evicted once `max_entries` is exceeded.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, embedding BLOB NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_accessed_at "
+            "ON embeddings (accessed_at)"
+        )
+        self.conn.commit()
+        self.count = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        if not keys:
+            return {}
+
+        found = {}
+        with self.lock:
+            # Stay well below SQLite's bound parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i : i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("d", blob).tolist()
+
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET accessed_at = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self.conn.commit()
+        return found
+
+    def set_many(self, items: dict[str, list[float]]):
+        if not items:
+            return
+
+        now = time.time()
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, embedding, accessed_at) VALUES (?, ?, ?)",
+                [
+                    (key, array("d", embedding).tobytes(), now)
+                    for key, embedding in items.items()
+                ],
+            )
+            self.count += self.conn.total_changes - before
+
+            if self.count > self.max_entries:
+                # Trim to 90% so eviction doesn't run on every insert
+                excess = self.count - int(self.max_entries * 0.9)
+                self.conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY accessed_at LIMIT ?)",
+                    (excess,),
+                )
+                self.count -= excess
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM embeddings")
+            self.conn.commit()
+            self.count = 0
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by engine, model and sha256 of the text:
+    an in-process LRU in front of a persistent on-disk store. Disk hits are
+    promoted into memory.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RAG_EMBEDDING_CACHE_SIZE,
+        disk_max_entries: int = RAG_EMBEDDING_CACHE_DISK_SIZE,
+        disk_dir: str = RAG_EMBEDDING_CACHE_DIR,
+    ):
+        self.max_entries = max_entries
+        self.memory: OrderedDict[str, list[float]] = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.disk: Optional[DiskEmbeddingStore] = None
+        if disk_max_entries > 0:
+            try:
+                self.disk = DiskEmbeddingStore(
+                    f"{disk_dir}/embeddings.db", disk_max_entries
+                )
+            except Exception as e:
+                log.exception(f"Unable to open embedding disk cache: {e}")
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _set_memory(self, key: str, embedding: list[float]):
+        if self.max_entries <= 0:
+            return
+
+        self.memory[key] = embedding
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+            self.memory_hits += len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.disk is not None:
+            try:
+                from_disk = self.disk.get_many(missing)
+            except Exception as e:
+                log.exception(f"Error reading embedding disk cache: {e}")
+                from_disk = {}
+
+            with self.lock:
+                self.disk_hits += len(from_disk)
+                for key, embedding in from_disk.items():
+                    self._set_memory(key, embedding)
+            found.update(from_disk)
+
+        with self.lock:
+            self.misses += len(set(keys) - found.keys())
+        return found
+
+    def set_many(self, items: dict[str, list[float]]):
+        with self.lock:
+            for key, embedding in items.items():
+                self._set_memory(key, embedding)
+
+        if self.disk is not None:
+            try:
+                self.disk.set_many(items)
+            except Exception as e:
+                log.exception(f"Error writing embedding disk cache: {e}")
+
+    def wrap(
+        self, engine: str, model: str, func: Callable
+    ) -> Callable[[Union[str, list[str]]], Union[list[float], list[list[float]]]]:
+        """
+        Wraps an embedding function taking a string or a list of strings so
+        that only texts missing from the cache are embedded.
+        """
+
+        def cached(query: Union[str, list[str]]):
+            texts = query if isinstance(query, list) else [query]
+            keys = [get_cache_key(engine, model, text) for text in texts]
+            found = self.get_many(keys)
+
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found and key not in missing:
+                    missing[key] = text
+
+            if missing:
+                missing_texts = list(missing.values())
+                embeddings = (
+                    func(missing_texts)
+                    if isinstance(query, list)
+                    else [func(missing_texts[0])]
+                )
+
+                # Don't cache failed embeddings
+                if embeddings is None or any(e is None for e in embeddings):
+                    return None
+
+                computed = dict(zip(missing.keys(), embeddings))
+                self.set_many(computed)
+                found.update(computed)
+
+            results = [found[key] for key in keys]
+            return results if isinstance(query, list) else results[0]
+
+        return cached
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_max_entries": self.max_entries,
+                "disk_entries": self.disk.count if self.disk is not None else 0,
+                "disk_max_entries": (
+                    self.disk.max_entries if self.disk is not None else 0
+                ),
+            }
+
+
+embedding_cache = EmbeddingCache()
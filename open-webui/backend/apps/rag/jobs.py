@@ -0,0 +1,575 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+import requests
+from fastapi.concurrency import run_in_threadpool
+
+from config import (
+    SRC_LOG_LEVELS,
+    RAG_INGEST_WORKERS,
+    RAG_JOB_MAX_RETRIES,
+    RAG_JOB_TTL,
+    RAG_JOB_QUEUE_REDIS_URL,
+    RAG_JOB_HEARTBEAT_TIMEOUT,
+)
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["RAG"])
+
+
+ACTIVE_STATUSES = ["queued", "running"]
+
+TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """
+    Whether `e` was caused by a connection error or timeout, e.g. from an
+    embedding backend, anywhere in its chain: such errors are often wrapped
+    in a generic Exception.
+    """
+    seen = set()
+    while e is not None and id(e) not in seen:
+        if isinstance(e, TRANSIENT_ERRORS):
+            return True
+        seen.add(id(e))
+        e = e.__cause__ or e.__context__
+    return False
+
+
+class InMemoryJobBackend:
+    blocking = False
+
+    def __init__(self):
+        self.jobs: dict[str, dict] = {}
+        self.dedup: dict[str, str] = {}
+        self.queue: queue.Queue = queue.Queue()
+        self.lock = threading.Lock()
+
+    def save(self, job: dict):
+        with self.lock:
+            self.jobs[job["id"]] = dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(
+        self, job_id: str, expected_status: Optional[str] = None, **fields
+    ) -> bool:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or (
+                expected_status is not None and job["status"] != expected_status
+            ):
+                return False
+            job.update(fields)
+            return True
+
+    def list(self, user_id: Optional[str] = None) -> list[dict]:
+        with self.lock:
+            return [
+                dict(job)
+                for job in self.jobs.values()
+                if user_id is None or job["user_id"] == user_id
+            ]
+
+    def push(self, job_id: str, delay: float = 0):
+        if delay > 0:
+            timer = threading.Timer(delay, self.queue.put, args=(job_id,))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.queue.put(job_id)
+
+    def pop(self, timeout: float) -> Optional[str]:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def claim(self, key: str, job_id: str) -> Optional[str]:
+        with self.lock:
+            existing = self.jobs.get(self.dedup.get(key))
+            if existing and existing["status"] in ACTIVE_STATUSES:
+                return existing["id"]
+            self.dedup[key] = job_id
+            return None
+
+    def is_queued(self, job_id: str) -> bool:
+        # The queue and its timers only go away with the process itself
+        return True
+
+    def release(self, key: str, job_id: str):
+        with self.lock:
+            if self.dedup.get(key) == job_id:
+                del self.dedup[key]
+
+    def prune(self, ttl: int):
+        now = time.time()
+        with self.lock:
+            for job_id in [
+                job["id"]
+                for job in self.jobs.values()
+                if job["status"] not in ACTIVE_STATUSES
+                and now - job["updated_at"] > ttl
+            ]:
+                del self.jobs[job_id]
+
+    def queue_size(self) -> int:
+        return self.queue.qsize()
+
+
+class RedisJobBackend:
+    """
+    Keeps jobs and the queue in Redis so every instance can pick up work and
+    report status. Uploaded files must be on storage shared by the instances.
+    """
+
+    PREFIX = "open-webui:rag:jobs"
+    blocking = True
+
+    # Sets the given fields of an existing job, if its status is ARGV[2] (or
+    # ARGV[2] is empty), so that concurrent updates of different fields
+    # (progress, heartbeats, status) don't overwrite each other
+    UPDATE_SCRIPT = """
+    if redis.call("EXISTS", KEYS[1]) == 0 then
+        return 0
+    end
+    if ARGV[2] ~= "" and redis.call("HGET", KEYS[1], "status") ~= ARGV[2] then
+        return 0
+    end
+    redis.call("HSET", KEYS[1], unpack(ARGV, 3))
+    redis.call("EXPIRE", KEYS[1], ARGV[1])
+    return 1
+    """
+
+    # Moves the retries due by ARGV[1] from the delayed set to the queue
+    PROMOTE_SCRIPT = """
+    local job_ids = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+    for _, job_id in ipairs(job_ids) do
+        redis.call("ZREM", KEYS[1], job_id)
+        redis.call("RPUSH", KEYS[2], job_id)
+    end
+    return #job_ids
+    """
+
+    def __init__(self, url: str, ttl: int):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.update_script = self.redis.register_script(self.UPDATE_SCRIPT)
+        self.promote_script = self.redis.register_script(self.PROMOTE_SCRIPT)
+
+    def _key(self, *parts: str) -> str:
+        return ":".join([self.PREFIX, *parts])
+
+    def _job_key(self, job_id: str) -> str:
+        # A hash with a JSON value per field
+        return self._key("state", job_id)
+
+    def save(self, job: dict):
+        pipe = self.redis.pipeline()
+        pipe.hset(
+            self._job_key(job["id"]),
+            mapping={field: json.dumps(value) for field, value in job.items()},
+        )
+        pipe.expire(self._job_key(job["id"]), self.ttl)
+        pipe.lpush(self._key("user", job["user_id"] or ""), job["id"])
+        pipe.ltrim(self._key("user", job["user_id"] or ""), 0, 99)
+        pipe.execute()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        data = self.redis.hgetall(self._job_key(job_id))
+        return {field: json.loads(value) for field, value in data.items()} or None
+
+    def update(
+        self, job_id: str, expected_status: Optional[str] = None, **fields
+    ) -> bool:
+        args = [self.ttl, json.dumps(expected_status) if expected_status else ""]
+        for field, value in fields.items():
+            args.extend([field, json.dumps(value)])
+        return bool(self.update_script(keys=[self._job_key(job_id)], args=args))
+
+    def list(self, user_id: Optional[str] = None) -> list[dict]:
+        if user_id is None:
+            job_ids = [
+                key.rsplit(":", 1)[-1]
+                for key in self.redis.scan_iter(self._job_key("*"))
+            ]
+        else:
+            job_ids = self.redis.lrange(self._key("user", user_id), 0, -1)
+        return [job for job in map(self.get, job_ids) if job is not None]
+
+    def push(self, job_id: str, delay: float = 0):
+        if delay > 0:
+            # Kept in Redis rather than in a timer, so that retries survive
+            # the instance that scheduled them
+            self.redis.zadd(self._key("delayed"), {job_id: time.time() + delay})
+        else:
+            self.redis.rpush(self._key("queue"), job_id)
+
+    def pop(self, timeout: float) -> Optional[str]:
+        self.promote_script(
+            keys=[self._key("delayed"), self._key("queue")], args=[time.time()]
+        )
+        result = self.redis.blpop(self._key("queue"), timeout=max(int(timeout), 1))
+        return result[1] if result else None
+
+    def claim(self, key: str, job_id: str) -> Optional[str]:
+        dedup_key = self._key("dedup", key)
+        if self.redis.set(dedup_key, job_id, nx=True, ex=self.ttl):
+            return None
+
+        existing = self.get(self.redis.get(dedup_key) or "")
+        if existing and existing["status"] in ACTIVE_STATUSES:
+            return existing["id"]
+
+        self.redis.set(dedup_key, job_id, ex=self.ttl)
+        return None
+
+    def is_queued(self, job_id: str) -> bool:
+        import redis
+
+        if self.redis.zscore(self._key("delayed"), job_id) is not None:
+            return True
+        try:
+            return self.redis.lpos(self._key("queue"), job_id) is not None
+        except redis.ResponseError:
+            # LPOS needs Redis 6.0.6
+            return True
+
+    def release(self, key: str, job_id: str):
+        dedup_key = self._key("dedup", key)
+        if self.redis.get(dedup_key) == job_id:
+            self.redis.delete(dedup_key)
+
+    def prune(self, ttl: int):
+        # Job keys expire on their own
+        pass
+
+    def queue_size(self) -> int:
+        return self.redis.llen(self._key("queue")) + self.redis.zcard(
+            self._key("delayed")
+        )
+
+
+class JobQueue:
+    """
+    Runs ingestion jobs on a fixed pool of worker threads instead of on the
+    request threadpool.
+
+    Jobs have an id, a status (queued, running, completed or failed), progress
+    and a result or error. Jobs that fail on a connection error or timeout
+    are retried with exponential backoff; any other error means the input
+    itself is unusable. Jobs submitted with a dedup key that matches a queued
+    or running job are collapsed into it.
+
+    Running jobs send a heartbeat, and a job that misses them for
+    `heartbeat_timeout` seconds (its worker died), or a queued job that
+    hasn't been picked up `heartbeat_timeout` seconds after it was due and is
+    no longer in the queue, is failed by whoever waits on it or submits it
+    again.
+    """
+
+    def __init__(
+        self,
+        workers: int = RAG_INGEST_WORKERS,
+        max_retries: int = RAG_JOB_MAX_RETRIES,
+        ttl: int = RAG_JOB_TTL,
+        redis_url: str = RAG_JOB_QUEUE_REDIS_URL,
+        heartbeat_timeout: int = RAG_JOB_HEARTBEAT_TIMEOUT,
+    ):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.ttl = ttl
+        self.heartbeat_timeout = heartbeat_timeout
+
+        if redis_url:
+            self.backend = RedisJobBackend(redis_url, ttl)
+        else:
+            self.backend = InMemoryJobBackend()
+
+        self.handlers: dict[str, Callable[[dict, Callable[[dict], None]], dict]] = {}
+        self.threads: list[threading.Thread] = []
+        self.running = 0
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def register(self, job_type: str):
+        def decorator(handler):
+            self.handlers[job_type] = handler
+            return handler
+
+        return decorator
+
+    def start(self):
+        if self.loop is None:
+            try:
+                self.loop = asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f"rag-ingest-{i}", daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+
+    def run_coroutine(self, coro):
+        # Lets handlers running on worker threads schedule work (e.g. socket
+        # events) on the main event loop without waiting for it
+        if self.loop is None:
+            coro.close()
+            return
+        asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def submit(
+        self,
+        job_type: str,
+        params: dict,
+        user_id: Optional[str] = None,
+        dedup_key: Optional[str] = None,
+    ) -> dict:
+        self.start()
+        self.backend.prune(self.ttl)
+
+        job_id = str(uuid.uuid4())
+        if dedup_key:
+            key = f"{job_type}:{dedup_key}"
+            existing_id = self.backend.claim(key, job_id)
+            if existing_id:
+                existing = self.backend.get(existing_id)
+                if existing is not None and not self._fail_if_lost(existing):
+                    log.info(
+                        f"Job {job_type} {dedup_key} already queued as {existing_id}"
+                    )
+                    return existing
+
+                # The lost job released its key
+                existing_id = self.backend.claim(key, job_id)
+                if existing_id:
+                    return self.backend.get(existing_id)
+
+        now = time.time()
+        job = {
+            "id": job_id,
+            "type": job_type,
+            "user_id": user_id,
+            "params": params,
+            "dedup_key": f"{job_type}:{dedup_key}" if dedup_key else None,
+            "status": "queued",
+            "progress": {},
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.backend.save(job)
+        self.backend.push(job_id)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.backend.get(job_id)
+
+    def list(self, user_id: Optional[str] = None) -> list[dict]:
+        return sorted(
+            self.backend.list(user_id), key=lambda job: job["created_at"], reverse=True
+        )
+
+    async def _run_backend(self, func, *args, **kwargs):
+        # Backends making network calls are kept off the event loop
+        if self.backend.blocking:
+            return await run_in_threadpool(func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    async def submit_async(self, *args, **kwargs) -> dict:
+        return await self._run_backend(self.submit, *args, **kwargs)
+
+    async def get_async(self, job_id: str) -> Optional[dict]:
+        return await self._run_backend(self.get, job_id)
+
+    async def list_async(self, user_id: Optional[str] = None):
+        return await self._run_backend(self.list, user_id)
+
+    def update_progress(self, job_id: str, progress: dict):
+        self.backend.update(job_id, progress=progress, updated_at=time.time())
+
+    def _is_lost(self, job: dict) -> bool:
+        now = time.time()
+        if job["status"] == "running":
+            return now - job["updated_at"] > self.heartbeat_timeout
+        if job["status"] == "queued":
+            due_at = max(job["updated_at"], job.get("retry_at") or 0)
+            return now - due_at > self.heartbeat_timeout and not (
+                self.backend.is_queued(job["id"])
+            )
+        return False
+
+    def _fail_if_lost(self, job: dict) -> bool:
+        if not self._is_lost(job):
+            return False
+
+        log.error(f"Job {job['id']} ({job['type']}) lost its worker")
+        # Unless a worker got to it meanwhile
+        return self._finish(
+            job,
+            "failed",
+            error="The job's worker stopped",
+            expected_status=job["status"],
+        )
+
+    async def wait(self, job_id: str, poll_interval: float = 0.2) -> Optional[dict]:
+        while True:
+            job = await self.get_async(job_id)
+            if job is None or job["status"] not in ACTIVE_STATUSES:
+                return job
+            if await self._run_backend(self._fail_if_lost, job):
+                return await self.get_async(job_id)
+            await asyncio.sleep(poll_interval)
+
+    def _heartbeat(self, job_id: str, stop: threading.Event):
+        interval = max(self.heartbeat_timeout / 4, 1)
+        while not stop.wait(interval):
+            try:
+                # Only while running: never rewrites a status set meanwhile
+                self.backend.update(
+                    job_id, expected_status="running", updated_at=time.time()
+                )
+            except Exception as e:
+                log.error(f"Unable to send the heartbeat of job {job_id}: {e}")
+
+    def _worker(self):
+        while True:
+            try:
+                job_id = self.backend.pop(timeout=1)
+                if job_id is not None:
+                    self._run(job_id)
+            except Exception as e:
+                log.exception(f"Job worker error: {e}")
+                time.sleep(1)
+
+    def _run(self, job_id: str):
+        job = self.backend.get(job_id)
+        if job is None or job["status"] != "queued":
+            return
+
+        handler = self.handlers.get(job["type"])
+        if handler is None:
+            self._finish(job, "failed", error=f"Unknown job type: {job['type']}")
+            return
+
+        attempts = job["attempts"] + 1
+        if not self.backend.update(
+            job_id,
+            expected_status="queued",
+            status="running",
+            attempts=attempts,
+            updated_at=time.time(),
+        ):
+            return
+
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat,
+            args=(job_id, stop_heartbeat),
+            name=f"rag-job-heartbeat-{job_id}",
+            daemon=True,
+        )
+        heartbeat.start()
+
+        def stop():
+            # Before the final status is written, so that a heartbeat in
+            # flight can't land after it
+            stop_heartbeat.set()
+            heartbeat.join()
+
+        with self.lock:
+            self.running += 1
+        try:
+            result = handler(
+                job["params"], lambda progress: self.update_progress(job_id, progress)
+            )
+        except Exception as e:
+            stop()
+            log.exception(f"Job {job_id} ({job['type']}) failed: {e}")
+
+            if attempts <= self.max_retries and is_transient_error(e):
+                delay = 2**attempts
+                now = time.time()
+                self.backend.update(
+                    job_id,
+                    status="queued",
+                    error=str(e),
+                    retry_at=now + delay,
+                    updated_at=now,
+                )
+                self.backend.push(job_id, delay=delay)
+            else:
+                self._finish(job, "failed", error=str(e))
+        else:
+            stop()
+            self._finish(job, "completed", result=result)
+        finally:
+            stop_heartbeat.set()
+            with self.lock:
+                self.running -= 1
+
+    def _finish(
+        self,
+        job: dict,
+        status: str,
+        result=None,
+        error=None,
+        expected_status: Optional[str] = None,
+    ) -> bool:
+        if not self.backend.update(
+            job["id"],
+            expected_status=expected_status,
+            status=status,
+            result=result,
+            error=error,
+            updated_at=time.time(),
+        ):
+            return False
+        if job.get("dedup_key"):
+            self.backend.release(job["dedup_key"], job["id"])
+        return True
+
+    def get_metrics(self) -> dict:
+        try:
+            queued = self.backend.queue_size()
+        except Exception as e:
+            log.error(f"Unable to read job queue size: {e}")
+            queued = None
+
+        with self.lock:
+            return {
+                "backend": (
+                    "redis" if isinstance(self.backend, RedisJobBackend) else "memory"
+                ),
+                "workers": self.workers,
+                "running": self.running,
+                "queued": queued,
+            }
+
+
+ingestion_jobs = JobQueue()
@@ -8,9 +8,11 @@
     Form,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 import requests
 import os, shutil, logging, re
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from pathlib import Path
 from typing import Union, Sequence, Iterator, Any
@@ -54,7 +56,7 @@
     DocumentResponse,
 )
 from apps.webui.models.files import (
-    Files,
+    AsyncFiles,
 )
 
 from apps.rag.utils import (
@@ -65,6 +67,9 @@
     query_collection,
     query_collection_with_hybrid_search,
 )
+from apps.rag.bm25_index import bm25_indexes
+from apps.rag.jobs import ingestion_jobs
+from apps.socket.main import emit_to_user
 
 from apps.rag.search.brave import search_brave
 from apps.rag.search.google_pse import search_google_pse
@@ -80,6 +85,7 @@
 from utils.misc import (
     calculate_sha256,
     calculate_sha256_string,
+    copy_file_and_calculate_sha256,
     sanitize_filename,
     extract_folders_after_data_docs,
 )
@@ -129,6 +135,7 @@
     RAG_WEB_SEARCH_RESULT_COUNT,
     RAG_WEB_SEARCH_CONCURRENT_REQUESTS,
     RAG_EMBEDDING_OPENAI_BATCH_SIZE,
+    RAG_INGEST_BATCH_SIZE,
     CORS_ALLOW_ORIGIN,
 )
 
@@ -681,60 +688,63 @@ def query_collection_handler(
 
 
 @app.post("/youtube")
-def store_youtube_video(form_data: UrlForm, user=Depends(get_verified_user)):
-    try:
-        loader = YoutubeLoader.from_youtube_url(
-            form_data.url,
-            add_video_info=True,
-            language=app.state.config.YOUTUBE_LOADER_LANGUAGE,
-            translation=app.state.YOUTUBE_LOADER_TRANSLATION,
-        )
-        data = loader.load()
-
-        collection_name = form_data.collection_name
-        if collection_name == "":
-            collection_name = calculate_sha256_string(form_data.url)[:63]
+async def store_youtube_video(
+    form_data: UrlForm, background: bool = False, user=Depends(get_verified_user)
+):
+    collection_name = form_data.collection_name
+    if collection_name == "":
+        collection_name = calculate_sha256_string(form_data.url)[:63]
 
-        store_data_in_vector_db(data, collection_name, overwrite=True)
-        return {
-            "status": True,
+    job = await ingestion_jobs.submit_async(
+        "youtube",
+        {
+            "url": form_data.url,
             "collection_name": collection_name,
-            "filename": form_data.url,
-        }
-    except Exception as e:
-        log.exception(e)
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=ERROR_MESSAGES.DEFAULT(e),
-        )
+            "user_id": user.id,
+        },
+        user_id=user.id,
+        dedup_key=collection_name,
+    )
+    if background:
+        return get_job_response(job)
+
+    raise_for_job_error(await ingestion_jobs.wait(job["id"]))
+    return {
+        "status": True,
+        "collection_name": collection_name,
+        "filename": form_data.url,
+    }
 
 
 @app.post("/web")
-def store_web(form_data: UrlForm, user=Depends(get_verified_user)):
+async def store_web(
+    form_data: UrlForm, background: bool = False, user=Depends(get_verified_user)
+):
     # "https://www.gutenberg.org/files/1727/1727-h/1727-h.htm"
-    try:
-        loader = get_web_loader(
-            form_data.url,
-            verify_ssl=app.state.config.ENABLE_RAG_WEB_LOADER_SSL_VERIFICATION,
-        )
-        data = loader.load()
-
-        collection_name = form_data.collection_name
-        if collection_name == "":
-            collection_name = calculate_sha256_string(form_data.url)[:63]
-
-        store_data_in_vector_db(data, collection_name, overwrite=True)
-        return {
-            "status": True,
+    collection_name = form_data.collection_name
+    if collection_name == "":
+        collection_name = calculate_sha256_string(form_data.url)[:63]
+
+    job = await ingestion_jobs.submit_async(
+        "web",
+        {
+            "url": form_data.url,
+            "verify_ssl": app.state.config.ENABLE_RAG_WEB_LOADER_SSL_VERIFICATION,
             "collection_name": collection_name,
-            "filename": form_data.url,
-        }
-    except Exception as e:
-        log.exception(e)
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=ERROR_MESSAGES.DEFAULT(e),
-        )
+            "user_id": user.id,
+        },
+        user_id=user.id,
+        dedup_key=collection_name,
+    )
+    if background:
+        return get_job_response(job)
+
+    raise_for_job_error(await ingestion_jobs.wait(job["id"]))
+    return {
+        "status": True,
+        "collection_name": collection_name,
+        "filename": form_data.url,
+    }
 
 
 def get_web_loader(url: Union[str, Sequence[str]], verify_ssl: bool = True):
@@ -888,13 +898,15 @@ def search_web(engine: str, query: str) -> list[SearchResult]:
 
 
 @app.post("/web/search")
-def store_web_search(form_data: SearchForm, user=Depends(get_verified_user)):
+async def store_web_search(
+    form_data: SearchForm, background: bool = False, user=Depends(get_verified_user)
+):
     try:
         logging.info(
             f"trying to web search with {app.state.config.RAG_WEB_SEARCH_ENGINE, form_data.query}"
         )
-        web_results = search_web(
-            app.state.config.RAG_WEB_SEARCH_ENGINE, form_data.query
+        web_results = await run_in_threadpool(
+            search_web, app.state.config.RAG_WEB_SEARCH_ENGINE, form_data.query
         )
     except Exception as e:
         log.exception(e)
@@ -905,31 +917,87 @@ def store_web_search(form_data: SearchForm, user=Depends(get_verified_user)):
             detail=ERROR_MESSAGES.WEB_SEARCH_ERROR(e),
         )
 
-    try:
-        urls = [result.link for result in web_results]
-        loader = get_web_loader(urls)
-        data = loader.load()
-
-        collection_name = form_data.collection_name
-        if collection_name == "":
-            collection_name = calculate_sha256_string(form_data.query)[:63]
+    urls = [result.link for result in web_results]
 
-        store_data_in_vector_db(data, collection_name, overwrite=True)
-        return {
-            "status": True,
+    collection_name = form_data.collection_name
+    if collection_name == "":
+        collection_name = calculate_sha256_string(form_data.query)[:63]
+
+    job = await ingestion_jobs.submit_async(
+        "web",
+        {
+            "url": urls,
+            "verify_ssl": True,
             "collection_name": collection_name,
-            "filenames": urls,
-        }
-    except Exception as e:
-        log.exception(e)
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=ERROR_MESSAGES.DEFAULT(e),
+            "user_id": user.id,
+        },
+        user_id=user.id,
+        dedup_key=collection_name,
+    )
+    if background:
+        return {**get_job_response(job), "filenames": urls}
+
+    raise_for_job_error(await ingestion_jobs.wait(job["id"]))
+    return {
+        "status": True,
+        "collection_name": collection_name,
+        "filenames": urls,
+    }
+
+
+def load_docs_lazily(loader) -> Iterator[Document]:
+    # Page-by-page for loaders that support it (e.g. PyPDFLoader)
+    if hasattr(loader, "lazy_load"):
+        yield from loader.lazy_load()
+    else:
+        yield from loader.load()
+
+
+def split_docs_lazily(docs, text_splitter) -> Iterator[Document]:
+    for doc in docs:
+        yield from text_splitter.split_documents([doc])
+
+
+def batch_docs(docs, batch_size: int) -> Iterator[list[Document]]:
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_ingestion_progress_callback(
+    user_id: str, collection_name: str, filename: str, job_progress=None
+):
+    def callback(chunks: int, done: bool = False):
+        if job_progress:
+            job_progress({"chunks": chunks, "done": done})
+
+        ingestion_jobs.run_coroutine(
+            emit_to_user(
+                user_id,
+                "doc-progress",
+                {
+                    "collection_name": collection_name,
+                    "filename": filename,
+                    "chunks": chunks,
+                    "done": done,
+                },
+            )
         )
 
+    return callback
+
 
 def store_data_in_vector_db(
-    data, collection_name, metadata: Optional[dict] = None, overwrite: bool = False
+    data,
+    collection_name,
+    metadata: Optional[dict] = None,
+    overwrite: bool = False,
+    progress_callback=None,
 ) -> bool:
 
     text_splitter = RecursiveCharacterTextSplitter(
@@ -938,13 +1006,13 @@ def store_data_in_vector_db(
         add_start_index=True,
     )
 
-    docs = text_splitter.split_documents(data)
-
-    if len(docs) > 0:
-        log.info(f"store_data_in_vector_db {docs}")
-        return store_docs_in_vector_db(docs, collection_name, metadata, overwrite), None
-    else:
-        raise ValueError(ERROR_MESSAGES.EMPTY_CONTENT)
+    docs = split_docs_lazily(data, text_splitter)
+    return (
+        store_docs_in_vector_db(
+            docs, collection_name, metadata, overwrite, progress_callback
+        ),
+        None,
+    )
 
 
 def store_text_in_vector_db(
@@ -959,60 +1027,124 @@ def store_text_in_vector_db(
     return store_docs_in_vector_db(docs, collection_name, overwrite=overwrite)
 
 
-def store_docs_in_vector_db(
-    docs, collection_name, metadata: Optional[dict] = None, overwrite: bool = False
-) -> bool:
-    log.info(f"store_docs_in_vector_db {docs} {collection_name}")
+def delete_collection_if_exists(collection_name: str):
+    for collection in CHROMA_CLIENT.list_collections():
+        if collection_name == collection.name:
+            log.info(f"deleting existing collection {collection_name}")
+            CHROMA_CLIENT.delete_collection(name=collection_name)
+    bm25_indexes.delete(collection_name)
 
-    texts = [doc.page_content for doc in docs]
-    metadatas = [{**doc.metadata, **(metadata if metadata else {})} for doc in docs]
 
-    # ChromaDB does not like datetime formats
-    # for meta-data so convert them to string.
-    for metadata in metadatas:
-        for key, value in metadata.items():
-            if isinstance(value, datetime):
-                metadata[key] = str(value)
-
-    try:
-        if overwrite:
-            for collection in CHROMA_CLIENT.list_collections():
-                if collection_name == collection.name:
-                    log.info(f"deleting existing collection {collection_name}")
-                    CHROMA_CLIENT.delete_collection(name=collection_name)
+def add_batch_to_collection(
+    collection, collection_name, ids, texts, metadatas, embeddings
+):
+    for batch in create_batches(
+        api=CHROMA_CLIENT,
+        ids=ids,
+        metadatas=metadatas,
+        embeddings=embeddings,
+        documents=texts,
+    ):
+        collection.add(*batch)
 
-        collection = CHROMA_CLIENT.create_collection(name=collection_name)
+    bm25_indexes.add(collection_name, ids, texts, metadatas, save=False)
 
-        embedding_func = get_embedding_function(
-            app.state.config.RAG_EMBEDDING_ENGINE,
-            app.state.config.RAG_EMBEDDING_MODEL,
-            app.state.sentence_transformer_ef,
-            app.state.config.OPENAI_API_KEY,
-            app.state.config.OPENAI_API_BASE_URL,
-            app.state.config.RAG_EMBEDDING_OPENAI_BATCH_SIZE,
-        )
 
-        embedding_texts = list(map(lambda x: x.replace("\n", " "), texts))
-        embeddings = embedding_func(embedding_texts)
+def store_docs_in_vector_db(
+    docs,
+    collection_name,
+    metadata: Optional[dict] = None,
+    overwrite: bool = False,
+    progress_callback=None,
+) -> bool:
+    """
+    Stores `docs` (a list or a generator) in a new collection. Chunks are
+    embedded in micro-batches of RAG_INGEST_BATCH_SIZE while the previous
+    batch is written to Chroma, so a large document is never held in memory
+    as a whole.
+    """
+    log.info(f"store_docs_in_vector_db {collection_name}")
 
-        for batch in create_batches(
-            api=CHROMA_CLIENT,
-            ids=[str(uuid.uuid4()) for _ in texts],
-            metadatas=metadatas,
-            embeddings=embeddings,
-            documents=texts,
-        ):
-            collection.add(*batch)
+    try:
+        if overwrite:
+            delete_collection_if_exists(collection_name)
 
-        return True
+        collection = CHROMA_CLIENT.create_collection(name=collection_name)
     except Exception as e:
+        # The collection already exists, so the content was stored before
         if e.__class__.__name__ == "UniqueConstraintError":
             return True
 
         log.exception(e)
-
         return False
 
+    embedding_func = get_embedding_function(
+        app.state.config.RAG_EMBEDDING_ENGINE,
+        app.state.config.RAG_EMBEDDING_MODEL,
+        app.state.sentence_transformer_ef,
+        app.state.config.OPENAI_API_KEY,
+        app.state.config.OPENAI_API_BASE_URL,
+        app.state.config.RAG_EMBEDDING_OPENAI_BATCH_SIZE,
+    )
+
+    total = 0
+    try:
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            for batch in batch_docs(docs, RAG_INGEST_BATCH_SIZE):
+                texts = [doc.page_content for doc in batch]
+                metadatas = [
+                    {**doc.metadata, **(metadata if metadata else {})} for doc in batch
+                ]
+
+                # ChromaDB does not like datetime formats
+                # for meta-data so convert them to string.
+                for meta in metadatas:
+                    for key, value in meta.items():
+                        if isinstance(value, datetime):
+                            meta[key] = str(value)
+
+                embeddings = embedding_func(
+                    list(map(lambda x: x.replace("\n", " "), texts))
+                )
+                if embeddings is None:
+                    raise Exception("Failed to generate embeddings")
+
+                # Wait for the previous batch so at most one write is in flight
+                if pending is not None:
+                    pending.result()
+
+                pending = writer.submit(
+                    add_batch_to_collection,
+                    collection,
+                    collection_name,
+                    [str(uuid.uuid4()) for _ in texts],
+                    texts,
+                    metadatas,
+                    embeddings,
+                )
+
+                total += len(texts)
+                if progress_callback:
+                    progress_callback(total)
+
+            if pending is not None:
+                pending.result()
+    except Exception:
+        # Don't leave a partial collection behind, it would be taken as complete
+        delete_collection_if_exists(collection_name)
+        raise
+
+    if total == 0:
+        delete_collection_if_exists(collection_name)
+        raise ValueError(ERROR_MESSAGES.EMPTY_CONTENT)
+
+    bm25_indexes.save(collection_name)
+    if progress_callback:
+        progress_callback(total, done=True)
+
+    return True
+
 
 class TikaLoader:
     def __init__(self, file_path, mime_type=None):
@@ -1162,10 +1294,22 @@ def get_loader(filename: str, file_content_type: str, file_path: str):
     return loader, known_type
 
 
+def save_upload_file(file, file_path: str) -> str:
+    with open(file_path, "wb") as f:
+        file_hash, _ = copy_file_and_calculate_sha256(file, f)
+    return file_hash
+
+
+def get_file_hash(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return calculate_sha256(f)
+
+
 @app.post("/doc")
-def store_doc(
+async def store_doc(
     collection_name: Optional[str] = Form(None),
     file: UploadFile = File(...),
+    background: bool = False,
     user=Depends(get_verified_user),
 ):
     # "https://www.gutenberg.org/files/1727/1727-h/1727-h.htm"
@@ -1176,47 +1320,43 @@ def store_doc(
         filename = os.path.basename(unsanitized_filename)
 
         file_path = f"{UPLOAD_DIR}/{filename}"
+        file_hash = await run_in_threadpool(save_upload_file, file.file, file_path)
 
-        contents = file.file.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
-            f.close()
-
-        f = open(file_path, "rb")
         if collection_name is None:
-            collection_name = calculate_sha256(f)[:63]
-        f.close()
-
-        loader, known_type = get_loader(filename, file.content_type, file_path)
-        data = loader.load()
-
-        try:
-            result = store_data_in_vector_db(data, collection_name)
-
-            if result:
-                return {
-                    "status": True,
-                    "collection_name": collection_name,
-                    "filename": filename,
-                    "known_type": known_type,
-                }
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=e,
-            )
+            collection_name = file_hash[:63]
+
+        job = await ingestion_jobs.submit_async(
+            "doc",
+            {
+                "file_path": file_path,
+                "filename": filename,
+                "name": filename,
+                "content_type": file.content_type,
+                "collection_name": collection_name,
+                "metadata": None,
+                "user_id": user.id,
+            },
+            user_id=user.id,
+            dedup_key=f"{collection_name}:{file_hash}",
+        )
     except Exception as e:
         log.exception(e)
-        if "No pandoc was found" in str(e):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=ERROR_MESSAGES.PANDOC_NOT_INSTALLED,
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=ERROR_MESSAGES.DEFAULT(e),
-            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ERROR_MESSAGES.DEFAULT(e),
+        )
+
+    if background:
+        return get_job_response(job)
+
+    job = await ingestion_jobs.wait(job["id"])
+    raise_for_job_error(job)
+    return {
+        "status": True,
+        "collection_name": collection_name,
+        "filename": filename,
+        "known_type": job["result"]["known_type"],
+    }
 
 
 class ProcessDocForm(BaseModel):
@@ -1225,60 +1365,57 @@ class ProcessDocForm(BaseModel):
 
 
 @app.post("/process/doc")
-def process_doc(
+async def process_doc(
     form_data: ProcessDocForm,
+    background: bool = False,
     user=Depends(get_verified_user),
 ):
     try:
-        file = Files.get_file_by_id(form_data.file_id)
+        file = await AsyncFiles.get_file_by_id(form_data.file_id)
         file_path = file.meta.get("path", f"{UPLOAD_DIR}/{file.filename}")
+        name = file.meta.get("name", file.filename)
 
-        f = open(file_path, "rb")
+        # Uploads record their hash, older files are hashed here
+        file_hash = file.meta.get("hash")
+        if file_hash is None:
+            file_hash = await run_in_threadpool(get_file_hash, file_path)
 
         collection_name = form_data.collection_name
         if collection_name is None:
-            collection_name = calculate_sha256(f)[:63]
-        f.close()
-
-        loader, known_type = get_loader(
-            file.filename, file.meta.get("content_type"), file_path
+            collection_name = file_hash[:63]
+
+        job = await ingestion_jobs.submit_async(
+            "doc",
+            {
+                "file_path": file_path,
+                "filename": file.filename,
+                "name": name,
+                "content_type": file.meta.get("content_type"),
+                "collection_name": collection_name,
+                "metadata": {"file_id": form_data.file_id, "name": name},
+                "user_id": user.id,
+            },
+            user_id=user.id,
+            dedup_key=f"{collection_name}:{file_hash}",
         )
-        data = loader.load()
-
-        try:
-            result = store_data_in_vector_db(
-                data,
-                collection_name,
-                {
-                    "file_id": form_data.file_id,
-                    "name": file.meta.get("name", file.filename),
-                },
-            )
-
-            if result:
-                return {
-                    "status": True,
-                    "collection_name": collection_name,
-                    "known_type": known_type,
-                    "filename": file.meta.get("name", file.filename),
-                }
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=e,
-            )
     except Exception as e:
         log.exception(e)
-        if "No pandoc was found" in str(e):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=ERROR_MESSAGES.PANDOC_NOT_INSTALLED,
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=ERROR_MESSAGES.DEFAULT(e),
-            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ERROR_MESSAGES.DEFAULT(e),
+        )
+
+    if background:
+        return get_job_response(job)
+
+    job = await ingestion_jobs.wait(job["id"])
+    raise_for_job_error(job)
+    return {
+        "status": True,
+        "collection_name": collection_name,
+        "known_type": job["result"]["known_type"],
+        "filename": name,
+    }
 
 
 class TextRAGForm(BaseModel):
@@ -1312,70 +1449,191 @@ def store_text(
         )
 
 
-@app.get("/scan")
-def scan_docs_dir(user=Depends(get_admin_user)):
-    for path in Path(DOCS_DIR).rglob("./**/*"):
-        try:
-            if path.is_file() and not path.name.startswith("."):
-                tags = extract_folders_after_data_docs(path)
-                filename = path.name
-                file_content_type = mimetypes.guess_type(path)
+def get_docs_dir_files() -> list[Path]:
+    return [
+        path
+        for path in Path(DOCS_DIR).rglob("./**/*")
+        if path.is_file() and not path.name.startswith(".")
+    ]
 
-                f = open(path, "rb")
-                collection_name = calculate_sha256(f)[:63]
-                f.close()
 
-                loader, known_type = get_loader(
-                    filename, file_content_type[0], str(path)
+@app.get("/scan")
+async def scan_docs_dir(background: bool = False, user=Depends(get_admin_user)):
+    jobs = []
+    for path in await run_in_threadpool(get_docs_dir_files):
+        try:
+            file_hash = await run_in_threadpool(get_file_hash, str(path))
+            collection_name = file_hash[:63]
+
+            jobs.append(
+                await ingestion_jobs.submit_async(
+                    "scan",
+                    {
+                        "file_path": str(path),
+                        "filename": path.name,
+                        "name": path.name,
+                        "content_type": mimetypes.guess_type(path)[0],
+                        "collection_name": collection_name,
+                        "metadata": None,
+                        "tags": extract_folders_after_data_docs(path),
+                        "user_id": user.id,
+                    },
+                    user_id=user.id,
+                    # Identical files under different names still get a document each
+                    dedup_key=f"{collection_name}:{path}",
                 )
-                data = loader.load()
-
-                try:
-                    result = store_data_in_vector_db(data, collection_name)
-
-                    if result:
-                        sanitized_filename = sanitize_filename(filename)
-                        doc = Documents.get_doc_by_name(sanitized_filename)
-
-                        if doc is None:
-                            doc = Documents.insert_new_doc(
-                                user.id,
-                                DocumentForm(
-                                    **{
-                                        "name": sanitized_filename,
-                                        "title": filename,
-                                        "collection_name": collection_name,
-                                        "filename": filename,
-                                        "content": (
-                                            json.dumps(
-                                                {
-                                                    "tags": list(
-                                                        map(
-                                                            lambda name: {"name": name},
-                                                            tags,
-                                                        )
-                                                    )
-                                                }
-                                            )
-                                            if len(tags)
-                                            else "{}"
-                                        ),
-                                    }
-                                ),
-                            )
-                except Exception as e:
-                    log.exception(e)
-                    pass
-
+            )
         except Exception as e:
             log.exception(e)
 
+    if background:
+        return [get_job_response(job) for job in jobs]
+
+    for job in jobs:
+        job = await ingestion_jobs.wait(job["id"])
+        if job and job["status"] == "failed":
+            log.error(f"Failed to scan {job['params']['file_path']}: {job['error']}")
+
     return True
 
 
+############################
+# Ingestion jobs
+############################
+
+
+def get_job_response(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "type": job["type"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+def raise_for_job_error(job: Optional[dict]):
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=ERROR_MESSAGES.DEFAULT("Ingestion job expired"),
+        )
+
+    if job["status"] == "failed":
+        if "No pandoc was found" in (job["error"] or ""):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=ERROR_MESSAGES.PANDOC_NOT_INSTALLED,
+            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ERROR_MESSAGES.DEFAULT(job["error"]),
+        )
+
+
+def store_job_data(params: dict, loader, progress) -> bool:
+    result, _ = store_data_in_vector_db(
+        load_docs_lazily(loader),
+        params["collection_name"],
+        params.get("metadata"),
+        overwrite=params.get("overwrite", False),
+        progress_callback=get_ingestion_progress_callback(
+            params["user_id"], params["collection_name"], params["name"], progress
+        ),
+    )
+    if not result:
+        raise Exception(f"Failed to store {params['name']}")
+    return result
+
+
+@ingestion_jobs.register("doc")
+def run_doc_job(params: dict, progress) -> dict:
+    loader, known_type = get_loader(
+        params["filename"], params["content_type"], params["file_path"]
+    )
+    store_job_data(params, loader, progress)
+    return {"collection_name": params["collection_name"], "known_type": known_type}
+
+
+@ingestion_jobs.register("scan")
+def run_scan_job(params: dict, progress) -> dict:
+    result = run_doc_job(params, progress)
+
+    filename = params["filename"]
+    tags = params["tags"]
+
+    sanitized_filename = sanitize_filename(filename)
+    doc = Documents.get_doc_by_name(sanitized_filename)
+
+    if doc is None:
+        doc = Documents.insert_new_doc(
+            params["user_id"],
+            DocumentForm(
+                **{
+                    "name": sanitized_filename,
+                    "title": filename,
+                    "collection_name": params["collection_name"],
+                    "filename": filename,
+                    "content": (
+                        json.dumps(
+                            {"tags": list(map(lambda name: {"name": name}, tags))}
+                        )
+                        if len(tags)
+                        else "{}"
+                    ),
+                }
+            ),
+        )
+    return result
+
+
+@ingestion_jobs.register("web")
+def run_web_job(params: dict, progress) -> dict:
+    loader = get_web_loader(params["url"], verify_ssl=params["verify_ssl"])
+    store_job_data(
+        {**params, "name": str(params["url"]), "overwrite": True}, loader, progress
+    )
+    return {"collection_name": params["collection_name"]}
+
+
+@ingestion_jobs.register("youtube")
+def run_youtube_job(params: dict, progress) -> dict:
+    loader = YoutubeLoader.from_youtube_url(
+        params["url"],
+        add_video_info=True,
+        language=app.state.config.YOUTUBE_LOADER_LANGUAGE,
+        translation=app.state.YOUTUBE_LOADER_TRANSLATION,
+    )
+    store_job_data(
+        {**params, "name": params["url"], "overwrite": True}, loader, progress
+    )
+    return {"collection_name": params["collection_name"]}
+
+
+@app.get("/jobs")
+async def get_ingestion_jobs(user=Depends(get_verified_user)):
+    return [get_job_response(job) for job in await ingestion_jobs.list_async(user.id)]
+
+
+@app.get("/jobs/{job_id}")
+async def get_ingestion_job(job_id: str, user=Depends(get_verified_user)):
+    job = await ingestion_jobs.get_async(job_id)
+    if job is None or (job["user_id"] != user.id and user.role != "admin"):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=ERROR_MESSAGES.NOT_FOUND,
+        )
+    return get_job_response(job)
+
+
 @app.get("/reset/db")
 def reset_vector_db(user=Depends(get_admin_user)):
     CHROMA_CLIENT.reset()
+    bm25_indexes.reset()
 
 
 @app.get("/reset/uploads")
@@ -1417,6 +1675,7 @@ def reset(user=Depends(get_admin_user)) -> bool:
 
     try:
         CHROMA_CLIENT.reset()
+        bm25_indexes.reset()
     except Exception as e:
         log.exception(e)
 
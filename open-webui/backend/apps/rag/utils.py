@@ -1,7 +1,10 @@
 import os
+import heapq
 import logging
 import requests
 
+from concurrent.futures import ThreadPoolExecutor
+
 from typing import Union
 
 from apps.ollama.main import (
@@ -12,7 +15,6 @@
 from huggingface_hub import snapshot_download
 
 from langchain_core.documents import Document
-from langchain_community.retrievers import BM25Retriever
 from langchain.retrievers import (
     ContextualCompressionRetriever,
     EnsembleRetriever,
@@ -20,12 +22,29 @@
 
 from typing import Optional
 
+from apps.rag.bm25_index import bm25_indexes
+from apps.rag.embedding_cache import embedding_cache
+
+from utils.executor import MeteredExecutor
 from utils.misc import get_last_user_message, add_or_update_system_message
-from config import SRC_LOG_LEVELS, CHROMA_CLIENT
+from config import (
+    SRC_LOG_LEVELS,
+    CHROMA_CLIENT,
+    RAG_RETRIEVAL_WORKERS,
+    RAG_EXECUTOR_WORKERS,
+)
 
 log = logging.getLogger(__name__)
 log.setLevel(SRC_LOG_LEVELS["RAG"])
 
+# Shared pool used to query several collections at once
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=RAG_RETRIEVAL_WORKERS, thread_name_prefix="rag-retrieval"
+)
+
+# Runs whole retrievals (embedding, Chroma queries, reranking) for async callers
+rag_executor = MeteredExecutor(RAG_EXECUTOR_WORKERS, "rag")
+
 
 def query_doc(
     collection_name: str,
@@ -58,13 +77,11 @@ def query_doc_with_hybrid_search(
 ):
     try:
         collection = CHROMA_CLIENT.get_collection(name=collection_name)
-        documents = collection.get()  # get all documents
 
-        bm25_retriever = BM25Retriever.from_texts(
-            texts=documents.get("documents"),
-            metadatas=documents.get("metadatas"),
+        bm25_retriever = BM25IndexRetriever(
+            index=bm25_indexes.get(collection_name, collection),
+            top_n=k,
         )
-        bm25_retriever.k = k
 
         chroma_retriever = ChromaRetriever(
             collection=collection,
@@ -101,44 +118,87 @@ def query_doc_with_hybrid_search(
 
 
 def merge_and_sort_query_results(query_results, k, reverse=False):
-    # Initialize lists to store combined data
-    combined_distances = []
-    combined_documents = []
-    combined_metadatas = []
-
-    for data in query_results:
-        combined_distances.extend(data["distances"][0])
-        combined_documents.extend(data["documents"][0])
-        combined_metadatas.extend(data["metadatas"][0])
-
-    # Create a list of tuples (distance, document, metadata)
-    combined = list(zip(combined_distances, combined_documents, combined_metadatas))
-
-    # Sort the list based on distances
-    combined.sort(key=lambda x: x[0], reverse=reverse)
-
-    # We don't have anything :-(
-    if not combined:
-        sorted_distances = []
-        sorted_documents = []
-        sorted_metadatas = []
-    else:
-        # Unzip the sorted list
-        sorted_distances, sorted_documents, sorted_metadatas = zip(*combined)
-
-        # Slicing the lists to include only k elements
-        sorted_distances = list(sorted_distances)[:k]
-        sorted_documents = list(sorted_documents)[:k]
-        sorted_metadatas = list(sorted_metadatas)[:k]
-
-    # Create the output dictionary
-    result = {
-        "distances": [sorted_distances],
-        "documents": [sorted_documents],
-        "metadatas": [sorted_metadatas],
+    combined = (
+        item
+        for data in query_results
+        for item in zip(
+            data["distances"][0], data["documents"][0], data["metadatas"][0]
+        )
+    )
+
+    # Keep only the k best results instead of sorting everything
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    top = select(k, combined, key=lambda x: x[0])
+
+    return {
+        "distances": [[distance for distance, _, _ in top]],
+        "documents": [[document for _, document, _ in top]],
+        "metadatas": [[metadata for _, _, metadata in top]],
+    }
+
+
+def get_query_embedding_function(embedding_function, query: str):
+    """
+    Embeds the query once and returns an embedding function that reuses it,
+    so concurrent per-collection lookups don't embed the same query again.
+    """
+    try:
+        query_embedding = embedding_function(query)
+    except Exception as e:
+        log.exception(e)
+        return embedding_function
+
+    def func(text):
+        if isinstance(text, str) and text == query:
+            return query_embedding
+        return embedding_function(text)
+
+    return func
+
+
+def query_collections(collection_names, query_func) -> dict[str, dict]:
+    """
+    Runs `query_func(collection_name)` for every collection on the retrieval
+    executor. Collections that fail (e.g. don't exist) are left out.
+    """
+    futures = {
+        collection_name: retrieval_executor.submit(query_func, collection_name)
+        for collection_name in collection_names
     }
 
-    return result
+    results = {}
+    for collection_name, future in futures.items():
+        try:
+            results[collection_name] = future.result()
+        except Exception as e:
+            log.debug(f"query_collections: {collection_name} failed: {e}")
+    return results
+
+
+def get_collection_query_func(
+    query: str,
+    embedding_function,
+    k: int,
+    hybrid_search: bool = False,
+    reranking_function=None,
+    r: float = 0.0,
+):
+    if hybrid_search:
+        return lambda collection_name: query_doc_with_hybrid_search(
+            collection_name=collection_name,
+            query=query,
+            embedding_function=embedding_function,
+            k=k,
+            reranking_function=reranking_function,
+            r=r,
+        )
+
+    return lambda collection_name: query_doc(
+        collection_name=collection_name,
+        query=query,
+        embedding_function=embedding_function,
+        k=k,
+    )
 
 
 def query_collection(
@@ -147,19 +207,13 @@ def query_collection(
     embedding_function,
     k: int,
 ):
-    results = []
-    for collection_name in collection_names:
-        try:
-            result = query_doc(
-                collection_name=collection_name,
-                query=query,
-                k=k,
-                embedding_function=embedding_function,
-            )
-            results.append(result)
-        except Exception:
-            pass
-    return merge_and_sort_query_results(results, k=k)
+    query_func = get_collection_query_func(
+        query=query,
+        embedding_function=get_query_embedding_function(embedding_function, query),
+        k=k,
+    )
+    results = query_collections(collection_names, query_func)
+    return merge_and_sort_query_results(results.values(), k=k)
 
 
 def query_collection_with_hybrid_search(
@@ -170,21 +224,16 @@ def query_collection_with_hybrid_search(
     reranking_function,
     r: float,
 ):
-    results = []
-    for collection_name in collection_names:
-        try:
-            result = query_doc_with_hybrid_search(
-                collection_name=collection_name,
-                query=query,
-                embedding_function=embedding_function,
-                k=k,
-                reranking_function=reranking_function,
-                r=r,
-            )
-            results.append(result)
-        except Exception:
-            pass
-    return merge_and_sort_query_results(results, k=k, reverse=True)
+    query_func = get_collection_query_func(
+        query=query,
+        embedding_function=get_query_embedding_function(embedding_function, query),
+        k=k,
+        hybrid_search=True,
+        reranking_function=reranking_function,
+        r=r,
+    )
+    results = query_collections(collection_names, query_func)
+    return merge_and_sort_query_results(results.values(), k=k, reverse=True)
 
 
 def rag_template(template: str, context: str, query: str):
@@ -202,7 +251,11 @@ def get_embedding_function(
     batch_size,
 ):
     if embedding_engine == "":
-        return lambda query: embedding_function.encode(query).tolist()
+        return embedding_cache.wrap(
+            embedding_engine,
+            embedding_model,
+            lambda query: embedding_function.encode(query).tolist(),
+        )
     elif embedding_engine in ["ollama", "openai"]:
         if embedding_engine == "ollama":
             func = lambda query: generate_ollama_embeddings(
@@ -233,7 +286,11 @@ def generate_multiple(query, f):
             else:
                 return f(query)
 
-        return lambda query: generate_multiple(query, func)
+        return embedding_cache.wrap(
+            embedding_engine,
+            embedding_model,
+            lambda query: generate_multiple(query, func),
+        )
 
 
 def get_rag_context(
@@ -249,11 +306,9 @@ def get_rag_context(
     query = get_last_user_message(messages)
 
     extracted_collections = []
-    relevant_contexts = []
+    file_collections = []
 
     for file in files:
-        context = None
-
         collection_names = (
             file["collection_names"]
             if file["type"] == "collection"
@@ -265,26 +320,42 @@ def get_rag_context(
             log.debug(f"skipping {file} as it has already been extracted")
             continue
 
+        file_collections.append((file, collection_names))
+        extracted_collections.extend(collection_names)
+
+    # Embed the query once and query every collection of every file concurrently
+    query_collection_names = [
+        name
+        for file, collection_names in file_collections
+        if file["type"] != "text"
+        for name in collection_names
+    ]
+
+    results = {}
+    if query_collection_names:
+        query_func = get_collection_query_func(
+            query=query,
+            embedding_function=get_query_embedding_function(embedding_function, query),
+            k=k,
+            hybrid_search=hybrid_search,
+            reranking_function=reranking_function,
+            r=r,
+        )
+        results = query_collections(query_collection_names, query_func)
+
+    relevant_contexts = []
+    for file, collection_names in file_collections:
+        context = None
+
         try:
             if file["type"] == "text":
                 context = file["content"]
             else:
-                if hybrid_search:
-                    context = query_collection_with_hybrid_search(
-                        collection_names=collection_names,
-                        query=query,
-                        embedding_function=embedding_function,
-                        k=k,
-                        reranking_function=reranking_function,
-                        r=r,
-                    )
-                else:
-                    context = query_collection(
-                        collection_names=collection_names,
-                        query=query,
-                        embedding_function=embedding_function,
-                        k=k,
-                    )
+                context = merge_and_sort_query_results(
+                    [results[name] for name in collection_names if name in results],
+                    k=k,
+                    reverse=hybrid_search,
+                )
         except Exception as e:
             log.exception(e)
             context = None
@@ -292,8 +363,6 @@ def get_rag_context(
         if context:
             relevant_contexts.append({**context, "source": file})
 
-        extracted_collections.extend(collection_names)
-
     contexts = []
     citations = []
 
@@ -320,6 +389,10 @@ def get_rag_context(
     return contexts, citations
 
 
+async def get_rag_context_async(**kwargs):
+    return await rag_executor.run(get_rag_context, **kwargs)
+
+
 def get_model_path(model: str, update_model: bool = False):
     # Construct huggingface_hub kwargs with local_files_only to return the snapshot path
     cache_dir = os.getenv("SENTENCE_TRANSFORMERS_HOME")
@@ -434,6 +507,22 @@ def _get_relevant_documents(
         return results
 
 
+class BM25IndexRetriever(BaseRetriever):
+    index: Any
+    top_n: int
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+    ) -> list[Document]:
+        return [
+            Document(metadata=metadata, page_content=text)
+            for _, text, metadata in self.index.search(query, self.top_n)
+        ]
+
+
 import operator
 
 from typing import Optional, Sequence
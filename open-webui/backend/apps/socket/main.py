@@ -140,6 +140,11 @@ async def disconnect(sid):
         print(f"Unknown session ID {sid} disconnected")
 
 
+async def emit_to_user(user_id, event, data):
+    for sid in USER_POOL.get(user_id, []):
+        await sio.emit(event, data, to=sid)
+
+
 def get_event_emitter(request_info):
     async def __event_emitter__(event_data):
         await sio.emit(
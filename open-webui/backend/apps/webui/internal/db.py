@@ -1,6 +1,8 @@
 import os
 import logging
 import json
+import threading
+import time
 from contextlib import contextmanager
 
 from peewee_migrate import Router
@@ -9,12 +11,25 @@
 from typing import Optional, Any
 from typing_extensions import Self
 
-from sqlalchemy import create_engine, types, Dialect
+from sqlalchemy import create_engine, event, types, Dialect
+from sqlalchemy.pool import NullPool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.sql.type_api import _T
 
-from config import SRC_LOG_LEVELS, DATA_DIR, DATABASE_URL, BACKEND_DIR
+from utils.executor import MeteredExecutor
+from config import (
+    SRC_LOG_LEVELS,
+    DATA_DIR,
+    DATABASE_URL,
+    BACKEND_DIR,
+    DATABASE_POOL_SIZE,
+    DATABASE_POOL_MAX_OVERFLOW,
+    DATABASE_POOL_TIMEOUT,
+    DATABASE_POOL_RECYCLE,
+    DATABASE_SQLITE_WAL,
+    DATABASE_SLOW_QUERY_THRESHOLD,
+)
 
 log = logging.getLogger(__name__)
 log.setLevel(SRC_LOG_LEVELS["DB"])
@@ -87,8 +102,75 @@ def handle_peewee_migration(DATABASE_URL):
     engine = create_engine(
         SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
     )
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if DATABASE_SQLITE_WAL:
+            # Readers no longer block on the writer and vice versa
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+elif DATABASE_POOL_SIZE > 0:
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=DATABASE_POOL_MAX_OVERFLOW,
+        pool_timeout=DATABASE_POOL_TIMEOUT,
+        pool_recycle=DATABASE_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
 else:
-    engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=True)
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL, pool_pre_ping=True, poolclass=NullPool
+    )
+
+
+class QueryMetrics:
+    def __init__(self, slow_query_threshold: float = DATABASE_SLOW_QUERY_THRESHOLD):
+        self.slow_query_threshold = slow_query_threshold
+        self.lock = threading.Lock()
+
+        self.queries = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.slow_queries = 0
+
+    def record(self, duration: float, statement: str):
+        with self.lock:
+            self.queries += 1
+            self.total_time += duration
+            self.max_time = max(self.max_time, duration)
+            if duration >= self.slow_query_threshold:
+                self.slow_queries += 1
+                log.warning(f"Slow query ({duration:.3f}s): {statement[:200]}")
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            return {
+                "queries": self.queries,
+                "avg_time": (
+                    round(self.total_time / self.queries, 6) if self.queries else 0.0
+                ),
+                "max_time": round(self.max_time, 6),
+                "slow_queries": self.slow_queries,
+            }
+
+
+query_metrics = QueryMetrics()
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_time = conn.info["query_start_time"].pop()
+    query_metrics.record(time.perf_counter() - start_time, statement)
 
 
 SessionLocal = sessionmaker(
@@ -108,3 +190,47 @@ def get_session():
 
 
 get_db = contextmanager(get_session)
+
+
+# Runs the blocking queries of async routes. Sized to the connection pool so
+# queries wait here rather than holding a thread while waiting for a connection.
+db_executor = MeteredExecutor(
+    (
+        DATABASE_POOL_SIZE + DATABASE_POOL_MAX_OVERFLOW
+        if DATABASE_POOL_SIZE > 0 and "sqlite" not in SQLALCHEMY_DATABASE_URL
+        else 8
+    ),
+    "db",
+)
+
+
+class AsyncTable:
+    """
+    Async variants of a *Table's methods, e.g. `await AsyncChats.get_chat_by_id(id)`.
+    They run the same queries on `db_executor` instead of on the event loop.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __getattr__(self, name: str):
+        method = getattr(self.table, name)
+
+        async def run(*args, **kwargs):
+            return await db_executor.run(method, *args, **kwargs)
+
+        return run
+
+
+def get_db_metrics() -> dict:
+    pool = engine.pool
+    metrics = {"pool": pool.status(), "queries": query_metrics.get_metrics()}
+    if hasattr(pool, "checkedout"):
+        metrics["pool"] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checked_in": pool.checkedin(),
+        }
+    metrics["executor"] = db_executor.get_metrics()
+    return metrics
@@ -17,7 +17,6 @@
 )
 from apps.webui.models.functions import Functions
 from apps.webui.models.models import Models
-from apps.webui.utils import load_function_module_by_id
 
 from utils.misc import (
     openai_chat_chunk_message_template,
@@ -27,6 +26,8 @@
 )
 
 from utils.tools import get_tools
+from utils.function_executor import function_executor
+from utils.function_plans import function_plans
 
 from config import (
     SHOW_ADMIN_DETAILS,
@@ -54,7 +55,6 @@
 
 from apps.socket.main import get_event_call, get_event_emitter
 
-import inspect
 import json
 
 from typing import Iterator, Generator, AsyncGenerator
@@ -130,17 +130,7 @@ async def get_status():
 
 
 def get_function_module(pipe_id: str):
-    # Check if function is already loaded
-    if pipe_id not in app.state.FUNCTIONS:
-        function_module, _, _ = load_function_module_by_id(pipe_id)
-        app.state.FUNCTIONS[pipe_id] = function_module
-    else:
-        function_module = app.state.FUNCTIONS[pipe_id]
-
-    if hasattr(function_module, "valves") and hasattr(function_module, "Valves"):
-        valves = Functions.get_function_valves_by_id(pipe_id)
-        function_module.valves = function_module.Valves(**(valves if valves else {}))
-    return function_module
+    return function_plans.get_function(app, pipe_id).module
 
 
 async def get_pipe_models():
@@ -156,7 +146,9 @@ async def get_pipe_models():
 
             # Check if pipes is a function or a list
             if callable(function_module.pipes):
-                manifold_pipes = function_module.pipes()
+                manifold_pipes = await function_executor.run(
+                    pipe.id, function_module.pipes
+                )
             else:
                 manifold_pipes = function_module.pipes
 
@@ -200,18 +192,19 @@ async def get_pipe_models():
     return pipe_models
 
 
-async def execute_pipe(pipe, params):
-    if inspect.iscoroutinefunction(pipe):
-        return await pipe(**params)
-    else:
-        return pipe(**params)
+async def execute_pipe(pipe_id: str, pipe, params):
+    return await function_executor.run(pipe_id, pipe, **params)
 
 
-async def get_message_content(res: str | Generator | AsyncGenerator) -> str:
+async def get_message_content(
+    pipe_id: str, res: str | Generator | AsyncGenerator
+) -> str:
     if isinstance(res, str):
         return res
     if isinstance(res, Generator):
-        return "".join(map(str, res))
+        return "".join(
+            [str(stream) async for stream in function_executor.iterate(pipe_id, res)]
+        )
     if isinstance(res, AsyncGenerator):
         return "".join([str(stream) async for stream in res])
 
@@ -245,31 +238,17 @@ def get_pipe_id(form_data: dict) -> str:
 
 def get_function_params(function_module, form_data, user, extra_params={}):
     pipe_id = get_pipe_id(form_data)
-    # Get the signature of the function
-    sig = inspect.signature(function_module.pipe)
-    params = {"body": form_data}
-
-    for key, value in extra_params.items():
-        if key in sig.parameters:
-            params[key] = value
+    plan = function_plans.get_function(app, pipe_id)
+    params = {"body": form_data, **plan.get_params("pipe", extra_params)}
 
-    if "__user__" in sig.parameters:
+    if "__user__" in plan.get_parameters("pipe"):
         __user__ = {
             "id": user.id,
             "email": user.email,
             "name": user.name,
             "role": user.role,
         }
-
-        try:
-            if hasattr(function_module, "UserValves"):
-                __user__["valves"] = function_module.UserValves(
-                    **Functions.get_user_valves_by_id_and_user_id(pipe_id, user.id)
-                )
-        except Exception as e:
-            print(e)
-
-        params["__user__"] = __user__
+        params["__user__"] = plan.get_user("pipe", __user__, user)
     return params
 
 
@@ -327,7 +306,7 @@ async def generate_function_chat_completion(form_data, user):
 
         async def stream_content():
             try:
-                res = await execute_pipe(pipe, params)
+                res = await execute_pipe(pipe_id, pipe, params)
 
                 # Directly return if the response is a StreamingResponse
                 if isinstance(res, StreamingResponse):
@@ -348,7 +327,7 @@ async def stream_content():
                 yield f"data: {json.dumps(message)}\n\n"
 
             if isinstance(res, Iterator):
-                for line in res:
+                async for line in function_executor.iterate(pipe_id, res):
                     yield process_line(form_data, line)
 
             if isinstance(res, AsyncGenerator):
@@ -366,7 +345,7 @@ async def stream_content():
         return StreamingResponse(stream_content(), media_type="text/event-stream")
     else:
         try:
-            res = await execute_pipe(pipe, params)
+            res = await execute_pipe(pipe_id, pipe, params)
 
         except Exception as e:
             print(f"Error: {e}")
@@ -377,5 +356,5 @@ async def stream_content():
         if isinstance(res, BaseModel):
             return res.model_dump()
 
-        message = await get_message_content(res)
+        message = await get_message_content(pipe_id, res)
         return openai_chat_completion_message_template(form_data["model"], message)
@@ -5,9 +5,9 @@
 import uuid
 import time
 
-from sqlalchemy import Column, String, BigInteger, Boolean, Text
+from sqlalchemy import Column, String, BigInteger, Boolean, Text, Index, and_, or_
 
-from apps.webui.internal.db import Base, get_db
+from apps.webui.internal.db import Base, get_db, AsyncTable
 
 
 ####################
@@ -29,6 +29,12 @@ class Chat(Base):
     share_id = Column(Text, unique=True, nullable=True)
     archived = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index(
+            "chat_user_id_archived_updated_at_idx", "user_id", "archived", "updated_at"
+        ),
+    )
+
 
 class ChatModel(BaseModel):
     model_config = ConfigDict(from_attributes=True)
@@ -76,8 +82,64 @@ class ChatTitleIdResponse(BaseModel):
     created_at: int
 
 
+####################
+# Cursors
+####################
+
+
+def get_chat_cursor(chat) -> str:
+    """
+    Position of `chat` in lists ordered by most recently updated, for
+    fetching the chats after it.
+    """
+    return f"{chat.updated_at}:{chat.id}"
+
+
+def parse_chat_cursor(cursor: str) -> tuple[int, str]:
+    updated_at, id = cursor.split(":", 1)
+    return int(updated_at), id
+
+
+def chat_to_json(chat: ChatModel) -> str:
+    """
+    Serializes `chat` as a ChatResponse. The chat body is stored as JSON
+    already, so it is spliced in rather than parsed and dumped again.
+    """
+    fields = json.dumps(chat.model_dump(exclude={"chat"}))
+    return fields[:-1] + ', "chat": ' + (chat.chat or "{}") + "}"
+
+
 class ChatTable:
 
+    def _order_by_cursor(self, query, cursor: Optional[str] = None):
+        if cursor:
+            updated_at, id = parse_chat_cursor(cursor)
+            query = query.filter(
+                or_(
+                    Chat.updated_at < updated_at,
+                    and_(Chat.updated_at == updated_at, Chat.id < id),
+                )
+            )
+        return query.order_by(Chat.updated_at.desc(), Chat.id.desc())
+
+    def _get_title_id_list(
+        self, query, skip: int = 0, limit: int = -1, cursor: Optional[str] = None
+    ) -> list[ChatTitleIdResponse]:
+        query = self._order_by_cursor(query, cursor).with_entities(
+            Chat.id, Chat.title, Chat.updated_at, Chat.created_at
+        )
+        if not cursor and skip:
+            query = query.offset(skip)
+        if limit is not None and limit >= 0:
+            query = query.limit(limit)
+
+        return [
+            ChatTitleIdResponse(
+                id=id, title=title, updated_at=updated_at, created_at=created_at
+            )
+            for id, title, updated_at, created_at in query.all()
+        ]
+
     def insert_new_chat(self, user_id: str, form_data: ChatForm) -> Optional[ChatModel]:
         with get_db() as db:
 
@@ -214,18 +276,15 @@ def archive_all_chats_by_user_id(self, user_id: str) -> bool:
             return False
 
     def get_archived_chat_list_by_user_id(
-        self, user_id: str, skip: int = 0, limit: int = 50
-    ) -> list[ChatModel]:
+        self,
+        user_id: str,
+        skip: int = 0,
+        limit: int = -1,
+        cursor: Optional[str] = None,
+    ) -> list[ChatTitleIdResponse]:
         with get_db() as db:
-
-            all_chats = (
-                db.query(Chat)
-                .filter_by(user_id=user_id, archived=True)
-                .order_by(Chat.updated_at.desc())
-                # .limit(limit).offset(skip)
-                .all()
-            )
-            return [ChatModel.model_validate(chat) for chat in all_chats]
+            query = db.query(Chat).filter_by(user_id=user_id, archived=True)
+            return self._get_title_id_list(query, skip, limit, cursor)
 
     def get_chat_list_by_user_id(
         self,
@@ -239,9 +298,7 @@ def get_chat_list_by_user_id(
             if not include_archived:
                 query = query.filter_by(archived=False)
             all_chats = (
-                query.order_by(Chat.updated_at.desc())
-                # .limit(limit).offset(skip)
-                .all()
+                query.order_by(Chat.updated_at.desc()).limit(limit).offset(skip).all()
             )
             return [ChatModel.model_validate(chat) for chat in all_chats]
 
@@ -251,45 +308,22 @@ def get_chat_title_id_list_by_user_id(
         include_archived: bool = False,
         skip: int = 0,
         limit: int = -1,
+        cursor: Optional[str] = None,
     ) -> list[ChatTitleIdResponse]:
         with get_db() as db:
             query = db.query(Chat).filter_by(user_id=user_id)
             if not include_archived:
                 query = query.filter_by(archived=False)
-
-            all_chats = (
-                query.order_by(Chat.updated_at.desc())
-                # limit cols
-                .with_entities(Chat.id, Chat.title, Chat.updated_at, Chat.created_at)
-                .limit(limit)
-                .offset(skip)
-                .all()
-            )
-            # result has to be destrctured from sqlalchemy `row` and mapped to a dict since the `ChatModel`is not the returned dataclass.
-            return [
-                ChatTitleIdResponse.model_validate(
-                    {
-                        "id": chat[0],
-                        "title": chat[1],
-                        "updated_at": chat[2],
-                        "created_at": chat[3],
-                    }
-                )
-                for chat in all_chats
-            ]
+            return self._get_title_id_list(query, skip, limit, cursor)
 
     def get_chat_list_by_chat_ids(
-        self, chat_ids: list[str], skip: int = 0, limit: int = 50
-    ) -> list[ChatModel]:
+        self, chat_ids: list[str], skip: int = 0, limit: int = -1
+    ) -> list[ChatTitleIdResponse]:
         with get_db() as db:
-            all_chats = (
-                db.query(Chat)
-                .filter(Chat.id.in_(chat_ids))
-                .filter_by(archived=False)
-                .order_by(Chat.updated_at.desc())
-                .all()
+            query = (
+                db.query(Chat).filter(Chat.id.in_(chat_ids)).filter_by(archived=False)
             )
-            return [ChatModel.model_validate(chat) for chat in all_chats]
+            return self._get_title_id_list(query, skip, limit)
 
     def get_chat_by_id(self, id: str) -> Optional[ChatModel]:
         try:
@@ -327,11 +361,33 @@ def get_chats(self, skip: int = 0, limit: int = 50) -> list[ChatModel]:
 
             all_chats = (
                 db.query(Chat)
-                # .limit(limit).offset(skip)
                 .order_by(Chat.updated_at.desc())
+                .limit(limit)
+                .offset(skip)
             )
             return [ChatModel.model_validate(chat) for chat in all_chats]
 
+    def get_chat_page(
+        self,
+        user_id: Optional[str] = None,
+        archived: Optional[bool] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> list[ChatModel]:
+        """
+        Full chats, most recently updated first, starting after `cursor`.
+        Used to go through every chat a batch at a time.
+        """
+        with get_db() as db:
+            query = db.query(Chat)
+            if user_id is not None:
+                query = query.filter_by(user_id=user_id)
+            if archived is not None:
+                query = query.filter_by(archived=archived)
+
+            all_chats = self._order_by_cursor(query, cursor).limit(limit)
+            return [ChatModel.model_validate(chat) for chat in all_chats]
+
     def get_chats_by_user_id(self, user_id: str) -> list[ChatModel]:
         with get_db() as db:
 
@@ -405,3 +461,4 @@ def delete_shared_chats_by_user_id(self, user_id: str) -> bool:
 
 
 Chats = ChatTable()
+AsyncChats = AsyncTable(Chats)
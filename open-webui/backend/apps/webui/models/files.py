@@ -5,7 +5,7 @@
 
 from sqlalchemy import Column, String, BigInteger, Text
 
-from apps.webui.internal.db import JSONField, Base, get_db
+from apps.webui.internal.db import JSONField, Base, get_db, AsyncTable
 
 import json
 
@@ -124,3 +124,4 @@ def delete_all_files(self) -> bool:
 
 
 Files = FilesTable()
+AsyncFiles = AsyncTable(Files)
@@ -5,7 +5,7 @@
 
 from sqlalchemy import Column, String, Text, BigInteger, Boolean
 
-from apps.webui.internal.db import JSONField, Base, get_db
+from apps.webui.internal.db import JSONField, Base, get_db, AsyncTable
 from apps.webui.models.users import Users
 
 import json
@@ -286,3 +286,4 @@ def delete_function_by_id(self, id: str) -> bool:
 
 
 Functions = FunctionsTable()
+AsyncFunctions = AsyncTable(Functions)
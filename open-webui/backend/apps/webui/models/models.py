@@ -4,7 +4,7 @@
 from pydantic import BaseModel, ConfigDict
 from sqlalchemy import Column, BigInteger, Text
 
-from apps.webui.internal.db import Base, JSONField, get_db
+from apps.webui.internal.db import Base, JSONField, get_db, AsyncTable
 
 from config import SRC_LOG_LEVELS
 
@@ -180,3 +180,4 @@ def delete_model_by_id(self, id: str) -> bool:
 
 
 Models = ModelsTable()
+AsyncModels = AsyncTable(Models)
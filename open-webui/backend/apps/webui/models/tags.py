@@ -8,7 +8,7 @@
 
 from sqlalchemy import String, Column, BigInteger, Text
 
-from apps.webui.internal.db import Base, get_db
+from apps.webui.internal.db import Base, get_db, AsyncTable
 
 from config import SRC_LOG_LEVELS
 
@@ -270,3 +270,4 @@ def delete_tags_by_chat_id_and_user_id(self, chat_id: str, user_id: str) -> bool
 
 
 Tags = TagTable()
+AsyncTags = AsyncTable(Tags)
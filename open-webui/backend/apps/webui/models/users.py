@@ -1,12 +1,24 @@
 from pydantic import BaseModel, ConfigDict
 from typing import Optional
+import logging
+import threading
 import time
 
-from sqlalchemy import String, Column, BigInteger, Text
+from sqlalchemy import String, Column, BigInteger, Text, bindparam, update
 
-from apps.webui.internal.db import Base, JSONField, get_db
+from apps.webui.internal.db import Base, JSONField, get_db, AsyncTable
 from apps.webui.models.chats import Chats
 
+from config import (
+    SRC_LOG_LEVELS,
+    USER_CACHE_TTL,
+    USER_CACHE_MAX_SIZE,
+    USER_LAST_ACTIVE_FLUSH_INTERVAL,
+)
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["MODELS"])
+
 ####################
 # User DB Schema
 ####################
@@ -166,6 +178,7 @@ def update_user_role_by_id(self, id: str, role: str) -> Optional[UserModel]:
             with get_db() as db:
                 db.query(User).filter_by(id=id).update({"role": role})
                 db.commit()
+                user_cache.invalidate(id)
                 user = db.query(User).filter_by(id=id).first()
                 return UserModel.model_validate(user)
         except Exception:
@@ -180,6 +193,7 @@ def update_user_profile_image_url_by_id(
                     {"profile_image_url": profile_image_url}
                 )
                 db.commit()
+                user_cache.invalidate(id)
 
                 user = db.query(User).filter_by(id=id).first()
                 return UserModel.model_validate(user)
@@ -199,6 +213,26 @@ def update_user_last_active_by_id(self, id: str) -> Optional[UserModel]:
         except Exception:
             return None
 
+    def update_users_last_active_by_ids(self, last_active: dict[str, int]) -> bool:
+        try:
+            with get_db() as db:
+                # A Core executemany, which unlike an ORM bulk update doesn't
+                # fail when some of the users have been deleted since
+                db.execute(
+                    update(User.__table__)
+                    .where(User.id == bindparam("_id"))
+                    .values(last_active_at=bindparam("_ts")),
+                    [
+                        {"_id": id, "_ts": last_active_at}
+                        for id, last_active_at in last_active.items()
+                    ],
+                )
+                db.commit()
+                return True
+        except Exception as e:
+            log.exception(f"Error updating last active times: {e}")
+            return False
+
     def update_user_oauth_sub_by_id(
         self, id: str, oauth_sub: str
     ) -> Optional[UserModel]:
@@ -206,6 +240,7 @@ def update_user_oauth_sub_by_id(
             with get_db() as db:
                 db.query(User).filter_by(id=id).update({"oauth_sub": oauth_sub})
                 db.commit()
+                user_cache.invalidate(id)
 
                 user = db.query(User).filter_by(id=id).first()
                 return UserModel.model_validate(user)
@@ -217,6 +252,7 @@ def update_user_by_id(self, id: str, updated: dict) -> Optional[UserModel]:
             with get_db() as db:
                 db.query(User).filter_by(id=id).update(updated)
                 db.commit()
+                user_cache.invalidate(id)
 
                 user = db.query(User).filter_by(id=id).first()
                 return UserModel.model_validate(user)
@@ -234,6 +270,7 @@ def delete_user_by_id(self, id: str) -> bool:
                     # Delete User
                     db.query(User).filter_by(id=id).delete()
                     db.commit()
+                    user_cache.invalidate(id)
 
                 return True
             else:
@@ -246,6 +283,7 @@ def update_user_api_key_by_id(self, id: str, api_key: str) -> str:
             with get_db() as db:
                 result = db.query(User).filter_by(id=id).update({"api_key": api_key})
                 db.commit()
+                user_cache.invalidate(id)
                 return True if result == 1 else False
         except Exception:
             return False
@@ -260,3 +298,174 @@ def get_user_api_key_by_id(self, id: str) -> Optional[str]:
 
 
 Users = UsersTable()
+AsyncUsers = AsyncTable(Users)
+
+
+class UserCache:
+    """
+    Short-lived cache of the users behind authenticated requests, by id and
+    by API key, so that every request doesn't read its user from the
+    database. UsersTable drops a user from it whenever the user is changed.
+
+    Callers that read a user from the database on a miss get a version from
+    `get_version` first, so that a user invalidated meanwhile isn't cached
+    again from the stale row.
+
+    Last active times are collected in memory and written in one batch every
+    USER_LAST_ACTIVE_FLUSH_INTERVAL seconds instead of with a committed write
+    per request.
+    """
+
+    def __init__(
+        self,
+        ttl: int = USER_CACHE_TTL,
+        max_size: int = USER_CACHE_MAX_SIZE,
+        flush_interval: int = USER_LAST_ACTIVE_FLUSH_INTERVAL,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+
+        # id -> (expires at, user)
+        self.users: dict[str, tuple[float, UserModel]] = {}
+        self.api_keys: dict[str, str] = {}
+        self.last_active: dict[str, int] = {}
+        # id -> number of invalidations; invalidations of any user and clears
+        self.versions: dict[str, int] = {}
+        self.invalidations = 0
+        self.clears = 0
+        self.lock = threading.Lock()
+        self.flusher: Optional[threading.Thread] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    def _get(self, id: str) -> Optional[UserModel]:
+        entry = self.users.get(id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def get(self, id: str) -> Optional[UserModel]:
+        with self.lock:
+            user = self._get(id)
+            if user is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Callers may modify the user they get
+            return user.model_copy(deep=True)
+
+    def get_by_api_key(self, api_key: str) -> Optional[UserModel]:
+        with self.lock:
+            user = self._get(self.api_keys.get(api_key, ""))
+            if user is None or user.api_key != api_key:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return user.model_copy(deep=True)
+
+    def _get_version(self, id: Optional[str]) -> tuple:
+        if id is None:
+            return (None, self.invalidations, self.clears)
+        return (id, self.versions.get(id, 0), self.clears)
+
+    def get_version(self, id: Optional[str] = None) -> tuple:
+        """
+        Version of the user with the given id, or of all users when the id
+        isn't known yet (e.g. on a lookup by API key), to pass to `set`.
+        """
+        with self.lock:
+            return self._get_version(id)
+
+    def set(self, user: UserModel, version: Optional[tuple] = None):
+        if self.ttl <= 0:
+            return
+
+        with self.lock:
+            if version is not None and self._get_version(version[0]) != version:
+                # Invalidated since it was read
+                return
+
+            if len(self.users) >= self.max_size:
+                now = time.monotonic()
+                self.users = {
+                    id: entry for id, entry in self.users.items() if entry[0] >= now
+                }
+                if len(self.users) >= self.max_size:
+                    self.users = {}
+                self.api_keys = {
+                    api_key: id
+                    for api_key, id in self.api_keys.items()
+                    if id in self.users
+                }
+
+            self.users[user.id] = (
+                time.monotonic() + self.ttl,
+                user.model_copy(deep=True),
+            )
+            if user.api_key:
+                self.api_keys[user.api_key] = user.id
+
+    def invalidate(self, id: str):
+        with self.lock:
+            self.versions[id] = self.versions.get(id, 0) + 1
+            self.invalidations += 1
+            self.last_active.pop(id, None)
+            entry = self.users.pop(id, None)
+            if entry is not None and entry[1].api_key:
+                self.api_keys.pop(entry[1].api_key, None)
+
+    def clear(self):
+        with self.lock:
+            self.clears += 1
+            self.users = {}
+            self.api_keys = {}
+
+    def touch(self, user: UserModel):
+        now = int(time.time())
+        with self.lock:
+            self.last_active[user.id] = now
+            entry = self.users.get(user.id)
+            if entry is not None:
+                entry[1].last_active_at = now
+
+            if self.flusher is None:
+                self.flusher = threading.Thread(
+                    target=self._flush_periodically,
+                    name="user-last-active",
+                    daemon=True,
+                )
+                self.flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            last_active, self.last_active = self.last_active, {}
+        if not last_active:
+            return
+
+        if Users.update_users_last_active_by_ids(last_active):
+            self.flushes += 1
+        else:
+            with self.lock:
+                # Keep them for the next flush unless they were touched since
+                self.last_active = {**last_active, **self.last_active}
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            return {
+                "users": len(self.users),
+                "hits": self.hits,
+                "misses": self.misses,
+                "pending_last_active": len(self.last_active),
+                "flushes": self.flushes,
+            }
+
+
+user_cache = UserCache()
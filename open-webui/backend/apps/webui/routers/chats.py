@@ -1,6 +1,7 @@
-from fastapi import Depends, Request, HTTPException, status
+from fastapi import Depends, Request, Response, HTTPException, status
+from fastapi.responses import StreamingResponse
 from datetime import datetime, timedelta
-from typing import Union, Optional
+from typing import AsyncIterator, Union, Optional
 from utils.utils import get_verified_user, get_admin_user
 from fastapi import APIRouter
 from pydantic import BaseModel
@@ -14,7 +15,9 @@
     ChatTitleForm,
     ChatForm,
     ChatTitleIdResponse,
-    Chats,
+    AsyncChats,
+    get_chat_cursor,
+    chat_to_json,
 )
 
 
@@ -23,7 +26,7 @@
     ChatIdTagModel,
     ChatIdTagForm,
     ChatTagsResponse,
-    Tags,
+    AsyncTags,
 )
 
 from constants import ERROR_MESSAGES
@@ -35,6 +38,59 @@
 
 router = APIRouter()
 
+# Chats loaded per query when going through all of them
+CHAT_BATCH_SIZE = 100
+
+
+async def get_chat_title_id_page(
+    response: Response, get_page, limit: int, cursor: Optional[str]
+) -> list[ChatTitleIdResponse]:
+    """
+    Returns a page of chats after `cursor`, and the cursor of the next page
+    in the X-Next-Cursor header when there may be one.
+    """
+    try:
+        chats = await get_page(limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=ERROR_MESSAGES.DEFAULT("Invalid cursor"),
+        )
+
+    if len(chats) == limit:
+        response.headers["X-Next-Cursor"] = get_chat_cursor(chats[-1])
+    return chats
+
+
+async def iter_chat_json(
+    user_id: Optional[str] = None, archived: Optional[bool] = None
+) -> AsyncIterator[str]:
+    cursor = None
+    while True:
+        chats = await AsyncChats.get_chat_page(
+            user_id=user_id, archived=archived, cursor=cursor, limit=CHAT_BATCH_SIZE
+        )
+        for chat in chats:
+            yield chat_to_json(chat)
+        if len(chats) < CHAT_BATCH_SIZE:
+            break
+        cursor = get_chat_cursor(chats[-1])
+
+
+async def stream_json_list(items: AsyncIterator[str]) -> AsyncIterator[str]:
+    yield "["
+    separator = ""
+    async for item in items:
+        yield separator + item
+        separator = ","
+    yield "]"
+
+
+async def stream_ndjson(items: AsyncIterator[str]) -> AsyncIterator[str]:
+    async for item in items:
+        yield item + "\n"
+
+
 ############################
 # GetChatList
 ############################
@@ -43,15 +99,30 @@
 @router.get("/", response_model=list[ChatTitleIdResponse])
 @router.get("/list", response_model=list[ChatTitleIdResponse])
 async def get_session_user_chat_list(
-    user=Depends(get_verified_user), page: Optional[int] = None
+    response: Response,
+    user=Depends(get_verified_user),
+    page: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
 ):
-    if page is not None:
+    if cursor is not None or limit is not None:
+        return await get_chat_title_id_page(
+            response,
+            lambda **kwargs: AsyncChats.get_chat_title_id_list_by_user_id(
+                user.id, **kwargs
+            ),
+            limit or 60,
+            cursor,
+        )
+    elif page is not None:
         limit = 60
         skip = (page - 1) * limit
 
-        return Chats.get_chat_title_id_list_by_user_id(user.id, skip=skip, limit=limit)
+        return await AsyncChats.get_chat_title_id_list_by_user_id(
+            user.id, skip=skip, limit=limit
+        )
     else:
-        return Chats.get_chat_title_id_list_by_user_id(user.id)
+        return await AsyncChats.get_chat_title_id_list_by_user_id(user.id)
 
 
 ############################
@@ -71,7 +142,7 @@ async def delete_all_user_chats(request: Request, user=Depends(get_verified_user
             detail=ERROR_MESSAGES.ACCESS_PROHIBITED,
         )
 
-    result = Chats.delete_chats_by_user_id(user.id)
+    result = await AsyncChats.delete_chats_by_user_id(user.id)
     return result
 
 
@@ -85,14 +156,14 @@ async def get_user_chat_list_by_user_id(
     user_id: str,
     user=Depends(get_admin_user),
     skip: int = 0,
-    limit: int = 50,
+    limit: int = -1,
 ):
     if not ENABLE_ADMIN_CHAT_ACCESS:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=ERROR_MESSAGES.ACCESS_PROHIBITED,
         )
-    return Chats.get_chat_list_by_user_id(
+    return await AsyncChats.get_chat_title_id_list_by_user_id(
         user_id, include_archived=True, skip=skip, limit=limit
     )
 
@@ -105,7 +176,7 @@ async def get_user_chat_list_by_user_id(
 @router.post("/new", response_model=Optional[ChatResponse])
 async def create_new_chat(form_data: ChatForm, user=Depends(get_verified_user)):
     try:
-        chat = Chats.insert_new_chat(user.id, form_data)
+        chat = await AsyncChats.insert_new_chat(user.id, form_data)
         return ChatResponse(**{**chat.model_dump(), "chat": json.loads(chat.chat)})
     except Exception as e:
         log.exception(e)
@@ -121,10 +192,23 @@ async def create_new_chat(form_data: ChatForm, user=Depends(get_verified_user)):
 
 @router.get("/all", response_model=list[ChatResponse])
 async def get_user_chats(user=Depends(get_verified_user)):
-    return [
-        ChatResponse(**{**chat.model_dump(), "chat": json.loads(chat.chat)})
-        for chat in Chats.get_chats_by_user_id(user.id)
-    ]
+    return StreamingResponse(
+        stream_json_list(iter_chat_json(user_id=user.id)),
+        media_type="application/json",
+    )
+
+
+############################
+# ExportChats
+############################
+
+
+@router.get("/export")
+async def export_user_chats(user=Depends(get_verified_user)):
+    return StreamingResponse(
+        stream_ndjson(iter_chat_json(user_id=user.id)),
+        media_type="application/x-ndjson",
+    )
 
 
 ############################
@@ -134,10 +218,10 @@ async def get_user_chats(user=Depends(get_verified_user)):
 
 @router.get("/all/archived", response_model=list[ChatResponse])
 async def get_user_archived_chats(user=Depends(get_verified_user)):
-    return [
-        ChatResponse(**{**chat.model_dump(), "chat": json.loads(chat.chat)})
-        for chat in Chats.get_archived_chats_by_user_id(user.id)
-    ]
+    return StreamingResponse(
+        stream_json_list(iter_chat_json(user_id=user.id, archived=True)),
+        media_type="application/json",
+    )
 
 
 ############################
@@ -152,10 +236,26 @@ async def get_all_user_chats_in_db(user=Depends(get_admin_user)):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=ERROR_MESSAGES.ACCESS_PROHIBITED,
         )
-    return [
-        ChatResponse(**{**chat.model_dump(), "chat": json.loads(chat.chat)})
-        for chat in Chats.get_chats()
-    ]
+    return StreamingResponse(
+        stream_json_list(iter_chat_json()), media_type="application/json"
+    )
+
+
+############################
+# ExportAllChatsInDB
+############################
+
+
+@router.get("/export/db")
+async def export_all_user_chats_in_db(user=Depends(get_admin_user)):
+    if not ENABLE_ADMIN_EXPORT:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=ERROR_MESSAGES.ACCESS_PROHIBITED,
+        )
+    return StreamingResponse(
+        stream_ndjson(iter_chat_json()), media_type="application/x-ndjson"
+    )
 
 
 ############################
@@ -165,9 +265,22 @@ async def get_all_user_chats_in_db(user=Depends(get_admin_user)):
 
 @router.get("/archived", response_model=list[ChatTitleIdResponse])
 async def get_archived_session_user_chat_list(
-    user=Depends(get_verified_user), skip: int = 0, limit: int = 50
+    response: Response,
+    user=Depends(get_verified_user),
+    skip: int = 0,
+    limit: int = -1,
+    cursor: Optional[str] = None,
 ):
-    return Chats.get_archived_chat_list_by_user_id(user.id, skip, limit)
+    if cursor is not None:
+        return await get_chat_title_id_page(
+            response,
+            lambda **kwargs: AsyncChats.get_archived_chat_list_by_user_id(
+                user.id, **kwargs
+            ),
+            limit,
+            cursor,
+        )
+    return await AsyncChats.get_archived_chat_list_by_user_id(user.id, skip, limit)
 
 
 ############################
@@ -177,7 +290,7 @@ async def get_archived_session_user_chat_list(
 
 @router.post("/archive/all", response_model=bool)
 async def archive_all_chats(user=Depends(get_verified_user)):
-    return Chats.archive_all_chats_by_user_id(user.id)
+    return await AsyncChats.archive_all_chats_by_user_id(user.id)
 
 
 ############################
@@ -193,9 +306,9 @@ async def get_shared_chat_by_id(share_id: str, user=Depends(get_verified_user)):
         )
 
     if user.role == "user" or (user.role == "admin" and not ENABLE_ADMIN_CHAT_ACCESS):
-        chat = Chats.get_chat_by_share_id(share_id)
+        chat = await AsyncChats.get_chat_by_share_id(share_id)
     elif user.role == "admin" and ENABLE_ADMIN_CHAT_ACCESS:
-        chat = Chats.get_chat_by_id(share_id)
+        chat = await AsyncChats.get_chat_by_id(share_id)
 
     if chat:
         return ChatResponse(**{**chat.model_dump(), "chat": json.loads(chat.chat)})
@@ -213,7 +326,7 @@ async def get_shared_chat_by_id(share_id: str, user=Depends(get_verified_user)):
 class TagNameForm(BaseModel):
     name: str
     skip: Optional[int] = 0
-    limit: Optional[int] = 50
+    limit: Optional[int] = -1
 
 
 @router.post("/tags", response_model=list[ChatTitleIdResponse])
@@ -223,17 +336,18 @@ async def get_user_chat_list_by_tag_name(
 
     chat_ids = [
         chat_id_tag.chat_id
-        for chat_id_tag in Tags.get_chat_ids_by_tag_name_and_user_id(
+        for chat_id_tag in await AsyncTags.get_chat_ids_by_tag_name_and_user_id(
             form_data.name, user.id
         )
     ]
 
-    chats = Chats.get_chat_list_by_chat_ids(chat_ids, form_data.skip, form_data.limit)
-
-    if len(chats) == 0:
-        Tags.delete_tag_by_tag_name_and_user_id(form_data.name, user.id)
+    if len(chat_ids) == 0:
+        await AsyncTags.delete_tag_by_tag_name_and_user_id(form_data.name, user.id)
+        return []
 
-    return chats
+    return await AsyncChats.get_chat_list_by_chat_ids(
+        chat_ids, form_data.skip, form_data.limit
+    )
 
 
 ############################
@@ -244,7 +358,7 @@ async def get_user_chat_list_by_tag_name(
 @router.get("/tags/all", response_model=list[TagModel])
 async def get_all_tags(user=Depends(get_verified_user)):
     try:
-        tags = Tags.get_tags_by_user_id(user.id)
+        tags = await AsyncTags.get_tags_by_user_id(user.id)
         return tags
     except Exception as e:
         log.exception(e)
@@ -260,7 +374,7 @@ async def get_all_tags(user=Depends(get_verified_user)):
 
 @router.get("/{id}", response_model=Optional[ChatResponse])
 async def get_chat_by_id(id: str, user=Depends(get_verified_user)):
-    chat = Chats.get_chat_by_id_and_user_id(id, user.id)
+    chat = await AsyncChats.get_chat_by_id_and_user_id(id, user.id)
 
     if chat:
         return ChatResponse(**{**chat.model_dump(), "chat": json.loads(chat.chat)})
@@ -279,11 +393,11 @@ async def get_chat_by_id(id: str, user=Depends(get_verified_user)):
 async def update_chat_by_id(
     id: str, form_data: ChatForm, user=Depends(get_verified_user)
 ):
-    chat = Chats.get_chat_by_id_and_user_id(id, user.id)
+    chat = await AsyncChats.get_chat_by_id_and_user_id(id, user.id)
     if chat:
         updated_chat = {**json.loads(chat.chat), **form_data.chat}
 
-        chat = Chats.update_chat_by_id(id, updated_chat)
+        chat = await AsyncChats.update_chat_by_id(id, updated_chat)
         return ChatResponse(**{**chat.model_dump(), "chat": json.loads(chat.chat)})
     else:
         raise HTTPException(
@@ -301,7 +415,7 @@ async def update_chat_by_id(
 async def delete_chat_by_id(request: Request, id: str, user=Depends(get_verified_user)):
 
     if user.role == "admin":
-        result = Chats.delete_chat_by_id(id)
+        result = await AsyncChats.delete_chat_by_id(id)
         return result
     else:
         if not request.app.state.config.USER_PERMISSIONS["chat"]["deletion"]:
@@ -310,7 +424,7 @@ async def delete_chat_by_id(request: Request, id: str, user=Depends(get_verified
                 detail=ERROR_MESSAGES.ACCESS_PROHIBITED,
             )
 
-        result = Chats.delete_chat_by_id_and_user_id(id, user.id)
+        result = await AsyncChats.delete_chat_by_id_and_user_id(id, user.id)
         return result
 
 
@@ -321,7 +435,7 @@ async def delete_chat_by_id(request: Request, id: str, user=Depends(get_verified
 
 @router.get("/{id}/clone", response_model=Optional[ChatResponse])
 async def clone_chat_by_id(id: str, user=Depends(get_verified_user)):
-    chat = Chats.get_chat_by_id_and_user_id(id, user.id)
+    chat = await AsyncChats.get_chat_by_id_and_user_id(id, user.id)
     if chat:
 
         chat_body = json.loads(chat.chat)
@@ -332,7 +446,9 @@ async def clone_chat_by_id(id: str, user=Depends(get_verified_user)):
             "title": f"Clone of {chat.title}",
         }
 
-        chat = Chats.insert_new_chat(user.id, ChatForm(**{"chat": updated_chat}))
+        chat = await AsyncChats.insert_new_chat(
+            user.id, ChatForm(**{"chat": updated_chat})
+        )
         return ChatResponse(**{**chat.model_dump(), "chat": json.loads(chat.chat)})
     else:
         raise HTTPException(
@@ -347,9 +463,9 @@ async def clone_chat_by_id(id: str, user=Depends(get_verified_user)):
 
 @router.get("/{id}/archive", response_model=Optional[ChatResponse])
 async def archive_chat_by_id(id: str, user=Depends(get_verified_user)):
-    chat = Chats.get_chat_by_id_and_user_id(id, user.id)
+    chat = await AsyncChats.get_chat_by_id_and_user_id(id, user.id)
     if chat:
-        chat = Chats.toggle_chat_archive_by_id(id)
+        chat = await AsyncChats.toggle_chat_archive_by_id(id)
         return ChatResponse(**{**chat.model_dump(), "chat": json.loads(chat.chat)})
     else:
         raise HTTPException(
@@ -364,15 +480,15 @@ async def archive_chat_by_id(id: str, user=Depends(get_verified_user)):
 
 @router.post("/{id}/share", response_model=Optional[ChatResponse])
 async def share_chat_by_id(id: str, user=Depends(get_verified_user)):
-    chat = Chats.get_chat_by_id_and_user_id(id, user.id)
+    chat = await AsyncChats.get_chat_by_id_and_user_id(id, user.id)
     if chat:
         if chat.share_id:
-            shared_chat = Chats.update_shared_chat_by_chat_id(chat.id)
+            shared_chat = await AsyncChats.update_shared_chat_by_chat_id(chat.id)
             return ChatResponse(
                 **{**shared_chat.model_dump(), "chat": json.loads(shared_chat.chat)}
             )
 
-        shared_chat = Chats.insert_shared_chat_by_chat_id(chat.id)
+        shared_chat = await AsyncChats.insert_shared_chat_by_chat_id(chat.id)
         if not shared_chat:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -396,13 +512,13 @@ async def share_chat_by_id(id: str, user=Depends(get_verified_user)):
 
 @router.delete("/{id}/share", response_model=Optional[bool])
 async def delete_shared_chat_by_id(id: str, user=Depends(get_verified_user)):
-    chat = Chats.get_chat_by_id_and_user_id(id, user.id)
+    chat = await AsyncChats.get_chat_by_id_and_user_id(id, user.id)
     if chat:
         if not chat.share_id:
             return False
 
-        result = Chats.delete_shared_chat_by_chat_id(id)
-        update_result = Chats.update_chat_share_id_by_id(id, None)
+        result = await AsyncChats.delete_shared_chat_by_chat_id(id)
+        update_result = await AsyncChats.update_chat_share_id_by_id(id, None)
 
         return result and update_result != None
     else:
@@ -419,7 +535,7 @@ async def delete_shared_chat_by_id(id: str, user=Depends(get_verified_user)):
 
 @router.get("/{id}/tags", response_model=list[TagModel])
 async def get_chat_tags_by_id(id: str, user=Depends(get_verified_user)):
-    tags = Tags.get_tags_by_chat_id_and_user_id(id, user.id)
+    tags = await AsyncTags.get_tags_by_chat_id_and_user_id(id, user.id)
 
     if tags != None:
         return tags
@@ -438,10 +554,10 @@ async def get_chat_tags_by_id(id: str, user=Depends(get_verified_user)):
 async def add_chat_tag_by_id(
     id: str, form_data: ChatIdTagForm, user=Depends(get_verified_user)
 ):
-    tags = Tags.get_tags_by_chat_id_and_user_id(id, user.id)
+    tags = await AsyncTags.get_tags_by_chat_id_and_user_id(id, user.id)
 
     if form_data.tag_name not in tags:
-        tag = Tags.add_tag_to_chat(user.id, form_data)
+        tag = await AsyncTags.add_tag_to_chat(user.id, form_data)
 
         if tag:
             return tag
@@ -465,7 +581,7 @@ async def add_chat_tag_by_id(
 async def delete_chat_tag_by_id(
     id: str, form_data: ChatIdTagForm, user=Depends(get_verified_user)
 ):
-    result = Tags.delete_tag_by_tag_name_and_chat_id_and_user_id(
+    result = await AsyncTags.delete_tag_by_tag_name_and_chat_id_and_user_id(
         form_data.tag_name, id, user.id
     )
 
@@ -484,7 +600,7 @@ async def delete_chat_tag_by_id(
 
 @router.delete("/{id}/tags/all", response_model=Optional[bool])
 async def delete_all_chat_tags_by_id(id: str, user=Depends(get_verified_user)):
-    result = Tags.delete_tags_by_chat_id_and_user_id(id, user.id)
+    result = await AsyncTags.delete_tags_by_chat_id_and_user_id(id, user.id)
 
     if result:
         return result
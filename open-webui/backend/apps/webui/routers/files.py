@@ -27,6 +27,7 @@
     FileModelResponse,
 )
 from utils.utils import get_verified_user, get_admin_user
+from utils.misc import copy_file_and_calculate_sha256
 from constants import ERROR_MESSAGES
 
 from importlib import util
@@ -62,10 +63,8 @@ def upload_file(file: UploadFile = File(...), user=Depends(get_verified_user)):
         filename = f"{id}_{filename}"
         file_path = f"{UPLOAD_DIR}/{filename}"
 
-        contents = file.file.read()
         with open(file_path, "wb") as f:
-            f.write(contents)
-            f.close()
+            file_hash, size = copy_file_and_calculate_sha256(file.file, f)
 
         file = Files.insert_new_file(
             user.id,
@@ -76,8 +75,9 @@ def upload_file(file: UploadFile = File(...), user=Depends(get_verified_user)):
                     "meta": {
                         "name": name,
                         "content_type": file.content_type,
-                        "size": len(contents),
+                        "size": size,
                         "path": file_path,
+                        "hash": file_hash,
                     },
                 }
             ),
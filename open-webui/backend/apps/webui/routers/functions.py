@@ -14,6 +14,8 @@
 )
 from apps.webui.utils import load_function_module_by_id
 from utils.utils import get_verified_user, get_admin_user
+from utils.model_registry import model_registry
+from utils.function_plans import function_plans
 from constants import ERROR_MESSAGES
 
 from importlib import util
@@ -78,6 +80,8 @@ async def create_new_function(
             FUNCTIONS[form_data.id] = function_module
 
             function = Functions.insert_new_function(user.id, function_type, form_data)
+            model_registry.invalidate()
+            function_plans.invalidate()
 
             function_cache_dir = Path(CACHE_DIR) / "functions" / form_data.id
             function_cache_dir.mkdir(parents=True, exist_ok=True)
@@ -132,6 +136,8 @@ async def toggle_function_by_id(id: str, user=Depends(get_admin_user)):
         function = Functions.update_function_by_id(
             id, {"is_active": not function.is_active}
         )
+        model_registry.invalidate()
+        function_plans.invalidate()
 
         if function:
             return function
@@ -159,6 +165,8 @@ async def toggle_global_by_id(id: str, user=Depends(get_admin_user)):
         function = Functions.update_function_by_id(
             id, {"is_global": not function.is_global}
         )
+        model_registry.invalidate()
+        function_plans.invalidate()
 
         if function:
             return function
@@ -199,6 +207,8 @@ async def update_function_by_id(
         print(updated)
 
         function = Functions.update_function_by_id(id, updated)
+        model_registry.invalidate()
+        function_plans.invalidate()
 
         if function:
             return function
@@ -227,6 +237,8 @@ async def delete_function_by_id(
     result = Functions.delete_function_by_id(id)
 
     if result:
+        model_registry.invalidate()
+        function_plans.invalidate()
         FUNCTIONS = request.app.state.FUNCTIONS
         if id in FUNCTIONS:
             del FUNCTIONS[id]
@@ -318,6 +330,8 @@ async def update_function_valves_by_id(
                 form_data = {k: v for k, v in form_data.items() if v is not None}
                 valves = Valves(**form_data)
                 Functions.update_function_valves_by_id(id, valves.model_dump())
+                model_registry.invalidate()
+                function_plans.invalidate()
                 return valves.model_dump()
             except Exception as e:
                 print(e)
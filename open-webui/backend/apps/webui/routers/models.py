@@ -9,6 +9,7 @@
 from apps.webui.models.models import Models, ModelModel, ModelForm, ModelResponse
 
 from utils.utils import get_verified_user, get_admin_user
+from utils.model_registry import model_registry
 from constants import ERROR_MESSAGES
 
 router = APIRouter()
@@ -43,6 +44,7 @@ async def add_new_model(
         model = Models.insert_new_model(form_data, user.id)
 
         if model:
+            model_registry.invalidate()
             return model
         else:
             raise HTTPException(
@@ -84,11 +86,13 @@ async def update_model_by_id(
     model = Models.get_model_by_id(id)
     if model:
         model = Models.update_model_by_id(id, form_data)
+        model_registry.invalidate()
         return model
     else:
         if form_data.id in request.app.state.MODELS:
             model = Models.insert_new_model(form_data, user.id)
             if model:
+                model_registry.invalidate()
                 return model
             else:
                 raise HTTPException(
@@ -110,4 +114,5 @@ async def update_model_by_id(
 @router.delete("/delete", response_model=bool)
 async def delete_model_by_id(id: str, user=Depends(get_admin_user)):
     result = Models.delete_model_by_id(id)
+    model_registry.invalidate()
     return result
@@ -8,6 +8,7 @@
 
 from utils.utils import get_admin_user, get_verified_user
 from utils.tools import get_tools_specs
+from utils.function_plans import function_plans
 from constants import ERROR_MESSAGES
 
 import os
@@ -78,6 +79,7 @@ async def create_new_toolkit(
 
             specs = get_tools_specs(TOOLS[form_data.id])
             toolkit = Tools.insert_new_tool(user.id, form_data, specs)
+            function_plans.invalidate()
 
             tool_cache_dir = Path(CACHE_DIR) / "tools" / form_data.id
             tool_cache_dir.mkdir(parents=True, exist_ok=True)
@@ -153,6 +155,7 @@ async def update_toolkit_by_id(
 
         print(updated)
         toolkit = Tools.update_tool_by_id(id, updated)
+        function_plans.invalidate()
 
         if toolkit:
             return toolkit
@@ -179,6 +182,7 @@ async def delete_toolkit_by_id(request: Request, id: str, user=Depends(get_admin
     result = Tools.delete_tool_by_id(id)
 
     if result:
+        function_plans.invalidate()
         TOOLS = request.app.state.TOOLS
         if id in TOOLS:
             del TOOLS[id]
@@ -266,6 +270,7 @@ async def update_toolkit_valves_by_id(
                 form_data = {k: v for k, v in form_data.items() if v is not None}
                 valves = Valves(**form_data)
                 Tools.update_tool_valves_by_id(id, valves.model_dump())
+                function_plans.invalidate()
                 return valves.model_dump()
             except Exception as e:
                 print(e)
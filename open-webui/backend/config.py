@@ -314,6 +314,15 @@ def __getattr__(self, key):
     "JWT_EXPIRES_IN", "auth.jwt_expiry", os.environ.get("JWT_EXPIRES_IN", "-1")
 )
 
+# Seconds an authenticated user is cached for (0 disables the cache). Changes
+# made through another instance are picked up once the entry expires.
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", "60"))
+USER_CACHE_MAX_SIZE = int(os.environ.get("USER_CACHE_MAX_SIZE", "10000"))
+# Seconds between batched writes of users' last active times
+USER_LAST_ACTIVE_FLUSH_INTERVAL = int(
+    os.environ.get("USER_LAST_ACTIVE_FLUSH_INTERVAL", "30")
+)
+
 ####################################
 # OAuth config
 ####################################
@@ -591,6 +600,15 @@ def load_oauth_providers():
 FUNCTIONS_DIR = os.getenv("FUNCTIONS_DIR", f"{DATA_DIR}/functions")
 Path(FUNCTIONS_DIR).mkdir(parents=True, exist_ok=True)
 
+# Threads running the synchronous code of functions and tools
+FUNCTIONS_MAX_WORKERS = int(os.environ.get("FUNCTIONS_MAX_WORKERS", "8"))
+# Calls a single function or tool may have running at once
+FUNCTIONS_MAX_CONCURRENCY = int(os.environ.get("FUNCTIONS_MAX_CONCURRENCY", "4"))
+# Seconds to wait for a synchronous call (or the next chunk it streams), 0 waits forever
+FUNCTIONS_TIMEOUT = int(os.environ.get("FUNCTIONS_TIMEOUT", "300"))
+# Seconds to wait for each tool call made for a chat, 0 waits forever
+TOOLS_TIMEOUT = int(os.environ.get("TOOLS_TIMEOUT", "60"))
+
 
 ####################################
 # LITELLM_CONFIG
@@ -651,6 +669,23 @@ def create_config_file(file_path):
     except Exception:
         AIOHTTP_CLIENT_TIMEOUT = 300
 
+AIOHTTP_CLIENT_POOL_LIMIT = int(os.environ.get("AIOHTTP_CLIENT_POOL_LIMIT", "100"))
+AIOHTTP_CLIENT_KEEPALIVE_TIMEOUT = float(
+    os.environ.get("AIOHTTP_CLIENT_KEEPALIVE_TIMEOUT", "30")
+)
+AIOHTTP_CLIENT_DNS_CACHE_TTL = int(
+    os.environ.get("AIOHTTP_CLIENT_DNS_CACHE_TTL", "300")
+)
+
+# Pipeline inlet/outlet filter calls
+PIPELINE_FILTER_TIMEOUT = float(os.environ.get("PIPELINE_FILTER_TIMEOUT", "30"))
+PIPELINE_FILTER_FAILURE_THRESHOLD = int(
+    os.environ.get("PIPELINE_FILTER_FAILURE_THRESHOLD", "3")
+)
+PIPELINE_FILTER_RESET_TIMEOUT = float(
+    os.environ.get("PIPELINE_FILTER_RESET_TIMEOUT", "30")
+)
+
 
 K8S_FLAG = os.environ.get("K8S_FLAG", "")
 USE_OLLAMA_DOCKER = os.environ.get("USE_OLLAMA_DOCKER", "false")
@@ -682,6 +717,13 @@ def create_config_file(file_path):
     "OLLAMA_BASE_URLS", "ollama.base_urls", OLLAMA_BASE_URLS
 )
 
+# random, least_outstanding, ewma or consistent_hash
+OLLAMA_LOAD_BALANCING_STRATEGY = os.environ.get(
+    "OLLAMA_LOAD_BALANCING_STRATEGY", "least_outstanding"
+).lower()
+OLLAMA_EJECTION_THRESHOLD = int(os.environ.get("OLLAMA_EJECTION_THRESHOLD", "3"))
+OLLAMA_EJECTION_DURATION = float(os.environ.get("OLLAMA_EJECTION_DURATION", "30"))
+
 ####################################
 # OPENAI_API
 ####################################
@@ -839,6 +881,9 @@ def create_config_file(file_path):
     [model.strip() for model in MODEL_FILTER_LIST.split(";")],
 )
 
+# Seconds before the cached model list is refreshed in the background
+MODELS_CACHE_TTL = int(os.environ.get("MODELS_CACHE_TTL", "60"))
+
 WEBHOOK_URL = PersistentConfig(
     "WEBHOOK_URL", "webhook_url", os.environ.get("WEBHOOK_URL", "")
 )
@@ -946,6 +991,14 @@ class BannerModel(BaseModel):
     os.environ.get("TASK_MODEL_EXTERNAL", ""),
 )
 
+# Seconds task results (titles, emojis, search queries) are cached for, 0 disables the cache
+TASK_CACHE_TTL = int(os.environ.get("TASK_CACHE_TTL", "3600"))
+TASK_CACHE_MAX_SIZE = int(os.environ.get("TASK_CACHE_MAX_SIZE", "1000"))
+# Title and emoji completions running at once
+TASK_MAX_CONCURRENCY = int(os.environ.get("TASK_MAX_CONCURRENCY", "2"))
+# Seconds a title or emoji completion waits for chat completions on its backend to finish
+TASK_MAX_DEFER = float(os.environ.get("TASK_MAX_DEFER", "10"))
+
 TITLE_GENERATION_PROMPT_TEMPLATE = PersistentConfig(
     "TITLE_GENERATION_PROMPT_TEMPLATE",
     "task.title.prompt_template",
@@ -994,7 +1047,7 @@ class BannerModel(BaseModel):
     "task.tools.prompt_template",
     os.environ.get(
         "TOOLS_FUNCTION_CALLING_PROMPT_TEMPLATE",
-        """Available Tools: {{TOOLS}}\nReturn an empty string if no tools match the query. If a function tool matches, construct and return a JSON object in the format {\"name\": \"functionName\", \"parameters\": {\"requiredFunctionParamKey\": \"requiredFunctionParamValue\"}} using the appropriate tool and its parameters. Only return the object and limit the response to the JSON object without additional text.""",
+        """Available Tools: {{TOOLS}}\nReturn an empty string if no tools match the query. If a function tool matches, construct and return a JSON object in the format {\"name\": \"functionName\", \"parameters\": {\"requiredFunctionParamKey\": \"requiredFunctionParamValue\"}} using the appropriate tool and its parameters. If the query needs several tools, return a JSON array of such objects. Only return the object or array and limit the response to the JSON without additional text.""",
     ),
 )
 
@@ -1044,6 +1097,8 @@ class BannerModel(BaseModel):
 ####################################
 
 CHROMA_DATA_PATH = f"{DATA_DIR}/vector_db"
+# Per-collection BM25 indexes used by hybrid search
+BM25_INDEX_PATH = os.environ.get("BM25_INDEX_PATH", f"{DATA_DIR}/bm25_index")
 CHROMA_TENANT = os.environ.get("CHROMA_TENANT", chromadb.DEFAULT_TENANT)
 CHROMA_DATABASE = os.environ.get("CHROMA_DATABASE", chromadb.DEFAULT_DATABASE)
 CHROMA_HTTP_HOST = os.environ.get("CHROMA_HTTP_HOST", "")
@@ -1113,6 +1168,31 @@ class BannerModel(BaseModel):
     int(os.environ.get("RAG_EMBEDDING_OPENAI_BATCH_SIZE", "1")),
 )
 
+# Embedding cache: in-memory LRU entries and on-disk entries (0 disables a tier)
+RAG_EMBEDDING_CACHE_SIZE = int(os.environ.get("RAG_EMBEDDING_CACHE_SIZE", "10000"))
+RAG_EMBEDDING_CACHE_DISK_SIZE = int(
+    os.environ.get("RAG_EMBEDDING_CACHE_DISK_SIZE", "200000")
+)
+RAG_EMBEDDING_CACHE_DIR = os.environ.get(
+    "RAG_EMBEDDING_CACHE_DIR", f"{CACHE_DIR}/embeddings"
+)
+
+# Threads used to query collections concurrently when building RAG context
+RAG_RETRIEVAL_WORKERS = int(os.environ.get("RAG_RETRIEVAL_WORKERS", "8"))
+# Chunks embedded per batch while ingesting documents
+RAG_INGEST_BATCH_SIZE = int(os.environ.get("RAG_INGEST_BATCH_SIZE", "64"))
+
+# Ingestion job queue, in-process unless a Redis URL is given
+RAG_INGEST_WORKERS = int(os.environ.get("RAG_INGEST_WORKERS", "2"))
+RAG_JOB_MAX_RETRIES = int(os.environ.get("RAG_JOB_MAX_RETRIES", "2"))
+RAG_JOB_TTL = int(os.environ.get("RAG_JOB_TTL", "3600"))
+RAG_JOB_QUEUE_REDIS_URL = os.environ.get("RAG_JOB_QUEUE_REDIS_URL", "")
+# Seconds a running job may go without a heartbeat before its worker is considered lost
+RAG_JOB_HEARTBEAT_TIMEOUT = int(os.environ.get("RAG_JOB_HEARTBEAT_TIMEOUT", "60"))
+
+# Threads running RAG retrieval for chat requests, off the event loop
+RAG_EXECUTOR_WORKERS = int(os.environ.get("RAG_EXECUTOR_WORKERS", "4"))
+
 RAG_RERANKING_MODEL = PersistentConfig(
     "RAG_RERANKING_MODEL",
     "rag.reranking_model",
@@ -1303,11 +1383,19 @@ class BannerModel(BaseModel):
 # Transcribe
 ####################################
 
-WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_MODEL = PersistentConfig(
+    "WHISPER_MODEL",
+    "audio.stt.whisper_model",
+    os.getenv("WHISPER_MODEL", "base"),
+)
 WHISPER_MODEL_DIR = os.getenv("WHISPER_MODEL_DIR", f"{CACHE_DIR}/whisper/models")
 WHISPER_MODEL_AUTO_UPDATE = (
     os.environ.get("WHISPER_MODEL_AUTO_UPDATE", "").lower() == "true"
 )
+# Number of resident Whisper models serving concurrent transcriptions
+WHISPER_MODEL_POOL_SIZE = int(os.environ.get("WHISPER_MODEL_POOL_SIZE", "1"))
+# Seconds a Whisper model may sit unused before it is unloaded (0 keeps it loaded)
+WHISPER_MODEL_IDLE_TIMEOUT = int(os.environ.get("WHISPER_MODEL_IDLE_TIMEOUT", "600"))
 
 
 ####################################
@@ -1484,6 +1572,21 @@ class BannerModel(BaseModel):
     "IMAGE_STEPS", "image_generation.steps", int(os.getenv("IMAGE_STEPS", 50))
 )
 
+# Threads decoding generated images and creating their thumbnails
+IMAGE_PROCESSING_WORKERS = int(os.environ.get("IMAGE_PROCESSING_WORKERS", "2"))
+# Longest side in pixels of the thumbnails rendered in chat history
+IMAGE_THUMBNAIL_SIZE = int(os.environ.get("IMAGE_THUMBNAIL_SIZE", "256"))
+
+# Generations run at once per Automatic1111 or ComfyUI server, the rest are queued
+IMAGE_GENERATION_CONCURRENCY = int(os.environ.get("IMAGE_GENERATION_CONCURRENCY", "1"))
+IMAGE_GENERATION_OPENAI_CONCURRENCY = int(
+    os.environ.get("IMAGE_GENERATION_OPENAI_CONCURRENCY", "4")
+)
+# Most images generated in one call when merging identical queued requests
+IMAGE_GENERATION_MAX_BATCH_SIZE = int(
+    os.environ.get("IMAGE_GENERATION_MAX_BATCH_SIZE", "4")
+)
+
 IMAGE_GENERATION_MODEL = PersistentConfig(
     "IMAGE_GENERATION_MODEL",
     "image_generation.model",
@@ -1518,6 +1621,13 @@ class BannerModel(BaseModel):
     os.getenv("AUDIO_STT_MODEL", "whisper-1"),
 )
 
+# Streaming transcription cuts audio into windows at pauses in speech
+AUDIO_STT_STREAM_SILENCE_MS = int(os.environ.get("AUDIO_STT_STREAM_SILENCE_MS", "500"))
+AUDIO_STT_STREAM_MAX_WINDOW = float(os.environ.get("AUDIO_STT_STREAM_MAX_WINDOW", "15"))
+AUDIO_STT_STREAM_VAD_THRESHOLD = float(
+    os.environ.get("AUDIO_STT_STREAM_VAD_THRESHOLD", "0.01")
+)
+
 AUDIO_TTS_OPENAI_API_BASE_URL = PersistentConfig(
     "AUDIO_TTS_OPENAI_API_BASE_URL",
     "audio.tts.openai.api_base_url",
@@ -1554,6 +1664,14 @@ class BannerModel(BaseModel):
     os.getenv("AUDIO_TTS_VOICE", "alloy"),  # OpenAI default voice
 )
 
+# Size in bytes the speech cache may grow to before old files are evicted (0 is unbounded)
+AUDIO_TTS_CACHE_MAX_SIZE = int(
+    os.environ.get("AUDIO_TTS_CACHE_MAX_SIZE", str(1024 * 1024 * 1024))
+)
+
+# Sentences synthesized at once when speech is split into sentences
+AUDIO_TTS_SPLIT_CONCURRENCY = int(os.environ.get("AUDIO_TTS_SPLIT_CONCURRENCY", "4"))
+
 
 ####################################
 # Database
@@ -1564,3 +1682,16 @@ class BannerModel(BaseModel):
 # Replace the postgres:// with postgresql://
 if "postgres://" in DATABASE_URL:
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://")
+
+# Connection pool for Postgres/MySQL; 0 opens a connection per session instead
+DATABASE_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", "5"))
+DATABASE_POOL_MAX_OVERFLOW = int(os.environ.get("DATABASE_POOL_MAX_OVERFLOW", "10"))
+DATABASE_POOL_TIMEOUT = int(os.environ.get("DATABASE_POOL_TIMEOUT", "30"))
+DATABASE_POOL_RECYCLE = int(os.environ.get("DATABASE_POOL_RECYCLE", "3600"))
+
+DATABASE_SQLITE_WAL = os.environ.get("DATABASE_SQLITE_WAL", "True").lower() == "true"
+
+# Queries slower than this many seconds are logged
+DATABASE_SLOW_QUERY_THRESHOLD = float(
+    os.environ.get("DATABASE_SLOW_QUERY_THRESHOLD", "1.0")
+)
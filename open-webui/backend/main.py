@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import uuid
 from contextlib import asynccontextmanager
@@ -13,26 +14,27 @@
 import requests
 import mimetypes
 import shutil
-import inspect
 from typing import Optional
 
 from fastapi import FastAPI, Request, Depends, status, UploadFile, File, Form
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import JSONResponse
+from fastapi.exceptions import RequestValidationError
 from fastapi import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy import text
 from starlette.exceptions import HTTPException as StarletteHTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.sessions import SessionMiddleware
-from starlette.responses import StreamingResponse, Response, RedirectResponse
+from starlette.responses import Response, RedirectResponse
 
 
 from apps.socket.main import app as socket_app, get_event_emitter, get_event_call
 from apps.ollama.main import (
     app as ollama_app,
     get_all_models as get_ollama_models,
+    generate_chat_completion as generate_ollama_native_chat_completion,
     generate_openai_chat_completion as generate_ollama_chat_completion,
+    GenerateChatCompletionForm,
 )
 from apps.openai.main import (
     app as openai_app,
@@ -41,30 +43,29 @@
 )
 
 from apps.audio.main import app as audio_app
-from apps.images.main import app as images_app
+from apps.audio.streaming import stt_stream_executor
+from apps.images.main import app as images_app, image_executor
 from apps.rag.main import app as rag_app
 from apps.webui.main import (
     app as webui_app,
     get_pipe_models,
     generate_function_chat_completion,
 )
-from apps.webui.internal.db import Session
+from apps.webui.internal.db import Session, get_db, db_executor, get_db_metrics
 
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 from apps.webui.models.auths import Auths
-from apps.webui.models.models import Models
-from apps.webui.models.functions import Functions
-from apps.webui.models.users import Users, UserModel
+from apps.webui.models.models import AsyncModels
+from apps.webui.models.functions import Functions, AsyncFunctions
+from apps.webui.models.users import Users, AsyncUsers, UserModel, user_cache
 
 from apps.webui.utils import load_function_module_by_id
 
 from utils.utils import (
     get_admin_user,
     get_verified_user,
-    get_current_user,
-    get_http_authorization_cred,
     get_password_hash,
     create_token,
     decode_token,
@@ -76,7 +77,14 @@
     moa_response_generation_template,
 )
 
+from utils.function_executor import function_executor
+from utils.function_plans import function_plans
+from utils.chat_pipeline import chat_pipeline, ChatRequest
+from utils.task_runner import task_runner
 from utils.tools import get_tools
+from utils.client_pool import client_pool
+from utils.model_registry import model_registry
+from utils.pipeline_filters import pipeline_filter_client, PipelineFilterError
 from utils.misc import (
     get_last_user_message,
     add_or_update_system_message,
@@ -84,7 +92,9 @@
     parse_duration,
 )
 
-from apps.rag.utils import get_rag_context, rag_template
+from apps.rag.utils import get_rag_context_async, rag_executor, rag_template
+from apps.rag.embedding_cache import embedding_cache
+from apps.rag.jobs import ingestion_jobs
 
 from config import (
     WEBUI_NAME,
@@ -108,6 +118,7 @@
     WEBUI_BUILD_HASH,
     TASK_MODEL,
     TASK_MODEL_EXTERNAL,
+    TOOLS_TIMEOUT,
     TITLE_GENERATION_PROMPT_TEMPLATE,
     SEARCH_QUERY_GENERATION_PROMPT_TEMPLATE,
     SEARCH_QUERY_PROMPT_LENGTH_THRESHOLD,
@@ -179,7 +190,19 @@ def run_migrations():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     run_migrations()
+    client_pool.open(
+        ollama_app.state.config.OLLAMA_BASE_URLS
+        + openai_app.state.config.OPENAI_API_BASE_URLS
+    )
+    ingestion_jobs.start()
     yield
+    await client_pool.close()
+    rag_executor.shutdown()
+    stt_stream_executor.shutdown()
+    image_executor.shutdown()
+    user_cache.flush()
+    db_executor.shutdown()
+    function_executor.shutdown()
 
 
 app = FastAPI(
@@ -240,87 +263,33 @@ def get_task_model_id(default_model_id):
     return task_model_id
 
 
-def get_filter_function_ids(model):
-    def get_priority(function_id):
-        function = Functions.get_function_by_id(function_id)
-        if function is not None and hasattr(function, "valves"):
-            # TODO: Fix FunctionModel
-            return (function.valves if function.valves else {}).get("priority", 0)
-        return 0
-
-    filter_ids = [function.id for function in Functions.get_global_filter_functions()]
-    if "info" in model and "meta" in model["info"]:
-        filter_ids.extend(model["info"]["meta"].get("filterIds", []))
-        filter_ids = list(set(filter_ids))
-
-    enabled_filter_ids = [
-        function.id
-        for function in Functions.get_functions_by_type("filter", active_only=True)
-    ]
-
-    filter_ids = [
-        filter_id for filter_id in filter_ids if filter_id in enabled_filter_ids
-    ]
-
-    filter_ids.sort(key=get_priority)
-    return filter_ids
-
-
-async def chat_completion_filter_functions_handler(body, model, extra_params):
+async def chat_completion_filter_functions_handler(body, model, user, extra_params):
     skip_files = None
 
-    filter_ids = get_filter_function_ids(model)
-    for filter_id in filter_ids:
-        filter = Functions.get_function_by_id(filter_id)
-        if not filter:
-            continue
-
-        if filter_id in webui_app.state.FUNCTIONS:
-            function_module = webui_app.state.FUNCTIONS[filter_id]
-        else:
-            function_module, _, _ = load_function_module_by_id(filter_id)
-            webui_app.state.FUNCTIONS[filter_id] = function_module
+    for filter_id in function_plans.get_filter_ids(model):
+        plan = function_plans.get_function(webui_app, filter_id)
+        function_module = plan.module
 
         # Check if the function has a file_handler variable
         if hasattr(function_module, "file_handler"):
             skip_files = function_module.file_handler
 
-        if hasattr(function_module, "valves") and hasattr(function_module, "Valves"):
-            valves = Functions.get_function_valves_by_id(filter_id)
-            function_module.valves = function_module.Valves(
-                **(valves if valves else {})
-            )
-
         if not hasattr(function_module, "inlet"):
             continue
 
         try:
-            inlet = function_module.inlet
-
-            # Get the signature of the function
-            sig = inspect.signature(inlet)
-            params = {"body": body}
-
             # Extra parameters to be passed to the function
-            custom_params = {**extra_params, "__model__": model, "__id__": filter_id}
-            if hasattr(function_module, "UserValves") and "__user__" in sig.parameters:
-                try:
-                    uid = custom_params["__user__"]["id"]
-                    custom_params["__user__"]["valves"] = function_module.UserValves(
-                        **Functions.get_user_valves_by_id_and_user_id(filter_id, uid)
-                    )
-                except Exception as e:
-                    print(e)
-
-            # Add extra params in contained in function signature
-            for key, value in custom_params.items():
-                if key in sig.parameters:
-                    params[key] = value
+            custom_params = {
+                **extra_params,
+                "__model__": model,
+                "__id__": filter_id,
+                "__user__": plan.get_user("inlet", extra_params["__user__"], user),
+            }
+            params = {"body": body, **plan.get_params("inlet", custom_params)}
 
-            if inspect.iscoroutinefunction(inlet):
-                body = await inlet(**params)
-            else:
-                body = inlet(**params)
+            body = await function_executor.run(
+                filter_id, function_module.inlet, **params
+            )
 
         except Exception as e:
             print(f"Error: {e}")
@@ -352,19 +321,86 @@ def get_tools_function_calling_payload(messages, task_model_id, content):
     }
 
 
-async def get_content_from_response(response) -> Optional[str]:
-    content = None
+def get_native_tools_function_calling_payload(messages, task_model_id, specs):
+    return {
+        "model": task_model_id,
+        "messages": messages,
+        "tools": [{"type": "function", "function": spec} for spec in specs],
+        "tool_choice": "auto",
+        # Only the tool calls are used, so an answer without any is cut short
+        "max_tokens": 512,
+        "stream": False,
+        "metadata": {"task": str(TASKS.FUNCTION_CALLING)},
+    }
+
+
+def supports_native_tool_calling(model: dict) -> bool:
+    info = model.get("info") or {}
+    capabilities = (info.get("meta") or {}).get("capabilities") or {}
+    return bool(capabilities.get("function_calling", False))
+
+
+async def get_message_from_response(response) -> Optional[dict]:
+    message = None
     if hasattr(response, "body_iterator"):
         async for chunk in response.body_iterator:
             data = json.loads(chunk.decode("utf-8"))
-            content = data["choices"][0]["message"]["content"]
+            message = data["choices"][0]["message"]
 
         # Cleanup any remaining background tasks if necessary
         if response.background is not None:
             await response.background()
     else:
-        content = response["choices"][0]["message"]["content"]
-    return content
+        message = response["choices"][0]["message"]
+    return message
+
+
+def get_tool_calls_from_message(message: dict, native: bool) -> list[dict]:
+    """
+    The tools the model asked for, as {"name", "parameters"} dicts, from its
+    native tool calls or, if not `native`, from its JSON answer to the
+    function calling prompt.
+    """
+    if native:
+        tool_calls = []
+        for tool_call in message.get("tool_calls") or []:
+            function = tool_call.get("function", {})
+            arguments = function.get("arguments") or {}
+            if isinstance(arguments, str):
+                arguments = json.loads(arguments) if arguments.strip() else {}
+            tool_calls.append({"name": function.get("name"), "parameters": arguments})
+        return tool_calls
+
+    content = message.get("content")
+    if not content:
+        return []
+
+    result = json.loads(content)
+    if isinstance(result, dict):
+        result = [result]
+    return [
+        {"name": call.get("name"), "parameters": call.get("parameters") or {}}
+        for call in result
+        if isinstance(call, dict)
+    ]
+
+
+async def call_tool(tool: dict, name: str, params: dict):
+    """
+    Calls `tool` and returns its output (or the error it raised) and the
+    seconds it took.
+    """
+    start_time = time.perf_counter()
+    try:
+        output = await asyncio.wait_for(
+            tool["callable"](**params), timeout=TOOLS_TIMEOUT or None
+        )
+    except asyncio.TimeoutError:
+        output = f"Tool {name} timed out after {TOOLS_TIMEOUT} seconds"
+        log.warning(output)
+    except Exception as e:
+        output = str(e)
+    return output, time.perf_counter() - start_time
 
 
 async def chat_completion_tools_handler(
@@ -394,64 +430,77 @@ async def chat_completion_tools_handler(
     log.info(f"{tools=}")
 
     specs = [tool["spec"] for tool in tools.values()]
-    tools_specs = json.dumps(specs)
 
-    tools_function_calling_prompt = tools_function_calling_generation_template(
-        app.state.config.TOOLS_FUNCTION_CALLING_PROMPT_TEMPLATE, tools_specs
-    )
-    log.info(f"{tools_function_calling_prompt=}")
-    payload = get_tools_function_calling_payload(
-        body["messages"], task_model_id, tools_function_calling_prompt
-    )
+    native = supports_native_tool_calling(app.state.MODELS[task_model_id])
+    if native:
+        payload = get_native_tools_function_calling_payload(
+            body["messages"], task_model_id, specs
+        )
+    else:
+        tools_function_calling_prompt = tools_function_calling_generation_template(
+            app.state.config.TOOLS_FUNCTION_CALLING_PROMPT_TEMPLATE, json.dumps(specs)
+        )
+        log.info(f"{tools_function_calling_prompt=}")
+        payload = get_tools_function_calling_payload(
+            body["messages"], task_model_id, tools_function_calling_prompt
+        )
 
     try:
-        payload = filter_pipeline(payload, user)
+        payload = await filter_pipeline(payload, user)
     except Exception as e:
         raise e
 
     try:
         response = await generate_chat_completions(form_data=payload, user=user)
         log.debug(f"{response=}")
-        content = await get_content_from_response(response)
-        log.debug(f"{content=}")
+        message = await get_message_from_response(response)
+        log.debug(f"{message=}")
 
-        if not content:
+        if not message:
             return body, {}
 
-        result = json.loads(content)
-
-        tool_function_name = result.get("name", None)
-        if tool_function_name not in tools:
-            return body, {}
+        tool_calls = [
+            tool_call
+            for tool_call in get_tool_calls_from_message(message, native)
+            if tool_call["name"] in tools
+        ]
 
-        tool_function_params = result.get("parameters", {})
+        # The tools run concurrently, each with its own timeout
+        results = await asyncio.gather(
+            *[
+                call_tool(tools[call["name"]], call["name"], call["parameters"])
+                for call in tool_calls
+            ]
+        )
 
-        try:
-            tool_output = await tools[tool_function_name]["callable"](
-                **tool_function_params
-            )
-        except Exception as e:
-            tool_output = str(e)
+        for tool_call, (tool_output, duration) in zip(tool_calls, results):
+            tool_function_name = tool_call["name"]
+            tool = tools[tool_function_name]
+            log.debug(f"{tool_function_name} took {duration:.3f}s")
 
-        if tools[tool_function_name]["citation"]:
-            citations.append(
-                {
-                    "source": {
-                        "name": f"TOOL:{tools[tool_function_name]['toolkit_id']}/{tool_function_name}"
-                    },
-                    "document": [tool_output],
-                    "metadata": [{"source": tool_function_name}],
-                }
-            )
-        if tools[tool_function_name]["file_handler"]:
-            skip_files = True
+            if tool["citation"]:
+                citations.append(
+                    {
+                        "source": {
+                            "name": f"TOOL:{tool['toolkit_id']}/{tool_function_name}"
+                        },
+                        "document": [tool_output],
+                        "metadata": [
+                            {
+                                "source": tool_function_name,
+                                "duration": round(duration, 3),
+                            }
+                        ],
+                    }
+                )
+            if tool["file_handler"]:
+                skip_files = True
 
-        if isinstance(tool_output, str):
-            contexts.append(tool_output)
+            if isinstance(tool_output, str):
+                contexts.append(tool_output)
 
     except Exception as e:
         log.exception(f"Error: {e}")
-        content = None
 
     log.debug(f"tool_contexts: {contexts}")
 
@@ -466,7 +515,7 @@ async def chat_completion_files_handler(body) -> tuple[dict, dict[str, list]]:
     citations = []
 
     if files := body.get("metadata", {}).get("files", None):
-        contexts, citations = get_rag_context(
+        contexts, citations = await get_rag_context_async(
             files=files,
             messages=body["messages"],
             embedding_function=rag_app.state.EMBEDDING_FUNCTION,
@@ -481,168 +530,170 @@ async def chat_completion_files_handler(body) -> tuple[dict, dict[str, list]]:
     return body, {"contexts": contexts, "citations": citations}
 
 
-def is_chat_completion_request(request):
-    return request.method == "POST" and any(
-        endpoint in request.url.path
-        for endpoint in ["/ollama/api/chat", "/chat/completions"]
-    )
-
-
-async def get_body_and_model_and_user(request):
-    # Read the original request body
-    body = await request.body()
-    body_str = body.decode("utf-8")
-    body = json.loads(body_str) if body_str else {}
-
-    model_id = body["model"]
-    if model_id not in app.state.MODELS:
-        raise Exception("Model not found")
-    model = app.state.MODELS[model_id]
-
-    user = get_current_user(
-        request,
-        get_http_authorization_cred(request.headers.get("Authorization")),
-    )
+##################################
+#
+# Chat Pipeline
+#
+##################################
 
-    return body, model, user
 
+@chat_pipeline.stage("pipeline_filters")
+async def pipeline_filters_stage(request: ChatRequest):
+    try:
+        request.body = await filter_pipeline(request.body, request.user)
+    except PipelineFilterError as e:
+        return JSONResponse(status_code=e.status_code, content=e.content)
 
-class ChatCompletionMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        if not is_chat_completion_request(request):
-            return await call_next(request)
-        log.debug(f"request.url.path: {request.url.path}")
 
-        try:
-            body, model, user = await get_body_and_model_and_user(request)
-        except Exception as e:
-            return JSONResponse(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                content={"detail": str(e)},
-            )
+@chat_pipeline.stage("function_filters")
+async def function_filters_stage(request: ChatRequest):
+    body, user = request.body, request.user
 
-        metadata = {
-            "chat_id": body.pop("chat_id", None),
-            "message_id": body.pop("id", None),
-            "session_id": body.pop("session_id", None),
-            "tool_ids": body.get("tool_ids", None),
-            "files": body.get("files", None),
-        }
-        body["metadata"] = metadata
+    metadata = {
+        "chat_id": body.pop("chat_id", None),
+        "message_id": body.pop("id", None),
+        "session_id": body.pop("session_id", None),
+        "tool_ids": body.get("tool_ids", None),
+        "files": body.get("files", None),
+    }
+    body["metadata"] = metadata
 
-        __user__ = {
+    request.extra_params = {
+        "__user__": {
             "id": user.id,
             "email": user.email,
             "name": user.name,
             "role": user.role,
-        }
+        },
+        "__event_emitter__": get_event_emitter(metadata),
+        "__event_call__": get_event_call(metadata),
+    }
 
-        extra_params = {
-            "__user__": __user__,
-            "__event_emitter__": get_event_emitter(metadata),
-            "__event_call__": get_event_call(metadata),
-        }
+    try:
+        body, flags = await chat_completion_filter_functions_handler(
+            body, request.model, user, request.extra_params
+        )
+    except Exception as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"detail": str(e)},
+        )
+
+    request.metadata = {
+        **metadata,
+        "tool_ids": body.pop("tool_ids", None),
+        "files": body.pop("files", None),
+    }
+    body["metadata"] = request.metadata
+    request.body = body
 
-        # Initialize data_items to store additional data to be sent to the client
-        # Initalize contexts and citation
-        data_items = []
-        contexts = []
-        citations = []
 
-        try:
-            body, flags = await chat_completion_filter_functions_handler(
-                body, model, extra_params
+@chat_pipeline.stage("tools")
+async def tools_stage(request: ChatRequest):
+    try:
+        request.body, flags = await chat_completion_tools_handler(
+            request.body, request.user, request.extra_params
+        )
+        request.contexts.extend(flags.get("contexts", []))
+        request.citations.extend(flags.get("citations", []))
+    except Exception as e:
+        log.exception(e)
+
+
+@chat_pipeline.stage("rag")
+async def rag_stage(request: ChatRequest):
+    body = request.body
+    try:
+        body, flags = await chat_completion_files_handler(body)
+        request.contexts.extend(flags.get("contexts", []))
+        request.citations.extend(flags.get("citations", []))
+    except Exception as e:
+        log.exception(e)
+
+    # If context is not empty, insert it into the messages
+    if len(request.contexts) > 0:
+        context_string = "/n".join(request.contexts).strip()
+        prompt = get_last_user_message(body["messages"])
+        if prompt is None:
+            raise Exception("No user message found")
+        # Workaround for Ollama 2.0+ system prompt issue
+        # TODO: replace with add_or_update_system_message
+        if request.model["owned_by"] == "ollama":
+            body["messages"] = prepend_to_first_user_message_content(
+                rag_template(rag_app.state.config.RAG_TEMPLATE, context_string, prompt),
+                body["messages"],
             )
-        except Exception as e:
-            return JSONResponse(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                content={"detail": str(e)},
+        else:
+            body["messages"] = add_or_update_system_message(
+                rag_template(rag_app.state.config.RAG_TEMPLATE, context_string, prompt),
+                body["messages"],
             )
 
-        metadata = {
-            **metadata,
-            "tool_ids": body.pop("tool_ids", None),
-            "files": body.pop("files", None),
-        }
-        body["metadata"] = metadata
+    # If there are citations, send them to the client ahead of the completion
+    if len(request.citations) > 0:
+        request.data_items.append({"citations": request.citations})
+    request.body = body
 
-        try:
-            body, flags = await chat_completion_tools_handler(body, user, extra_params)
-            contexts.extend(flags.get("contexts", []))
-            citations.extend(flags.get("citations", []))
-        except Exception as e:
-            log.exception(e)
 
-        try:
-            body, flags = await chat_completion_files_handler(body)
-            contexts.extend(flags.get("contexts", []))
-            citations.extend(flags.get("citations", []))
-        except Exception as e:
-            log.exception(e)
-
-        # If context is not empty, insert it into the messages
-        if len(contexts) > 0:
-            context_string = "/n".join(contexts).strip()
-            prompt = get_last_user_message(body["messages"])
-            if prompt is None:
-                raise Exception("No user message found")
-            # Workaround for Ollama 2.0+ system prompt issue
-            # TODO: replace with add_or_update_system_message
-            if model["owned_by"] == "ollama":
-                body["messages"] = prepend_to_first_user_message_content(
-                    rag_template(
-                        rag_app.state.config.RAG_TEMPLATE, context_string, prompt
-                    ),
-                    body["messages"],
-                )
-            else:
-                body["messages"] = add_or_update_system_message(
-                    rag_template(
-                        rag_app.state.config.RAG_TEMPLATE, context_string, prompt
-                    ),
-                    body["messages"],
-                )
+async def run_chat_pipeline(form_data: dict, user: UserModel, completion):
+    model_id = form_data.get("model")
+    if model_id not in app.state.MODELS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Model not found",
+        )
+
+    request = ChatRequest(form_data, app.state.MODELS[model_id], user)
+    return await chat_pipeline.run(request, completion)
+
+
+# The chat endpoints of the mounted Ollama and OpenAI apps go through the
+# pipeline too. They are registered before the apps are mounted so that they
+# take precedence over the apps' own routes.
 
-        # If there are citations, add them to the data_items
-        if len(citations) > 0:
-            data_items.append({"citations": citations})
-
-        modified_body_bytes = json.dumps(body).encode("utf-8")
-        # Replace the request body with the modified one
-        request._body = modified_body_bytes
-        # Set custom header to ensure content-length matches new body length
-        request.headers.__dict__["_list"] = [
-            (b"content-length", str(len(modified_body_bytes)).encode("utf-8")),
-            *[(k, v) for k, v in request.headers.raw if k.lower() != b"content-length"],
-        ]
 
-        response = await call_next(request)
-        if not isinstance(response, StreamingResponse):
-            return response
+@app.post("/ollama/api/chat")
+@app.post("/ollama/api/chat/{url_idx}")
+async def generate_ollama_api_chat_completion(
+    form_data: dict, url_idx: Optional[int] = None, user=Depends(get_verified_user)
+):
+    async def completion(request: ChatRequest):
+        try:
+            form = GenerateChatCompletionForm(**request.body)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        return await generate_ollama_native_chat_completion(
+            form, url_idx, user=request.user
+        )
 
-        content_type = response.headers["Content-Type"]
-        is_openai = "text/event-stream" in content_type
-        is_ollama = "application/x-ndjson" in content_type
-        if not is_openai and not is_ollama:
-            return response
+    return await run_chat_pipeline(form_data, user, completion)
 
-        def wrap_item(item):
-            return f"data: {item}\n\n" if is_openai else f"{item}\n"
 
-        async def stream_wrapper(original_generator, data_items):
-            for item in data_items:
-                yield wrap_item(json.dumps(item))
+@app.post("/ollama/v1/chat/completions")
+@app.post("/ollama/v1/chat/completions/{url_idx}")
+async def generate_ollama_openai_chat_completion(
+    form_data: dict, url_idx: Optional[int] = None, user=Depends(get_verified_user)
+):
+    async def completion(request: ChatRequest):
+        return await generate_ollama_chat_completion(
+            request.body, url_idx, user=request.user
+        )
 
-            async for data in original_generator:
-                yield data
+    return await run_chat_pipeline(form_data, user, completion)
 
-        return StreamingResponse(stream_wrapper(response.body_iterator, data_items))
 
-    async def _receive(self, body: bytes):
-        return {"type": "http.request", "body": body, "more_body": False}
+@app.post("/openai/chat/completions")
+@app.post("/openai/chat/completions/{url_idx}")
+async def generate_openai_api_chat_completion(
+    form_data: dict, url_idx: Optional[int] = None, user=Depends(get_verified_user)
+):
+    async def completion(request: ChatRequest):
+        return await generate_openai_chat_completion(
+            request.body, url_idx, user=request.user
+        )
 
+    return await run_chat_pipeline(form_data, user, completion)
 
-app.add_middleware(ChatCompletionMiddleware)
 
 ##################################
 #
@@ -670,7 +721,7 @@ def get_sorted_filters(model_id):
     return sorted_filters
 
 
-def filter_pipeline(payload, user):
+async def filter_pipeline(payload, user):
     user = {"id": user.id, "email": user.email, "name": user.name, "role": user.role}
     model_id = payload["model"]
     sorted_filters = get_sorted_filters(model_id)
@@ -680,85 +731,13 @@ def filter_pipeline(payload, user):
     if "pipeline" in model:
         sorted_filters.append(model)
 
-    for filter in sorted_filters:
-        r = None
-        try:
-            urlIdx = filter["urlIdx"]
-
-            url = openai_app.state.config.OPENAI_API_BASE_URLS[urlIdx]
-            key = openai_app.state.config.OPENAI_API_KEYS[urlIdx]
-
-            if key == "":
-                continue
-
-            headers = {"Authorization": f"Bearer {key}"}
-            r = requests.post(
-                f"{url}/{filter['id']}/filter/inlet",
-                headers=headers,
-                json={
-                    "user": user,
-                    "body": payload,
-                },
-            )
-
-            r.raise_for_status()
-            payload = r.json()
-        except Exception as e:
-            # Handle connection error here
-            print(f"Connection error: {e}")
-
-            if r is not None:
-                res = r.json()
-                if "detail" in res:
-                    raise Exception(r.status_code, res["detail"])
-
-    return payload
-
-
-class PipelineMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        if not is_chat_completion_request(request):
-            return await call_next(request)
-
-        log.debug(f"request.url.path: {request.url.path}")
-
-        # Read the original request body
-        body = await request.body()
-        # Decode body to string
-        body_str = body.decode("utf-8")
-        # Parse string to JSON
-        data = json.loads(body_str) if body_str else {}
-
-        user = get_current_user(
-            request,
-            get_http_authorization_cred(request.headers["Authorization"]),
-        )
-
-        try:
-            data = filter_pipeline(data, user)
-        except Exception as e:
-            return JSONResponse(
-                status_code=e.args[0],
-                content={"detail": e.args[1]},
-            )
-
-        modified_body_bytes = json.dumps(data).encode("utf-8")
-        # Replace the request body with the modified one
-        request._body = modified_body_bytes
-        # Set custom header to ensure content-length matches new body length
-        request.headers.__dict__["_list"] = [
-            (b"content-length", str(len(modified_body_bytes)).encode("utf-8")),
-            *[(k, v) for k, v in request.headers.raw if k.lower() != b"content-length"],
-        ]
-
-        response = await call_next(request)
-        return response
-
-    async def _receive(self, body: bytes):
-        return {"type": "http.request", "body": body, "more_body": False}
-
-
-app.add_middleware(PipelineMiddleware)
+    return await pipeline_filter_client.inlet(
+        sorted_filters,
+        openai_app.state.config.OPENAI_API_BASE_URLS,
+        openai_app.state.config.OPENAI_API_KEYS,
+        user,
+        payload,
+    )
 
 
 app.add_middleware(
@@ -773,8 +752,10 @@ async def _receive(self, body: bytes):
 @app.middleware("http")
 async def commit_session_after_request(request: Request, call_next):
     response = await call_next(request)
-    log.debug("Commit session after request")
-    Session.commit()
+    # Most requests never touch the scoped session, so don't open one for them
+    if Session.registry.has() and Session().in_transaction():
+        log.debug("Commit session after request")
+        Session.commit()
     return response
 
 
@@ -816,7 +797,10 @@ async def update_embedding_function(request: Request, call_next):
 
 
 async def get_all_models():
-    # TODO: Optimize this function
+    return await model_registry.get_models()
+
+
+async def fetch_all_models():
     pipe_models = []
     openai_models = []
     ollama_models = []
@@ -843,15 +827,18 @@ async def get_all_models():
 
     models = pipe_models + openai_models + ollama_models
 
+    # Index enabled actions once instead of querying them per model
+    action_functions = {
+        function.id: function
+        for function in await AsyncFunctions.get_functions_by_type(
+            "action", active_only=True
+        )
+    }
     global_action_ids = [
-        function.id for function in Functions.get_global_action_functions()
-    ]
-    enabled_action_ids = [
-        function.id
-        for function in Functions.get_functions_by_type("action", active_only=True)
+        function.id for function in action_functions.values() if function.is_global
     ]
 
-    custom_models = Models.get_all_models()
+    custom_models = await AsyncModels.get_all_models()
     for custom_model in custom_models:
         if custom_model.base_model_id is None:
             for model in models:
@@ -899,6 +886,43 @@ async def get_all_models():
                 }
             )
 
+    action_items = {}
+    for action_id, action in action_functions.items():
+        if action_id in webui_app.state.FUNCTIONS:
+            function_module = webui_app.state.FUNCTIONS[action_id]
+        else:
+            function_module, _, _ = load_function_module_by_id(action_id)
+            webui_app.state.FUNCTIONS[action_id] = function_module
+
+        __webui__ = False
+        if hasattr(function_module, "__webui__"):
+            __webui__ = function_module.__webui__
+
+        if hasattr(function_module, "actions"):
+            actions = function_module.actions
+            action_items[action_id] = [
+                {
+                    "id": f"{action_id}.{_action['id']}",
+                    "name": _action.get("name", f"{action.name} ({_action['id']})"),
+                    "description": action.meta.description,
+                    "icon_url": _action.get(
+                        "icon_url", action.meta.manifest.get("icon_url", None)
+                    ),
+                    **({"__webui__": __webui__} if __webui__ else {}),
+                }
+                for _action in actions
+            ]
+        else:
+            action_items[action_id] = [
+                {
+                    "id": action_id,
+                    "name": action.name,
+                    "description": action.meta.description,
+                    "icon_url": action.meta.manifest.get("icon_url", None),
+                    **({"__webui__": __webui__} if __webui__ else {}),
+                }
+            ]
+
     for model in models:
         action_ids = []
         if "action_ids" in model:
@@ -907,54 +931,11 @@ async def get_all_models():
 
         action_ids = action_ids + global_action_ids
         action_ids = list(set(action_ids))
-        action_ids = [
-            action_id for action_id in action_ids if action_id in enabled_action_ids
-        ]
 
         model["actions"] = []
         for action_id in action_ids:
-            action = Functions.get_function_by_id(action_id)
-            if action is None:
-                raise Exception(f"Action not found: {action_id}")
-
-            if action_id in webui_app.state.FUNCTIONS:
-                function_module = webui_app.state.FUNCTIONS[action_id]
-            else:
-                function_module, _, _ = load_function_module_by_id(action_id)
-                webui_app.state.FUNCTIONS[action_id] = function_module
-
-            __webui__ = False
-            if hasattr(function_module, "__webui__"):
-                __webui__ = function_module.__webui__
-
-            if hasattr(function_module, "actions"):
-                actions = function_module.actions
-                model["actions"].extend(
-                    [
-                        {
-                            "id": f"{action_id}.{_action['id']}",
-                            "name": _action.get(
-                                "name", f"{action.name} ({_action['id']})"
-                            ),
-                            "description": action.meta.description,
-                            "icon_url": _action.get(
-                                "icon_url", action.meta.manifest.get("icon_url", None)
-                            ),
-                            **({"__webui__": __webui__} if __webui__ else {}),
-                        }
-                        for _action in actions
-                    ]
-                )
-            else:
-                model["actions"].append(
-                    {
-                        "id": action_id,
-                        "name": action.name,
-                        "description": action.meta.description,
-                        "icon_url": action.meta.manifest.get("icon_url", None),
-                        **({"__webui__": __webui__} if __webui__ else {}),
-                    }
-                )
+            if action_id in action_items:
+                model["actions"].extend(action_items[action_id])
 
     app.state.MODELS = {model["id"]: model for model in models}
     webui_app.state.MODELS = app.state.MODELS
@@ -962,6 +943,9 @@ async def get_all_models():
     return models
 
 
+model_registry.set_loader(fetch_all_models)
+
+
 @app.get("/api/models")
 async def get_models(user=Depends(get_verified_user)):
     models = await get_all_models()
@@ -987,7 +971,14 @@ async def get_models(user=Depends(get_verified_user)):
 
 
 @app.post("/api/chat/completions")
-async def generate_chat_completions(form_data: dict, user=Depends(get_verified_user)):
+async def chat_completion(form_data: dict, user=Depends(get_verified_user)):
+    async def completion(request: ChatRequest):
+        return await generate_chat_completions(request.body, user=request.user)
+
+    return await run_chat_pipeline(form_data, user, completion)
+
+
+async def generate_chat_completions(form_data: dict, user: UserModel):
     model_id = form_data["model"]
     if model_id not in app.state.MODELS:
         raise HTTPException(
@@ -1018,49 +1009,21 @@ async def chat_completed(form_data: dict, user=Depends(get_verified_user)):
     if "pipeline" in model:
         sorted_filters = [model] + sorted_filters
 
-    for filter in sorted_filters:
-        r = None
-        try:
-            urlIdx = filter["urlIdx"]
-
-            url = openai_app.state.config.OPENAI_API_BASE_URLS[urlIdx]
-            key = openai_app.state.config.OPENAI_API_KEYS[urlIdx]
-
-            if key != "":
-                headers = {"Authorization": f"Bearer {key}"}
-                r = requests.post(
-                    f"{url}/{filter['id']}/filter/outlet",
-                    headers=headers,
-                    json={
-                        "user": {
-                            "id": user.id,
-                            "name": user.name,
-                            "email": user.email,
-                            "role": user.role,
-                        },
-                        "body": data,
-                    },
-                )
-
-                r.raise_for_status()
-                data = r.json()
-        except Exception as e:
-            # Handle connection error here
-            print(f"Connection error: {e}")
-
-            if r is not None:
-                try:
-                    res = r.json()
-                    if "detail" in res:
-                        return JSONResponse(
-                            status_code=r.status_code,
-                            content=res,
-                        )
-                except Exception:
-                    pass
-
-            else:
-                pass
+    try:
+        data = await pipeline_filter_client.outlet(
+            sorted_filters,
+            openai_app.state.config.OPENAI_API_BASE_URLS,
+            openai_app.state.config.OPENAI_API_KEYS,
+            {
+                "id": user.id,
+                "name": user.name,
+                "email": user.email,
+                "role": user.role,
+            },
+            data,
+        )
+    except PipelineFilterError as e:
+        return JSONResponse(status_code=e.status_code, content=e.content)
 
     __event_emitter__ = get_event_emitter(
         {
@@ -1078,92 +1041,33 @@ async def chat_completed(form_data: dict, user=Depends(get_verified_user)):
         }
     )
 
-    def get_priority(function_id):
-        function = Functions.get_function_by_id(function_id)
-        if function is not None and hasattr(function, "valves"):
-            # TODO: Fix FunctionModel to include vavles
-            return (function.valves if function.valves else {}).get("priority", 0)
-        return 0
-
-    filter_ids = [function.id for function in Functions.get_global_filter_functions()]
-    if "info" in model and "meta" in model["info"]:
-        filter_ids.extend(model["info"]["meta"].get("filterIds", []))
-        filter_ids = list(set(filter_ids))
-
-    enabled_filter_ids = [
-        function.id
-        for function in Functions.get_functions_by_type("filter", active_only=True)
-    ]
-    filter_ids = [
-        filter_id for filter_id in filter_ids if filter_id in enabled_filter_ids
-    ]
-
-    # Sort filter_ids by priority, using the get_priority function
-    filter_ids.sort(key=get_priority)
-
-    for filter_id in filter_ids:
-        filter = Functions.get_function_by_id(filter_id)
-        if not filter:
-            continue
-
-        if filter_id in webui_app.state.FUNCTIONS:
-            function_module = webui_app.state.FUNCTIONS[filter_id]
-        else:
-            function_module, _, _ = load_function_module_by_id(filter_id)
-            webui_app.state.FUNCTIONS[filter_id] = function_module
+    __user__ = {
+        "id": user.id,
+        "email": user.email,
+        "name": user.name,
+        "role": user.role,
+    }
 
-        if hasattr(function_module, "valves") and hasattr(function_module, "Valves"):
-            valves = Functions.get_function_valves_by_id(filter_id)
-            function_module.valves = function_module.Valves(
-                **(valves if valves else {})
-            )
+    for filter_id in function_plans.get_filter_ids(model):
+        plan = function_plans.get_function(webui_app, filter_id)
+        function_module = plan.module
 
         if not hasattr(function_module, "outlet"):
             continue
         try:
-            outlet = function_module.outlet
-
-            # Get the signature of the function
-            sig = inspect.signature(outlet)
-            params = {"body": data}
-
             # Extra parameters to be passed to the function
             extra_params = {
                 "__model__": model,
                 "__id__": filter_id,
                 "__event_emitter__": __event_emitter__,
                 "__event_call__": __event_call__,
+                "__user__": plan.get_user("outlet", __user__, user),
             }
+            params = {"body": data, **plan.get_params("outlet", extra_params)}
 
-            # Add extra params in contained in function signature
-            for key, value in extra_params.items():
-                if key in sig.parameters:
-                    params[key] = value
-
-            if "__user__" in sig.parameters:
-                __user__ = {
-                    "id": user.id,
-                    "email": user.email,
-                    "name": user.name,
-                    "role": user.role,
-                }
-
-                try:
-                    if hasattr(function_module, "UserValves"):
-                        __user__["valves"] = function_module.UserValves(
-                            **Functions.get_user_valves_by_id_and_user_id(
-                                filter_id, user.id
-                            )
-                        )
-                except Exception as e:
-                    print(e)
-
-                params = {**params, "__user__": __user__}
-
-            if inspect.iscoroutinefunction(outlet):
-                data = await outlet(**params)
-            else:
-                data = outlet(**params)
+            data = await function_executor.run(
+                filter_id, function_module.outlet, **params
+            )
 
         except Exception as e:
             print(f"Error: {e}")
@@ -1213,61 +1117,33 @@ async def chat_action(action_id: str, form_data: dict, user=Depends(get_verified
         }
     )
 
-    if action_id in webui_app.state.FUNCTIONS:
-        function_module = webui_app.state.FUNCTIONS[action_id]
-    else:
-        function_module, _, _ = load_function_module_by_id(action_id)
-        webui_app.state.FUNCTIONS[action_id] = function_module
-
-    if hasattr(function_module, "valves") and hasattr(function_module, "Valves"):
-        valves = Functions.get_function_valves_by_id(action_id)
-        function_module.valves = function_module.Valves(**(valves if valves else {}))
+    plan = function_plans.get_function(webui_app, action_id)
+    function_module = plan.module
 
     if hasattr(function_module, "action"):
         try:
-            action = function_module.action
-
-            # Get the signature of the function
-            sig = inspect.signature(action)
-            params = {"body": data}
-
             # Extra parameters to be passed to the function
             extra_params = {
                 "__model__": model,
                 "__id__": sub_action_id if sub_action_id is not None else action_id,
                 "__event_emitter__": __event_emitter__,
                 "__event_call__": __event_call__,
+                "__user__": plan.get_user(
+                    "action",
+                    {
+                        "id": user.id,
+                        "email": user.email,
+                        "name": user.name,
+                        "role": user.role,
+                    },
+                    user,
+                ),
             }
+            params = {"body": data, **plan.get_params("action", extra_params)}
 
-            # Add extra params in contained in function signature
-            for key, value in extra_params.items():
-                if key in sig.parameters:
-                    params[key] = value
-
-            if "__user__" in sig.parameters:
-                __user__ = {
-                    "id": user.id,
-                    "email": user.email,
-                    "name": user.name,
-                    "role": user.role,
-                }
-
-                try:
-                    if hasattr(function_module, "UserValves"):
-                        __user__["valves"] = function_module.UserValves(
-                            **Functions.get_user_valves_by_id_and_user_id(
-                                action_id, user.id
-                            )
-                        )
-                except Exception as e:
-                    print(e)
-
-                params = {**params, "__user__": __user__}
-
-            if inspect.iscoroutinefunction(action):
-                data = await action(**params)
-            else:
-                data = action(**params)
+            data = await function_executor.run(
+                action_id, function_module.action, **params
+            )
 
         except Exception as e:
             print(f"Error: {e}")
@@ -1337,6 +1213,15 @@ async def update_task_config(form_data: TaskConfigForm, user=Depends(get_admin_u
     }
 
 
+async def run_task(payload: dict, user: UserModel):
+    model = app.state.MODELS.get(payload["model"], {})
+    return await task_runner.run(
+        payload,
+        lambda payload: generate_chat_completions(form_data=payload, user=user),
+        owned_by=model.get("owned_by"),
+    )
+
+
 @app.post("/api/task/title/completions")
 async def generate_title(form_data: dict, user=Depends(get_verified_user)):
     print("generate_title")
@@ -1377,7 +1262,7 @@ async def generate_title(form_data: dict, user=Depends(get_verified_user)):
     log.debug(payload)
 
     try:
-        payload = filter_pipeline(payload, user)
+        payload = await filter_pipeline(payload, user)
     except Exception as e:
         return JSONResponse(
             status_code=e.args[0],
@@ -1387,7 +1272,7 @@ async def generate_title(form_data: dict, user=Depends(get_verified_user)):
     if "chat_id" in payload:
         del payload["chat_id"]
 
-    return await generate_chat_completions(form_data=payload, user=user)
+    return await run_task(payload, user)
 
 
 @app.post("/api/task/query/completions")
@@ -1430,7 +1315,7 @@ async def generate_search_query(form_data: dict, user=Depends(get_verified_user)
     print(payload)
 
     try:
-        payload = filter_pipeline(payload, user)
+        payload = await filter_pipeline(payload, user)
     except Exception as e:
         return JSONResponse(
             status_code=e.args[0],
@@ -1440,7 +1325,7 @@ async def generate_search_query(form_data: dict, user=Depends(get_verified_user)
     if "chat_id" in payload:
         del payload["chat_id"]
 
-    return await generate_chat_completions(form_data=payload, user=user)
+    return await run_task(payload, user)
 
 
 @app.post("/api/task/emoji/completions")
@@ -1487,7 +1372,7 @@ async def generate_emoji(form_data: dict, user=Depends(get_verified_user)):
     log.debug(payload)
 
     try:
-        payload = filter_pipeline(payload, user)
+        payload = await filter_pipeline(payload, user)
     except Exception as e:
         return JSONResponse(
             status_code=e.args[0],
@@ -1497,7 +1382,7 @@ async def generate_emoji(form_data: dict, user=Depends(get_verified_user)):
     if "chat_id" in payload:
         del payload["chat_id"]
 
-    return await generate_chat_completions(form_data=payload, user=user)
+    return await run_task(payload, user)
 
 
 @app.post("/api/task/moa/completions")
@@ -1539,7 +1424,7 @@ async def generate_moa_response(form_data: dict, user=Depends(get_verified_user)
     log.debug(payload)
 
     try:
-        payload = filter_pipeline(payload, user)
+        payload = await filter_pipeline(payload, user)
     except Exception as e:
         return JSONResponse(
             status_code=e.args[0],
@@ -1549,7 +1434,7 @@ async def generate_moa_response(form_data: dict, user=Depends(get_verified_user)
     if "chat_id" in payload:
         del payload["chat_id"]
 
-    return await generate_chat_completions(form_data=payload, user=user)
+    return await run_task(payload, user)
 
 
 ##################################
@@ -1617,6 +1502,7 @@ async def upload_pipeline(
 
         r.raise_for_status()
         data = r.json()
+        model_registry.invalidate()
 
         return {**data}
     except Exception as e:
@@ -1665,6 +1551,7 @@ async def add_pipeline(form_data: AddPipelineForm, user=Depends(get_admin_user))
 
         r.raise_for_status()
         data = r.json()
+        model_registry.invalidate()
 
         return {**data}
     except Exception as e:
@@ -1707,6 +1594,7 @@ async def delete_pipeline(form_data: DeletePipelineForm, user=Depends(get_admin_
 
         r.raise_for_status()
         data = r.json()
+        model_registry.invalidate()
 
         return {**data}
     except Exception as e:
@@ -1893,7 +1781,7 @@ async def get_app_config(request: Request):
         token = request.cookies.get("token")
         data = decode_token(token)
         if data is not None and "id" in data:
-            user = Users.get_user_by_id(data["id"])
+            user = await AsyncUsers.get_user_by_id(data["id"])
 
     return {
         "status": True,
@@ -1992,6 +1880,29 @@ async def update_webhook_url(form_data: UrlForm, user=Depends(get_admin_user)):
     return {"url": app.state.config.WEBHOOK_URL}
 
 
+@app.get("/api/metrics")
+async def get_app_metrics(user=Depends(get_admin_user)):
+    return {
+        "client_pool": client_pool.get_metrics(),
+        "ollama_load_balancer": ollama_app.state.LOAD_BALANCER.get_metrics(),
+        "embedding_cache": embedding_cache.get_metrics(),
+        "rag_executor": rag_executor.get_metrics(),
+        "ingestion_jobs": ingestion_jobs.get_metrics(),
+        "whisper_pool": audio_app.state.WHISPER_MODEL_POOL.get_metrics(),
+        "stt_stream_executor": stt_stream_executor.get_metrics(),
+        "speech_cache": audio_app.state.SPEECH_CACHE.get_metrics(),
+        "image_executor": image_executor.get_metrics(),
+        "image_generation_queue": images_app.state.IMAGE_GENERATION_QUEUE.get_metrics(),
+        "user_cache": user_cache.get_metrics(),
+        "db": get_db_metrics(),
+        "pipeline_filters": pipeline_filter_client.get_metrics(),
+        "functions": function_executor.get_metrics(),
+        "function_plans": function_plans.get_metrics(),
+        "chat_pipeline": chat_pipeline.get_metrics(),
+        "task_runner": task_runner.get_metrics(),
+    }
+
+
 @app.get("/api/version")
 async def get_app_version():
     return {
@@ -2234,7 +2145,11 @@ async def healthcheck():
 
 @app.get("/health/db")
 async def healthcheck_with_db():
-    Session.execute(text("SELECT 1;")).all()
+    def check_db():
+        with get_db() as db:
+            db.execute(text("SELECT 1;")).all()
+
+    await db_executor.run(check_db)
     return {"status": True}
 
 
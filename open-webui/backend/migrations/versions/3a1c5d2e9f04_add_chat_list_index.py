@@ -0,0 +1,36 @@
+"""add chat list index
+
+Revision ID: 3a1c5d2e9f04
+Revises: 7e5b5dc7342b
+Create Date: 2024-08-06 10:12:41.215733
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import Inspector
+
+# revision identifiers, used by Alembic.
+revision: str = "3a1c5d2e9f04"
+down_revision: Union[str, None] = "7e5b5dc7342b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEX_NAME = "chat_user_id_archived_updated_at_idx"
+
+
+def get_existing_indexes(table_name: str) -> set[str]:
+    inspector = Inspector.from_engine(op.get_bind())
+    return {index["name"] for index in inspector.get_indexes(table_name)}
+
+
+def upgrade() -> None:
+    # Chat lists are filtered by user and archived state and sorted by update time
+    if INDEX_NAME not in get_existing_indexes("chat"):
+        op.create_index(INDEX_NAME, "chat", ["user_id", "archived", "updated_at"])
+
+
+def downgrade() -> None:
+    op.drop_index(INDEX_NAME, table_name="chat")
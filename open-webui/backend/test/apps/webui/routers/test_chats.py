@@ -1,3 +1,4 @@
+import json
 import uuid
 
 from test.util.abstract_integration_test import AbstractPostgresTest
@@ -41,6 +42,40 @@ def test_get_session_user_chat_list(self):
         assert first_chat["created_at"] is not None
         assert first_chat["updated_at"] is not None
 
+    def test_get_session_user_chat_list_by_cursor(self):
+        from apps.webui.models.chats import ChatForm
+
+        for i in range(2):
+            self.chats.insert_new_chat("2", ChatForm(**{"chat": {"title": f"chat{i}"}}))
+
+        ids = []
+        cursor = None
+        with mock_webui_user(id="2"):
+            while True:
+                params = {"limit": 2}
+                if cursor:
+                    params["cursor"] = cursor
+                response = self.fast_api_client.get(
+                    self.create_url("/list"), params=params
+                )
+                assert response.status_code == 200
+                ids += [chat["id"] for chat in response.json()]
+                cursor = response.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+        assert len(ids) == 3
+        assert len(set(ids)) == 3
+
+    def test_export_user_chats(self):
+        with mock_webui_user(id="2"):
+            response = self.fast_api_client.get(self.create_url("/export"))
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert len(lines) == 1
+        chat = json.loads(lines[0])
+        assert chat["user_id"] == "2"
+        assert chat["chat"]["name"] == "chat1"
+
     def test_delete_all_user_chats(self):
         with mock_webui_user(id="2"):
             response = self.fast_api_client.delete(self.create_url("/"))
@@ -85,6 +120,27 @@ def test_create_new_chat(self):
         assert data["created_at"] is not None
         assert len(self.chats.get_chats()) == 2
 
+    def test_get_user_chat_list_by_tag_name(self):
+        from apps.webui.models.tags import ChatIdTagForm, Tags
+
+        chat_id = self.chats.get_chats()[0].id
+        Tags.add_tag_to_chat("2", ChatIdTagForm(tag_name="tag1", chat_id=chat_id))
+
+        with mock_webui_user(id="2"):
+            response = self.fast_api_client.post(
+                self.create_url("/tags"), json={"name": "tag1"}
+            )
+            assert response.status_code == 200
+            assert [chat["id"] for chat in response.json()] == [chat_id]
+
+            # A page past the end keeps the tag
+            response = self.fast_api_client.post(
+                self.create_url("/tags"), json={"name": "tag1", "skip": 10}
+            )
+            assert response.status_code == 200
+            assert response.json() == []
+        assert Tags.get_tag_by_name_and_user_id("tag1", "2") is not None
+
     def test_get_user_chats(self):
         self.test_get_session_user_chat_list()
 
@@ -166,3 +166,41 @@ def test_users(self):
         assert len(response.json()) == 1
         data = response.json()
         _assert_user(data, "1")
+
+    def test_user_cache(self):
+        from apps.webui.models.users import user_cache
+
+        user_cache.set(self.users.get_user_by_id("2"))
+        assert user_cache.get("2").role == "user"
+
+        # Updating a user through the API drops it from the cache
+        with mock_webui_user(id="3"):
+            response = self.fast_api_client.post(
+                self.create_url("/update/role"), json={"id": "2", "role": "admin"}
+            )
+        assert response.status_code == 200
+        assert user_cache.get("2") is None
+
+        # A user read before an invalidation isn't cached after it
+        version = user_cache.get_version("2")
+        user = self.users.get_user_by_id("2")
+        self.users.update_user_role_by_id("2", "user")
+        user_cache.set(user, version)
+        assert user_cache.get("2") is None
+        user_cache.set(user, user_cache.get_version("2"))
+        assert user_cache.get("2") is not None
+
+        # Last active times are written in batches
+        user = self.users.get_user_by_id("1")
+        user_cache.touch(user)
+        user_cache.flush()
+        assert self.users.get_user_by_id("1").last_active_at >= user.last_active_at
+
+        # Users deleted before the flush don't stop the others being written
+        user_cache.touch(self.users.get_user_by_id("2"))
+        user_cache.touch(self.users.get_user_by_id("1"))
+        assert self.users.delete_user_by_id("2")
+        user_cache.flush()
+        assert user_cache.get_metrics()["pending_last_active"] == 0
+        assert self.users.update_users_last_active_by_ids({"1": 1000, "missing": 1000})
+        assert self.users.get_user_by_id("1").last_active_at == 1000
@@ -0,0 +1,202 @@
+import json
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from starlette.background import BackgroundTask
+from starlette.responses import StreamingResponse
+
+from apps.webui.models.users import UserModel
+from config import SRC_LOG_LEVELS
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["MAIN"])
+
+
+class ChatRequest:
+    """
+    A chat completion request as it goes through the pipeline: the body,
+    parsed once, its model and its authenticated user. Stages modify it in
+    place.
+    """
+
+    def __init__(self, body: dict, model: dict, user: UserModel):
+        self.body = body
+        self.model = model
+        self.user = user
+
+        self.metadata: dict = {}
+        self.extra_params: dict = {}
+        self.contexts: list[str] = []
+        self.citations: list[dict] = []
+        # Sent to the client ahead of the completion stream
+        self.data_items: list[dict] = []
+        self.timings: dict[str, float] = {}
+
+
+Stage = Callable[[ChatRequest], Awaitable[Optional[Any]]]
+
+
+class ActiveRequest:
+    """
+    Marks a request in progress until it is finished, which happens once
+    however many times it's called: when its stream ends, after its response
+    has been sent, or when it's garbage collected because the response never
+    was.
+    """
+
+    def __init__(self, on_finish: Callable[[], None]):
+        self.on_finish = on_finish
+        self.finished = False
+
+    def __call__(self):
+        if not self.finished:
+            self.finished = True
+            self.on_finish()
+
+    def __del__(self):
+        self()
+
+
+class ChatPipeline:
+    """
+    The ordered stages a chat completion request goes through before the
+    provider is called, and the call itself. A stage returning anything but
+    None ends the request with that response. Time spent in each stage is
+    tracked, and so are the requests in progress (until their response has
+    been streamed) for each model owner.
+    """
+
+    def __init__(self):
+        self.stages: list[tuple[str, Stage]] = []
+        self.lock = threading.Lock()
+        self.metrics: dict[str, dict] = {}
+        # owned_by -> requests in progress
+        self.active: dict[str, int] = {}
+
+    def stage(self, name: str) -> Callable[[Stage], Stage]:
+        def decorator(func: Stage) -> Stage:
+            self.stages.append((name, func))
+            return func
+
+        return decorator
+
+    def _record(self, request: ChatRequest, name: str, duration: float):
+        request.timings[name] = duration
+        with self.lock:
+            metrics = self.metrics.setdefault(
+                name, {"count": 0, "total_time": 0.0, "max_time": 0.0}
+            )
+            metrics["count"] += 1
+            metrics["total_time"] += duration
+            metrics["max_time"] = max(metrics["max_time"], duration)
+
+    async def _run_stage(self, request: ChatRequest, name: str, func: Stage):
+        start_time = time.perf_counter()
+        try:
+            return await func(request)
+        finally:
+            self._record(request, name, time.perf_counter() - start_time)
+
+    def _start(self, request: ChatRequest) -> ActiveRequest:
+        owned_by = request.model.get("owned_by")
+        self.active[owned_by] = self.active.get(owned_by, 0) + 1
+
+        # Not under the lock, as it may be called by the garbage collector
+        def finish():
+            self.active[owned_by] = self.active.get(owned_by, 1) - 1
+
+        return ActiveRequest(finish)
+
+    def get_active(self, owned_by: Optional[str] = None) -> int:
+        """
+        Requests in progress for models of `owned_by`, or for any model.
+        """
+        if owned_by is None:
+            return sum(self.active.values())
+        return self.active.get(owned_by, 0)
+
+    async def run(self, request: ChatRequest, completion: Stage) -> Optional[Any]:
+        """
+        Runs every stage on `request`, then `completion` to call the provider,
+        and returns its response.
+        """
+        finish = self._start(request)
+        try:
+            for name, func in [*self.stages, ("completion", completion)]:
+                response = await self._run_stage(request, name, func)
+                if response is not None:
+                    break
+        except BaseException:
+            finish()
+            raise
+
+        log.debug(
+            "chat pipeline timings: "
+            + ", ".join(
+                f"{name}={t * 1000:.1f}ms" for name, t in request.timings.items()
+            )
+        )
+
+        if not isinstance(response, StreamingResponse):
+            finish()
+            return response
+        return self._wrap_stream(response, request, finish)
+
+    def _wrap_stream(
+        self, response: StreamingResponse, request: ChatRequest, finish: ActiveRequest
+    ):
+        content_type = response.headers.get("Content-Type", "")
+        is_openai = "text/event-stream" in content_type
+        is_ollama = "application/x-ndjson" in content_type
+        data_items = request.data_items if is_openai or is_ollama else []
+
+        def wrap_item(item):
+            return f"data: {item}\n\n" if is_openai else f"{item}\n"
+
+        async def stream_wrapper(original_generator):
+            try:
+                for item in data_items:
+                    yield wrap_item(json.dumps(item))
+
+                async for data in original_generator:
+                    yield data
+            finally:
+                finish()
+
+        async def background():
+            # Runs even if the client went away before the stream started
+            try:
+                if response.background is not None:
+                    await response.background()
+            finally:
+                finish()
+
+        return StreamingResponse(
+            stream_wrapper(response.body_iterator),
+            status_code=response.status_code,
+            headers={
+                key: value
+                for key, value in response.headers.items()
+                if key.lower() != "content-length"
+            },
+            background=BackgroundTask(background),
+        )
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            return {
+                "active": dict(self.active),
+                "stages": {
+                    name: {
+                        "count": metrics["count"],
+                        "avg_time": round(metrics["total_time"] / metrics["count"], 4),
+                        "max_time": round(metrics["max_time"], 4),
+                    }
+                    for name, metrics in self.metrics.items()
+                },
+            }
+
+
+chat_pipeline = ChatPipeline()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from typing import Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+from config import (
+    SRC_LOG_LEVELS,
+    AIOHTTP_CLIENT_TIMEOUT,
+    AIOHTTP_CLIENT_POOL_LIMIT,
+    AIOHTTP_CLIENT_KEEPALIVE_TIMEOUT,
+    AIOHTTP_CLIENT_DNS_CACHE_TTL,
+)
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["MAIN"])
+
+
+def get_upstream_key(url: str) -> str:
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+class ClientSessionPool:
+    """
+    Keeps one long-lived aiohttp.ClientSession per upstream (scheme://host:port)
+    so that TCP/TLS connections are reused across requests instead of being
+    re-established for every chat message.
+    """
+
+    def __init__(
+        self,
+        limit: int = AIOHTTP_CLIENT_POOL_LIMIT,
+        keepalive_timeout: float = AIOHTTP_CLIENT_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache: int = AIOHTTP_CLIENT_DNS_CACHE_TTL,
+        timeout: Optional[int] = AIOHTTP_CLIENT_TIMEOUT,
+    ):
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.timeout = timeout
+
+        self.sessions: dict[str, aiohttp.ClientSession] = {}
+        self.metrics: dict[str, dict] = {}
+
+    def _get_trace_config(self, key: str) -> aiohttp.TraceConfig:
+        metrics = self.metrics.setdefault(
+            key,
+            {
+                "requests": 0,
+                "errors": 0,
+                "connections_created": 0,
+                "connections_reused": 0,
+            },
+        )
+
+        async def on_request_start(session, context, params):
+            metrics["requests"] += 1
+
+        async def on_request_exception(session, context, params):
+            metrics["errors"] += 1
+
+        async def on_connection_create_end(session, context, params):
+            metrics["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            metrics["connections_reused"] += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    def get_session(self, url: str) -> aiohttp.ClientSession:
+        key = get_upstream_key(url)
+
+        session = self.sessions.get(key)
+        if session is None or session.closed:
+            log.debug(f"Creating client session for {key}")
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.ttl_dns_cache,
+                use_dns_cache=True,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trust_env=True,
+                trace_configs=[self._get_trace_config(key)],
+            )
+            self.sessions[key] = session
+
+        return session
+
+    def open(self, urls: list[str]):
+        for url in urls:
+            if url:
+                self.get_session(url)
+
+    async def close(self):
+        sessions, self.sessions = self.sessions, {}
+        await asyncio.gather(
+            *[session.close() for session in sessions.values() if not session.closed],
+            return_exceptions=True,
+        )
+
+    def get_metrics(self) -> dict[str, dict]:
+        metrics = {}
+        for key, counters in self.metrics.items():
+            connections = (
+                counters["connections_created"] + counters["connections_reused"]
+            )
+            session = self.sessions.get(key)
+
+            metrics[key] = {
+                **counters,
+                "reuse_rate": (
+                    round(counters["connections_reused"] / connections, 4)
+                    if connections
+                    else 0.0
+                ),
+                "open": session is not None and not session.closed,
+                "limit": self.limit,
+            }
+        return metrics
+
+
+client_pool = ClientSessionPool()
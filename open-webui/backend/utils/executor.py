@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from config import SRC_LOG_LEVELS
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["MAIN"])
+
+
+class MeteredExecutor:
+    """
+    Thread pool for blocking work called from async handlers, so it runs off
+    the event loop. Tracks how many tasks are queued and running and how long
+    they wait for a worker.
+    """
+
+    def __init__(self, max_workers: int, name: str):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self.lock = threading.Lock()
+
+        self.queued = 0
+        self.running = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queued = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _run(self, submitted_at: float, func: Callable, *args, **kwargs) -> Any:
+        wait_time = time.monotonic() - submitted_at
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+            self.started += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+        return result
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        with self.lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+        future = self.executor.submit(
+            functools.partial(self._run, time.monotonic(), func, *args, **kwargs)
+        )
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Cancelled before a worker picked it up, so it never left the queue
+            if future.cancelled():
+                with self.lock:
+                    self.queued -= 1
+            raise
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "max_queued": self.max_queued,
+                "avg_wait_time": (
+                    round(self.total_wait_time / self.started, 4)
+                    if self.started
+                    else 0.0
+                ),
+                "max_wait_time": round(self.max_wait_time, 4),
+            }
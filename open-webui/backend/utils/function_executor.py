@@ -0,0 +1,148 @@
+import asyncio
+import inspect
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Iterator
+
+from utils.executor import MeteredExecutor
+from config import (
+    SRC_LOG_LEVELS,
+    FUNCTIONS_MAX_WORKERS,
+    FUNCTIONS_MAX_CONCURRENCY,
+    FUNCTIONS_TIMEOUT,
+)
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["MAIN"])
+
+
+class FunctionTimeoutError(Exception):
+    def __init__(self, function_id: str, timeout: float):
+        super().__init__(f"Function {function_id} timed out after {timeout}s")
+        self.function_id = function_id
+        self.timeout = timeout
+
+
+# Marks the end of a generator iterated on the executor, StopIteration can't
+# be raised through a future
+_STOP = object()
+
+
+def _next(iterator: Iterator) -> Any:
+    return next(iterator, _STOP)
+
+
+class FunctionExecutor:
+    """
+    Runs the synchronous code of user-installed functions and tools (pipes,
+    filters, actions and tool calls) on a bounded thread pool, so a slow
+    function can't block the event loop for every other request.
+
+    Each function may occupy at most `max_concurrency` workers, calls are
+    given up on after `timeout` seconds, and the CPU time of each function's
+    calls is tracked. Running threads can't be interrupted: a timed out call
+    keeps its slot until it actually returns.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = FUNCTIONS_MAX_WORKERS,
+        max_concurrency: int = FUNCTIONS_MAX_CONCURRENCY,
+        timeout: float = FUNCTIONS_TIMEOUT,
+    ):
+        self.executor = MeteredExecutor(max_workers, "functions")
+        self.max_concurrency = max(max_concurrency, 1)
+        self.timeout = timeout
+
+        self.semaphores: dict[str, asyncio.Semaphore] = {}
+        self.stats: dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def _get_stats(self, function_id: str) -> dict:
+        return self.stats.setdefault(
+            function_id,
+            {"calls": 0, "errors": 0, "timeouts": 0, "cpu_time": 0.0, "wall_time": 0.0},
+        )
+
+    def _call(self, function_id: str, func: Callable, args, kwargs) -> Any:
+        start_cpu_time = time.thread_time()
+        start_time = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            with self.lock:
+                self._get_stats(function_id)["errors"] += 1
+            raise
+        finally:
+            with self.lock:
+                stats = self._get_stats(function_id)
+                stats["calls"] += 1
+                stats["cpu_time"] += time.thread_time() - start_cpu_time
+                stats["wall_time"] += time.monotonic() - start_time
+
+    async def run(self, function_id: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        Calls `func` and returns its result. Coroutine and async generator
+        functions are called on the event loop, anything else on the pool.
+        """
+        if inspect.iscoroutinefunction(func):
+            return await func(*args, **kwargs)
+        if inspect.isasyncgenfunction(func):
+            return func(*args, **kwargs)
+
+        semaphore = self.semaphores.setdefault(
+            function_id, asyncio.Semaphore(self.max_concurrency)
+        )
+        await semaphore.acquire()
+
+        task = asyncio.ensure_future(
+            self.executor.run(self._call, function_id, func, args, kwargs)
+        )
+        # Released once the thread is done, not when the caller stops waiting
+        task.add_done_callback(lambda _: semaphore.release())
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout or None)
+        except asyncio.TimeoutError:
+            with self.lock:
+                self._get_stats(function_id)["timeouts"] += 1
+            log.warning(f"Function {function_id} timed out after {self.timeout}s")
+            raise FunctionTimeoutError(function_id, self.timeout)
+
+    async def iterate(self, function_id: str, iterator: Iterator) -> AsyncIterator:
+        """
+        Iterates a synchronous generator or iterator returned by a function,
+        producing each item on the pool.
+        """
+        try:
+            while (item := await self.run(function_id, _next, iterator)) is not _STOP:
+                yield item
+        finally:
+            if hasattr(iterator, "close"):
+                try:
+                    await self.run(function_id, iterator.close)
+                except Exception as e:
+                    log.debug(f"Error closing {function_id} generator: {e}")
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            functions = {
+                function_id: {
+                    **stats,
+                    "cpu_time": round(stats["cpu_time"], 4),
+                    "wall_time": round(stats["wall_time"], 4),
+                }
+                for function_id, stats in self.stats.items()
+            }
+        return {
+            "executor": self.executor.get_metrics(),
+            "max_concurrency": self.max_concurrency,
+            "timeout": self.timeout,
+            "functions": functions,
+        }
+
+
+function_executor = FunctionExecutor()
@@ -0,0 +1,222 @@
+import inspect
+import logging
+from typing import Any, Optional
+
+from apps.webui.models.functions import Functions, FunctionModel
+from apps.webui.models.tools import Tools
+from apps.webui.models.users import UserModel
+from apps.webui.utils import load_function_module_by_id, load_toolkit_module_by_id
+from utils.schemas import json_schema_to_model
+from config import SRC_LOG_LEVELS
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["MAIN"])
+
+
+def get_user_valves_data(user: Optional[UserModel], kind: str, id: str) -> dict:
+    """
+    Valves `user` has set for the function or toolkit `id`, where `kind` is
+    "functions" or "tools".
+    """
+    if user is None or user.settings is None:
+        return {}
+    settings = getattr(user.settings, kind, None) or {}
+    return (settings.get("valves") or {}).get(id) or {}
+
+
+class FunctionPlan:
+    """
+    A loaded function or toolkit module with its valves applied, and the
+    parameters each of its methods takes, so that calling it doesn't need
+    any database queries or reflection.
+    """
+
+    def __init__(self, id: str, kind: str, module, valves: Optional[dict]):
+        self.id = id
+        self.kind = kind
+        self.module = module
+
+        if hasattr(module, "valves") and hasattr(module, "Valves"):
+            module.valves = module.Valves(**(valves if valves else {}))
+
+        self.parameters: dict[str, frozenset[str]] = {}
+        # user id -> (valves data, validated UserValves)
+        self.user_valves: dict[str, tuple[dict, Any]] = {}
+
+    def get_parameters(self, name: str) -> frozenset[str]:
+        if name not in self.parameters:
+            function = getattr(self.module, name)
+            self.parameters[name] = frozenset(inspect.signature(function).parameters)
+        return self.parameters[name]
+
+    def get_params(self, name: str, params: dict) -> dict:
+        """
+        The entries of `params` the method `name` takes.
+        """
+        parameters = self.get_parameters(name)
+        return {key: value for key, value in params.items() if key in parameters}
+
+    def get_user_valves(self, user: Optional[UserModel]) -> Optional[Any]:
+        if user is None or not hasattr(self.module, "UserValves"):
+            return None
+
+        data = get_user_valves_data(user, self.kind, self.id)
+        cached = self.user_valves.get(user.id)
+        if cached is not None and cached[0] == data:
+            return cached[1]
+
+        try:
+            user_valves = self.module.UserValves(**data)
+        except Exception as e:
+            print(e)
+            return None
+        self.user_valves[user.id] = (data, user_valves)
+        return user_valves
+
+    def get_user(self, name: str, __user__: dict, user: Optional[UserModel]) -> dict:
+        """
+        A copy of `__user__` with this module's user valves, if `name` takes them.
+        """
+        __user__ = {**__user__}
+        if "__user__" in self.get_parameters(name):
+            user_valves = self.get_user_valves(user)
+            if user_valves is not None:
+                __user__["valves"] = user_valves
+        return __user__
+
+
+class ToolkitPlan(FunctionPlan):
+    def __init__(self, id: str, module, valves: Optional[dict], specs: list[dict]):
+        super().__init__(id, "tools", module, valves)
+
+        self.specs = []
+        self.models = {}
+        for spec in specs:
+            # TODO: Fix hack for OpenAI API
+            for val in spec.get("parameters", {}).get("properties", {}).values():
+                if val["type"] == "str":
+                    val["type"] = "string"
+            self.specs.append(spec)
+            self.models[spec["name"]] = json_schema_to_model(spec)
+
+
+class FunctionPlanCache:
+    """
+    Plans for calling functions and toolkits, and the resolved order of the
+    filters of each model, built once and reused by every chat request.
+
+    Everything is dropped by `invalidate()`, which the functions and tools
+    routers call whenever they change a function, toolkit or their valves.
+    User valves are revalidated only when the user's settings change.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.functions: dict[str, FunctionPlan] = {}
+        self.toolkits: dict[str, ToolkitPlan] = {}
+        # Enabled filter functions, loaded once per version
+        self.filters: Optional[dict[str, FunctionModel]] = None
+        # model id and filter ids -> ordered filter ids
+        self.filter_ids: dict[tuple, list[str]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        log.debug("Function plans invalidated")
+        self.version += 1
+        self.functions = {}
+        self.toolkits = {}
+        self.filters = None
+        self.filter_ids = {}
+
+    def get_function(self, webui_app, id: str) -> FunctionPlan:
+        plan = self.functions.get(id)
+        if plan is not None:
+            self.hits += 1
+            return plan
+
+        self.misses += 1
+        version = self.version
+        if id in webui_app.state.FUNCTIONS:
+            function_module = webui_app.state.FUNCTIONS[id]
+        else:
+            function_module, _, _ = load_function_module_by_id(id)
+            webui_app.state.FUNCTIONS[id] = function_module
+
+        plan = FunctionPlan(
+            id, "functions", function_module, Functions.get_function_valves_by_id(id)
+        )
+        if version == self.version:
+            self.functions[id] = plan
+        return plan
+
+    def get_toolkit(self, webui_app, id: str) -> Optional[ToolkitPlan]:
+        plan = self.toolkits.get(id)
+        if plan is not None:
+            self.hits += 1
+            return plan
+
+        self.misses += 1
+        version = self.version
+        toolkit = Tools.get_tool_by_id(id)
+        if toolkit is None:
+            return None
+
+        module = webui_app.state.TOOLS.get(id, None)
+        if module is None:
+            module, _ = load_toolkit_module_by_id(id)
+            webui_app.state.TOOLS[id] = module
+
+        plan = ToolkitPlan(
+            id, module, Tools.get_tool_valves_by_id(id) or {}, toolkit.specs
+        )
+        if version == self.version:
+            self.toolkits[id] = plan
+        return plan
+
+    def get_filter_ids(self, model: dict) -> list[str]:
+        model_filter_ids = []
+        if "info" in model and "meta" in model["info"]:
+            model_filter_ids = model["info"]["meta"].get("filterIds", [])
+        key = (model.get("id"), tuple(model_filter_ids))
+
+        if key in self.filter_ids:
+            self.hits += 1
+            return self.filter_ids[key]
+
+        self.misses += 1
+        version = self.version
+        if self.filters is None:
+            self.filters = {
+                function.id: function
+                for function in Functions.get_functions_by_type(
+                    "filter", active_only=True
+                )
+            }
+
+        filter_ids = {id for id, function in self.filters.items() if function.is_global}
+        filter_ids.update(id for id in model_filter_ids if id in self.filters)
+
+        def get_priority(function_id):
+            # TODO: Fix FunctionModel
+            valves = self.filters[function_id].valves
+            return (valves if valves else {}).get("priority", 0)
+
+        filter_ids = sorted(filter_ids, key=lambda id: (get_priority(id), id))
+        if version == self.version:
+            self.filter_ids[key] = filter_ids
+        return filter_ids
+
+    def get_metrics(self) -> dict:
+        return {
+            "version": self.version,
+            "functions": len(self.functions),
+            "toolkits": len(self.toolkits),
+            "models": len(self.filter_ids),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+function_plans = FunctionPlanCache()
@@ -218,6 +218,17 @@ def calculate_sha256(file):
     return sha256.hexdigest()
 
 
+def copy_file_and_calculate_sha256(src, dst, chunk_size: int = 1024 * 1024):
+    # Hash while copying so large uploads are read only once and never held in memory
+    sha256 = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: src.read(chunk_size), b""):
+        sha256.update(chunk)
+        dst.write(chunk)
+        size += len(chunk)
+    return sha256.hexdigest(), size
+
+
 def calculate_sha256_string(string):
     # Create a new SHA-256 hash object
     sha256_hash = hashlib.sha256()
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from config import SRC_LOG_LEVELS, MODELS_CACHE_TTL
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["MODELS"])
+
+
+class ModelRegistry:
+    """
+    Caches the merged model list built by the main app.
+
+    Fresh entries are served directly. Once `ttl` seconds have passed the
+    cached list is still served while a single background refresh runs
+    (stale-while-revalidate). `invalidate()` drops the cache so the next
+    caller waits for a rebuild; it is called whenever models, functions or
+    backend URLs are changed.
+    """
+
+    def __init__(self, ttl: int = MODELS_CACHE_TTL):
+        self.ttl = ttl
+        self.loader: Optional[Callable[[], Awaitable[list[dict]]]] = None
+
+        self.models: Optional[list[dict]] = None
+        self.updated_at = 0.0
+        self.version = 0
+        self.refresh_task: Optional[asyncio.Task] = None
+        # Version the refresh task was started for
+        self.refresh_version: Optional[int] = None
+
+    def set_loader(self, loader: Callable[[], Awaitable[list[dict]]]):
+        self.loader = loader
+
+    def invalidate(self):
+        log.debug("Model registry invalidated")
+        self.version += 1
+        self.models = None
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.updated_at > self.ttl
+
+    async def _refresh(self, version: int) -> list[dict]:
+        models = await self.loader()
+
+        # Don't cache a result that was invalidated while it was being built
+        if version == self.version:
+            self.models = models
+            self.updated_at = time.monotonic()
+        return models
+
+    def _on_refresh_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f"Error refreshing models: {task.exception()}")
+
+    def _get_refresh_task(self) -> asyncio.Task:
+        # Single-flight: concurrent callers share the same refresh, unless it
+        # was started before an invalidation and would return stale models
+        if (
+            self.refresh_task is None
+            or self.refresh_task.done()
+            or self.refresh_version != self.version
+        ):
+            self.refresh_version = self.version
+            self.refresh_task = asyncio.create_task(self._refresh(self.version))
+            self.refresh_task.add_done_callback(self._on_refresh_done)
+        return self.refresh_task
+
+    async def get_models(self, force: bool = False) -> list[dict]:
+        if self.models is None or force:
+            return await asyncio.shield(self._get_refresh_task())
+
+        if self.is_stale():
+            self._get_refresh_task()
+        return self.models
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import aiohttp
+
+from utils.client_pool import client_pool
+from config import (
+    SRC_LOG_LEVELS,
+    PIPELINE_FILTER_TIMEOUT,
+    PIPELINE_FILTER_FAILURE_THRESHOLD,
+    PIPELINE_FILTER_RESET_TIMEOUT,
+)
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["MAIN"])
+
+
+class PipelineFilterError(Exception):
+    """
+    Raised when a filter rejects a request with a `detail` message. `args` is
+    (status_code, detail) and `content` is the full response body.
+    """
+
+    def __init__(self, status_code: int, detail, content: Optional[dict] = None):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.content = content if content is not None else {"detail": detail}
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures: dict[str, int] = {}
+        self.open_until: dict[str, float] = {}
+
+    def is_open(self, key: str) -> bool:
+        return self.open_until.get(key, 0.0) > time.monotonic()
+
+    def record_success(self, key: str):
+        self.failures.pop(key, None)
+
+    def record_failure(self, key: str):
+        self.failures[key] = self.failures.get(key, 0) + 1
+        if self.failures[key] >= self.failure_threshold:
+            log.warning(
+                f"Pipeline filter {key} failed {self.failures[key]} times in a row, skipping it for {self.reset_timeout}s"
+            )
+            self.open_until[key] = time.monotonic() + self.reset_timeout
+            # Half-open: a single failure after the break opens it again
+            self.failures[key] = self.failure_threshold - 1
+
+    def get_metrics(self) -> dict:
+        return {
+            key: {"consecutive_failures": failures, "open": self.is_open(key)}
+            for key, failures in self.failures.items()
+        }
+
+
+class PipelineFilterClient:
+    """
+    Calls pipeline inlet/outlet filters over the shared client pool.
+
+    Each call has a timeout (PIPELINE_FILTER_TIMEOUT, or `timeout` in the
+    filter's pipeline manifest). A filter that keeps failing to respond is
+    skipped for a while instead of adding its timeout to every request.
+
+    Outlet filters that set `order_insensitive` in their pipeline manifest
+    are treated as observers: consecutive ones run concurrently on the same
+    body and their responses don't modify it.
+    """
+
+    def __init__(
+        self,
+        timeout: float = PIPELINE_FILTER_TIMEOUT,
+        failure_threshold: int = PIPELINE_FILTER_FAILURE_THRESHOLD,
+        reset_timeout: float = PIPELINE_FILTER_RESET_TIMEOUT,
+    ):
+        self.timeout = timeout
+        self.circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def _get_timeout(self, filter: dict) -> float:
+        return filter.get("pipeline", {}).get("timeout") or self.timeout
+
+    async def _post(
+        self,
+        filter: dict,
+        direction: str,
+        url: str,
+        key: str,
+        user: dict,
+        body: dict,
+    ) -> Optional[dict]:
+        breaker_key = f"{url}/{filter['id']}"
+        if self.circuit_breaker.is_open(breaker_key):
+            log.debug(f"Skipping pipeline filter {breaker_key}, circuit is open")
+            return None
+
+        try:
+            session = client_pool.get_session(url)
+            async with session.post(
+                f"{url}/{filter['id']}/filter/{direction}",
+                headers={"Authorization": f"Bearer {key}"},
+                json={"user": user, "body": body},
+                timeout=aiohttp.ClientTimeout(total=self._get_timeout(filter)),
+            ) as r:
+                try:
+                    res = await r.json(content_type=None)
+                except Exception:
+                    res = None
+
+                if r.status >= 400:
+                    if isinstance(res, dict) and "detail" in res:
+                        # The filter answered and rejected the request
+                        self.circuit_breaker.record_success(breaker_key)
+                        raise PipelineFilterError(r.status, res["detail"], res)
+                    r.raise_for_status()
+
+                self.circuit_breaker.record_success(breaker_key)
+                return res
+        except PipelineFilterError:
+            raise
+        except Exception as e:
+            # Handle connection error here
+            log.error(f"Connection error calling pipeline filter {breaker_key}: {e!r}")
+            self.circuit_breaker.record_failure(breaker_key)
+            return None
+
+    def _get_url_and_key(
+        self, filter: dict, urls: list[str], keys: list[str]
+    ) -> tuple[Optional[str], Optional[str]]:
+        try:
+            url_idx = filter["urlIdx"]
+            return urls[url_idx], keys[url_idx]
+        except Exception as e:
+            log.error(f"Unable to resolve pipeline filter url: {e}")
+            return None, None
+
+    async def inlet(
+        self,
+        filters: list[dict],
+        urls: list[str],
+        keys: list[str],
+        user: dict,
+        body: dict,
+    ) -> dict:
+        for filter in filters:
+            url, key = self._get_url_and_key(filter, urls, keys)
+            if not url or not key:
+                continue
+
+            res = await self._post(filter, "inlet", url, key, user, body)
+            if res is not None:
+                body = res
+        return body
+
+    async def outlet(
+        self,
+        filters: list[dict],
+        urls: list[str],
+        keys: list[str],
+        user: dict,
+        body: dict,
+    ) -> dict:
+        observers = []
+
+        async def flush(body: dict):
+            if not observers:
+                return
+            calls, observers[:] = list(observers), []
+            results = await asyncio.gather(
+                *[
+                    self._post(filter, "outlet", url, key, user, body)
+                    for filter, url, key in calls
+                ],
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+
+        for filter in filters:
+            url, key = self._get_url_and_key(filter, urls, keys)
+            if not url or not key:
+                continue
+
+            if filter.get("pipeline", {}).get("order_insensitive", False):
+                observers.append((filter, url, key))
+                continue
+
+            await flush(body)
+            res = await self._post(filter, "outlet", url, key, user, body)
+            if res is not None:
+                body = res
+
+        await flush(body)
+        return body
+
+    def get_metrics(self) -> dict:
+        return {
+            "timeout": self.timeout,
+            "filters": self.circuit_breaker.get_metrics(),
+        }
+
+
+pipeline_filter_client = PipelineFilterClient()
@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+from constants import TASKS
+from utils.chat_pipeline import chat_pipeline
+from config import (
+    SRC_LOG_LEVELS,
+    TASK_CACHE_TTL,
+    TASK_CACHE_MAX_SIZE,
+    TASK_MAX_CONCURRENCY,
+    TASK_MAX_DEFER,
+)
+
+log = logging.getLogger(__name__)
+log.setLevel(SRC_LOG_LEVELS["MAIN"])
+
+
+def get_task_key(payload: dict) -> str:
+    """
+    Hash of the task, model, prompt (with its whitespace normalized) and
+    generation parameters of a task completion payload.
+    """
+    key = {
+        k: v
+        for k, v in payload.items()
+        if k not in ["metadata", "chat_id", "stream", "messages"]
+    }
+    key["task"] = (payload.get("metadata") or {}).get("task")
+    key["messages"] = [
+        {
+            **message,
+            "content": (
+                " ".join(message["content"].split())
+                if isinstance(message.get("content"), str)
+                else message.get("content")
+            ),
+        }
+        for message in payload.get("messages", [])
+    ]
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class TaskRunner:
+    """
+    Runs background task completions (titles, search queries, emojis, MoA
+    responses).
+
+    Non-streaming results are cached for `ttl` seconds, keyed by
+    `get_task_key`, and identical requests in flight share one call.
+
+    Tasks nobody is waiting on (titles and emojis) run in a low-priority
+    lane, so that they don't compete with chat completions for the backend:
+    each waits (up to `max_defer` seconds) until no chat completion is in
+    progress for models of the same owner, then for one of `max_concurrency`
+    slots. Search queries and MoA responses are on the way to an answer and
+    run straight away.
+    """
+
+    POLL_INTERVAL = 0.2
+    LOW_PRIORITY_TASKS = [str(TASKS.TITLE_GENERATION), str(TASKS.EMOJI_GENERATION)]
+
+    def __init__(
+        self,
+        ttl: int = TASK_CACHE_TTL,
+        max_size: int = TASK_CACHE_MAX_SIZE,
+        max_concurrency: int = TASK_MAX_CONCURRENCY,
+        max_defer: float = TASK_MAX_DEFER,
+        get_active: Callable[[Optional[str]], int] = chat_pipeline.get_active,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_defer = max_defer
+        self.get_active = get_active
+        self.semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+
+        # key -> (expiry time, result), least recently used first
+        self.cache: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.inflight: dict[str, asyncio.Future] = {}
+
+        self.running = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.deferred = 0
+
+    def _get_cached(self, key: str) -> Optional[Any]:
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self.cache[key]
+            return None
+
+        self.cache.move_to_end(key)
+        return result
+
+    def _set_cached(self, key: str, result: Any):
+        if self.ttl <= 0 or not isinstance(result, dict):
+            return
+
+        self.cache[key] = (time.monotonic() + self.ttl, result)
+        self.cache.move_to_end(key)
+        while len(self.cache) > max(self.max_size, 1):
+            self.cache.popitem(last=False)
+
+    async def _defer(self, owned_by: Optional[str]):
+        if self.get_active(owned_by) > 0:
+            self.deferred += 1
+            deadline = time.monotonic() + self.max_defer
+            while self.get_active(owned_by) > 0 and time.monotonic() < deadline:
+                await asyncio.sleep(self.POLL_INTERVAL)
+
+    async def _run(self, payload: dict, call: Callable[[dict], Awaitable]):
+        self.running += 1
+        try:
+            return await call(payload)
+        finally:
+            self.running -= 1
+
+    async def _call(
+        self, payload: dict, call: Callable[[dict], Awaitable], owned_by: Optional[str]
+    ):
+        task = (payload.get("metadata") or {}).get("task")
+        if task not in self.LOW_PRIORITY_TASKS:
+            return await self._run(payload, call)
+
+        # Waiting outside the semaphore, so that tasks for other owners
+        # aren't held up behind it
+        await self._defer(owned_by)
+        async with self.semaphore:
+            return await self._run(payload, call)
+
+    def _done(self, key: str, future: asyncio.Future):
+        self.inflight.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self._set_cached(key, future.result())
+
+    async def run(
+        self,
+        payload: dict,
+        call: Callable[[dict], Awaitable],
+        owned_by: Optional[str] = None,
+    ):
+        """
+        Returns the result of `call(payload)`, from the cache or a call in
+        flight if possible. `owned_by` is the owner of the payload's model.
+        """
+        if payload.get("stream", False):
+            return await self._call(payload, call, owned_by)
+
+        key = get_task_key(payload)
+        result = self._get_cached(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        future = self.inflight.get(key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._call(payload, call, owned_by))
+            self.inflight[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        else:
+            self.coalesced += 1
+
+        # Shielded so that the call goes on for the others if a client leaves
+        return await asyncio.shield(future)
+
+    def get_metrics(self) -> dict:
+        return {
+            "cached": len(self.cache),
+            "inflight": len(self.inflight),
+            "running": self.running,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "deferred": self.deferred,
+        }
+
+
+task_runner = TaskRunner()
@@ -2,68 +2,52 @@
 import logging
 from typing import Awaitable, Callable, get_type_hints
 
-from apps.webui.models.tools import Tools
 from apps.webui.models.users import UserModel
-from apps.webui.utils import load_toolkit_module_by_id
 
-from utils.schemas import json_schema_to_model
+from utils.function_executor import function_executor
+from utils.function_plans import function_plans
 
 log = logging.getLogger(__name__)
 
 
 def apply_extra_params_to_tool_function(
-    function: Callable, extra_params: dict
+    function: Callable, extra_params: dict, tool_id: str
 ) -> Callable[..., Awaitable]:
-    sig = inspect.signature(function)
-    extra_params = {
-        key: value for key, value in extra_params.items() if key in sig.parameters
-    }
-    is_coroutine = inspect.iscoroutinefunction(function)
+    """
+    Wraps `function` to be called with only the model's parameters, adding
+    `extra_params` (which should only hold parameters the function takes).
+    """
 
     async def new_function(**kwargs):
         extra_kwargs = kwargs | extra_params
-        if is_coroutine:
-            return await function(**extra_kwargs)
-        return function(**extra_kwargs)
+        return await function_executor.run(tool_id, function, **extra_kwargs)
 
     return new_function
 
 
-# Mutation on extra_params
 def get_tools(
     webui_app, tool_ids: list[str], user: UserModel, extra_params: dict
 ) -> dict[str, dict]:
     tools = {}
     for tool_id in tool_ids:
-        toolkit = Tools.get_tool_by_id(tool_id)
-        if toolkit is None:
+        plan = function_plans.get_toolkit(webui_app, tool_id)
+        if plan is None:
             continue
 
-        module = webui_app.state.TOOLS.get(tool_id, None)
-        if module is None:
-            module, _ = load_toolkit_module_by_id(tool_id)
-            webui_app.state.TOOLS[tool_id] = module
-
-        extra_params["__id__"] = tool_id
-        if hasattr(module, "valves") and hasattr(module, "Valves"):
-            valves = Tools.get_tool_valves_by_id(tool_id) or {}
-            module.valves = module.Valves(**valves)
-
-        if hasattr(module, "UserValves"):
-            extra_params["__user__"]["valves"] = module.UserValves(  # type: ignore
-                **Tools.get_user_valves_by_id_and_user_id(tool_id, user.id)
-            )
-
-        for spec in toolkit.specs:
-            # TODO: Fix hack for OpenAI API
-            for val in spec.get("parameters", {}).get("properties", {}).values():
-                if val["type"] == "str":
-                    val["type"] = "string"
+        module = plan.module
+        for spec in plan.specs:
             function_name = spec["name"]
 
             # convert to function that takes only model params and inserts custom params
             original_func = getattr(module, function_name)
-            callable = apply_extra_params_to_tool_function(original_func, extra_params)
+            function_params = {**extra_params, "__id__": tool_id}
+            if "__user__" in extra_params:
+                function_params["__user__"] = plan.get_user(
+                    function_name, extra_params["__user__"], user
+                )
+            callable = apply_extra_params_to_tool_function(
+                original_func, plan.get_params(function_name, function_params), tool_id
+            )
             if hasattr(original_func, "__doc__"):
                 callable.__doc__ = original_func.__doc__
 
@@ -72,7 +56,7 @@ def get_tools(
                 "toolkit_id": tool_id,
                 "callable": callable,
                 "spec": spec,
-                "pydantic_model": json_schema_to_model(spec),
+                "pydantic_model": plan.models[function_name],
                 "file_handler": hasattr(module, "file_handler") and module.file_handler,
                 "citation": hasattr(module, "citation") and module.citation,
             }
@@ -80,8 +64,10 @@ def get_tools(
             # TODO: if collision, prepend toolkit name
             if function_name in tools:
                 log.warning(f"Tool {function_name} already exists in another toolkit!")
-                log.warning(f"Collision between {toolkit} and {tool_id}.")
-                log.warning(f"Discarding {toolkit}.{function_name}")
+                log.warning(
+                    f"Collision between {tool_id} and {tools[function_name]['toolkit_id']}."
+                )
+                log.warning(f"Discarding {tool_id}.{function_name}")
             else:
                 tools[function_name] = tool_dict
     return tools
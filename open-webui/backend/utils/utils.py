@@ -1,7 +1,7 @@
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import HTTPException, status, Depends, Request
 
-from apps.webui.models.users import Users
+from apps.webui.models.users import Users, user_cache
 
 from typing import Union, Optional
 from constants import ERROR_MESSAGES
@@ -94,14 +94,18 @@ def get_current_user(
     # auth by jwt token
     data = decode_token(token)
     if data is not None and "id" in data:
-        user = Users.get_user_by_id(data["id"])
+        user = user_cache.get(data["id"])
         if user is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail=ERROR_MESSAGES.INVALID_TOKEN,
-            )
-        else:
-            Users.update_user_last_active_by_id(user.id)
+            version = user_cache.get_version(data["id"])
+            user = Users.get_user_by_id(data["id"])
+            if user is None:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail=ERROR_MESSAGES.INVALID_TOKEN,
+                )
+            user_cache.set(user, version)
+
+        user_cache.touch(user)
         return user
     else:
         raise HTTPException(
@@ -111,16 +115,19 @@ def get_current_user(
 
 
 def get_current_user_by_api_key(api_key: str):
-    user = Users.get_user_by_api_key(api_key)
-
+    user = user_cache.get_by_api_key(api_key)
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=ERROR_MESSAGES.INVALID_TOKEN,
-        )
-    else:
-        Users.update_user_last_active_by_id(user.id)
+        version = user_cache.get_version()
+        user = Users.get_user_by_api_key(api_key)
+
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=ERROR_MESSAGES.INVALID_TOKEN,
+            )
+        user_cache.set(user, version)
 
+    user_cache.touch(user)
     return user
 
 